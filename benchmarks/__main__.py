@@ -0,0 +1,45 @@
+"""
+Roda todos os benchmarks com os parâmetros padrão de cada um.
+
+    python -m benchmarks            # todos
+    python -m benchmarks fanout     # só os listados
+"""
+
+import subprocess
+import sys
+
+SUITE = [
+    "history_pagination",
+    "inbox",
+    "dm_throughput",
+    "wire_protocol",
+    "fanout",
+    "sqlite_concurrency",
+    "message_search",
+    "user_search",
+    "presence",
+    "reconnect",
+    "room_page",
+    "archive",
+    "export",
+    "rate_limit",
+    "multiplex",
+    "auth_handshake",
+    "metrics",
+    "tracing",
+    "db_executor",
+]
+
+
+def main():
+    names = sys.argv[1:] or SUITE
+    for name in names:
+        if name not in SUITE:
+            sys.exit(f"Benchmark desconhecido: {name}. Disponíveis: {', '.join(SUITE)}")
+        print(f"# {name}", flush=True)
+        # Cada benchmark roda num processo próprio para não dividir estado global
+        subprocess.run([sys.executable, "-m", f"benchmarks.{name}"], check=True)
+
+
+if __name__ == "__main__":
+    main()
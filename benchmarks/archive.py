@@ -0,0 +1,128 @@
+"""
+Benchmark do arquivo de mensagens (chat/retention.py).
+
+    python -m benchmarks.archive --messages 100000 --days 90 --retention 30 --chunk 1000
+
+Uma sala com 'messages' mensagens espalhadas pelos últimos 'days' dias e
+retention_days = 'retention' é arquivada enquanto outra thread grava uma mensagem
+a cada 5 ms em outra sala. Relata:
+    -> archive: mensagens movidas por segundo e tabelas mensais criadas
+    -> concurrent_writes: latência dos INSERTs feitos durante o arquivamento
+       (mostra se algum lote segurou o lock de escrita por muito tempo)
+    -> history: latência de room_history para a página mais recente (chat_message),
+       a página que atravessa a fronteira e uma página inteira do arquivo
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import timedelta
+
+from benchmarks.common import measure, setup_database, summarize
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+from chat import retention
+from chat.models import Message, Room
+from chat.pagination import room_history
+
+
+def prepare(messages, days, retention_days):
+    user = User.objects.get_or_create(username="bench_archive")[0]
+    room = Room.objects.get_or_create(name="bench_archive")[0]
+    writes = Room.objects.get_or_create(name="bench_archive_writes")[0]
+    room.retention_days = retention_days
+    room.save()
+
+    # Começa do zero: o arquivamento consome o histórico
+    Message.objects.filter(room=room).delete()
+    with connection.cursor() as cursor:
+        for name in retention.list_partitions():
+            cursor.execute(f"DELETE FROM {name} WHERE room_id = %s", [room.id])
+
+    # Mensagens espalhadas pelos 'days' dias
+    step = days * 86400 / messages
+    start = timezone.now() - timedelta(days=days)
+    Message.objects.bulk_create(
+        [
+            Message(
+                room=room,
+                user=user,
+                content=f"mensagem {n}",
+                timestamp=start + timedelta(seconds=(n + 1) * step),
+            )
+            for n in range(messages)
+        ],
+        batch_size=1000,
+    )
+    return user, room, writes
+
+
+def write_loop(user, room, stop, samples):
+    while not stop.is_set():
+        started = time.perf_counter()
+        Message.objects.create(room=room, user=user, content="gravação concorrente")
+        samples.append((time.perf_counter() - started) * 1000)
+        time.sleep(0.005)
+    connection.close()
+
+
+def history_pages(room, limit):
+    """Cursores 'before' das páginas: a mais recente, a da fronteira e uma do arquivo."""
+    oldest_hot = Message.objects.filter(room=room).order_by("timestamp", "id").first()
+    newest_archived = retention.archived_page(retention.room_scope(room.id), limit=limit + 1)
+    return {
+        "hot": None,
+        "boundary": Message.objects.filter(room=room)
+        .order_by("timestamp", "id")[limit // 2]
+        .id,
+        "archived": newest_archived[0].id if newest_archived else oldest_hot.id,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--retention", type=int, default=30)
+    parser.add_argument("--chunk", type=int, default=1000)
+    parser.add_argument("--pause-ms", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_database()
+    user, room, writes = prepare(args.messages, args.days, args.retention)
+    partitions = set(retention.list_partitions())
+
+    archiver = retention.Archiver(chunk=args.chunk, pause_ms=args.pause_ms)
+    (_, queryset), = archiver.scopes(room_ids=[room.id])
+    stop, write_samples = threading.Event(), []
+    writer = threading.Thread(target=write_loop, args=(user, writes, stop, write_samples))
+    writer.start()
+    started = time.perf_counter()
+    moved = archiver.archive(queryset)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    writer.join()
+
+    print(json.dumps({
+        "archive": {
+            "moved": moved,
+            "seconds": round(elapsed, 3),
+            "rows_per_s": round(moved / elapsed),
+            "chunk": args.chunk,
+            "pause_ms": args.pause_ms,
+            "new_partitions": len(set(retention.list_partitions()) - partitions),
+        },
+        "concurrent_writes": {"writes": len(write_samples), **summarize(write_samples)},
+    }))
+
+    for name, before in history_pages(room, args.limit).items():
+        page = room_history(room, before=before, limit=args.limit)
+        samples = measure(lambda: room_history(room, before=before, limit=args.limit), repeat=100)
+        print(json.dumps({"history": name, "rows": len(page), **summarize(samples)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Benchmark da autenticação dos WebSockets (chat/auth.py) numa onda de reconexões.
+
+    python -m benchmarks.auth_handshake --clients 10000
+
+'clients' usuários, cada um com a própria sessão, abrem o socket das mensagens
+diretas ao mesmo tempo (em levas de CHUNK handshakes simultâneos) pela pilha
+completa: cookies, sessão, autenticação, roteamento e consumer. Cenários:
+    -> channels: AuthMiddlewareStack (sessão e usuário lidos do banco a cada socket)
+    -> cached_cold: CachedAuthMiddlewareStack logo depois de um deploy (cache vazio:
+       os misses simultâneos são lidos em lote)
+    -> cached_warm: os mesmos clientes reconectando ao mesmo worker (cache quente)
+    -> signed_cold: cache vazio com SESSION_ENGINE "signed_cookies" (só o usuário
+       vem do banco)
+Cada cenário roda num processo próprio e relata handshakes por segundo e quantos
+SELECTs chegaram ao SQLite. Usa o channel layer sem varredura de
+benchmarks/multiplex.py (a varredura do InMemoryChannelLayer dominaria a medida).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+from benchmarks.common import setup_database
+from channels.auth import AuthMiddlewareStack
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS
+from django.contrib.sessions.models import Session
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from chat.auth import CachedAuthMiddlewareStack, auth_cache, session_store
+from chat.routing import websocket_urlpatterns
+
+PREFIX = "bench_auth_"
+CHUNK = 500
+BACKEND = "django.contrib.auth.backends.ModelBackend"
+SCENARIOS = ("channels", "cached_cold", "cached_warm", "signed_cold")
+SIGNED = "django.contrib.sessions.backends.signed_cookies"
+
+selects = 0
+
+
+def count_selects(sender, connection, **kwargs):
+    def trace(statement):
+        global selects
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects += 1
+
+    if connection.vendor == "sqlite":
+        connection.connection.set_trace_callback(trace)
+
+
+def prepare(clients):
+    existing = User.objects.filter(username__startswith=PREFIX).count()
+    User.objects.bulk_create(
+        [User(username=f"{PREFIX}{i}", password="!") for i in range(existing, clients)]
+    )
+    # O banco dos benchmarks só tem sessões descartáveis
+    Session.objects.all().delete()
+
+
+def create_sessions(users):
+    """Chave de sessão (o valor do cookie) de cada usuário, já logado."""
+    store = session_store()
+    sessions = []
+    for user in users:
+        data = {
+            SESSION_KEY: str(user.pk),
+            BACKEND_SESSION_KEY: BACKEND,
+            HASH_SESSION_KEY: user.get_session_auth_hash(),
+        }
+        if settings.SESSION_ENGINE == SIGNED:
+            session = store()
+            session.update(data)
+            session.save()
+            sessions.append(session.session_key)
+        else:
+            sessions.append(
+                Session(
+                    session_key=get_random_string(32, VALID_KEY_CHARS),
+                    session_data=store().encode(data),
+                    expire_date=timezone.now() + timedelta(days=1),
+                )
+            )
+    if settings.SESSION_ENGINE == SIGNED:
+        return sessions
+    Session.objects.bulk_create(sessions, batch_size=1000)
+    return [session.session_key for session in sessions]
+
+
+async def handshake(application, session_key):
+    cookie = f"{settings.SESSION_COOKIE_NAME}={session_key}".encode()
+    communicator = WebsocketCommunicator(
+        application, "/ws/chat/direct/", headers=[(b"cookie", cookie)]
+    )
+    connected, _ = await communicator.connect(timeout=60)
+    assert connected
+    return communicator
+
+
+async def storm(application, session_keys):
+    global selects
+    selects = 0
+    started = time.perf_counter()
+    sockets = []
+    for start in range(0, len(session_keys), CHUNK):
+        chunk = session_keys[start:start + CHUNK]
+        sockets += await asyncio.gather(*(handshake(application, key) for key in chunk))
+    return sockets, time.perf_counter() - started, selects
+
+
+async def run_worker(scenario, session_keys):
+    stack = AuthMiddlewareStack if scenario == "channels" else CachedAuthMiddlewareStack
+    application = stack(URLRouter(websocket_urlpatterns))
+    auth_cache.clear()
+    before = auth_cache.get_stats()
+    sockets, elapsed, queries = await storm(application, session_keys)
+    if scenario == "cached_warm":
+        # Queda de rede: os clientes caem e voltam para o mesmo worker
+        for start in range(0, len(sockets), CHUNK):
+            chunk = sockets[start:start + CHUNK]
+            await asyncio.gather(*(socket.disconnect() for socket in chunk))
+        before = auth_cache.get_stats()
+        sockets, elapsed, queries = await storm(application, session_keys)
+    after = auth_cache.get_stats()
+    return {
+        "scenario": scenario,
+        "clients": len(sockets),
+        "total_s": round(elapsed, 2),
+        "handshakes_per_s": round(len(sockets) / elapsed),
+        "selects": queries,
+        "selects_per_handshake": round(queries / len(sockets), 3),
+        "batches": after["batches"] - before["batches"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=10000)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--worker", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        engine = SIGNED if args.worker == "signed_cold" else settings.SESSION_ENGINE
+        layers = {"default": {"BACKEND": "benchmarks.multiplex.ScanlessChannelLayer"}}
+        with override_settings(SESSION_ENGINE=engine, CHANNEL_LAYERS=layers):
+            users = list(
+                User.objects.filter(username__startswith=PREFIX).order_by("id")[: args.clients]
+            )
+            session_keys = create_sessions(users)
+            connections.close_all()
+            connection_created.connect(count_selects)
+            # Sem asyncio.run: fechar milhares de consumers na saída não faz parte da medida
+            loop = asyncio.new_event_loop()
+            result = loop.run_until_complete(run_worker(args.worker, session_keys))
+        print(json.dumps(result), flush=True)
+        os._exit(0)
+
+    setup_database()
+    prepare(args.clients)
+    connections.close_all()
+    for scenario in args.scenarios:
+        command = [
+            sys.executable, "-m", "benchmarks.auth_handshake",
+            "--worker", scenario, "--clients", str(args.clients),
+        ]
+        output = subprocess.run(command, capture_output=True, text=True, check=True)
+        print(output.stdout.strip(), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Utilitários compartilhados pelos benchmarks.
+
+Uso: python -m benchmarks.<nome> [opções]
+"""
+
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+
+def setup_database():
+    call_command("migrate", verbosity=0)
+
+
+def measure(func, repeat=50):
+    """Executa func 'repeat' vezes e retorna as latências em milissegundos."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95) - 1], 3),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+async def connect_consumer(
+    user, room_id=None, subprotocols=None, timeout=1, consumer=None, query=""
+):
+    """Abre um ChatConsumer (ou a subclasse 'consumer') em memória, autenticado como 'user'."""
+    from channels.testing import WebsocketCommunicator
+    from chat.consumers import ChatConsumer
+
+    consumer = consumer or ChatConsumer
+    path = f"/ws/chat/room/{room_id}/" if room_id else "/ws/chat/direct/"
+    if query:
+        path += f"?{query}"
+    communicator = WebsocketCommunicator(consumer.as_asgi(), path, subprotocols=subprotocols)
+    communicator.scope["user"] = user
+    communicator.scope["url_route"] = {"kwargs": {"room_id": str(room_id)} if room_id else {}}
+    connected, _ = await communicator.connect(timeout=timeout)
+    assert connected
+    return communicator
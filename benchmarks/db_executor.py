@@ -0,0 +1,145 @@
+"""
+Benchmark do caminho dos consumers até o banco (CHAT_DB, ver chat/database.py).
+
+    python -m benchmarks.db_executor --senders 100,1000,5000 --messages 3
+
+'senders' remetentes simultâneos, cada um na própria sala e com o próprio usuário,
+gravam 'messages' mensagens em sequência pelo mesmo caminho do ChatConsumer
+(save_room_message e depois save_direct_message), em cada modo:
+    -> sync: database_sync_to_async (uma thread do asgiref, conexão reaberta a cada salto)
+    -> async: ORM assíncrono (acreate) nas mensagens de sala
+    -> executor: thread escritora própria e pool de WORKERS leitoras, conexões persistentes
+Cada modo roda num processo próprio e relata mensagens por segundo e latência
+(p50/p95/p99) de cada gravação.
+"""
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+from benchmarks.common import setup_database
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import override_settings
+from chat.consumers import ChatConsumer
+from chat.models import Room
+from chat.rooms import room_cache
+from chat import database
+
+PREFIX = "bench_db_"
+MODES = ("sync", "async", "executor")
+
+
+def prepare(senders):
+    existing = User.objects.filter(username__startswith=PREFIX).count()
+    User.objects.bulk_create(
+        [User(username=f"{PREFIX}{i}", password="!") for i in range(existing, senders + 1)]
+    )
+    existing = Room.objects.filter(name__startswith=PREFIX).count()
+    Room.objects.bulk_create([Room(name=f"{PREFIX}{i}") for i in range(existing, senders)])
+
+
+def make_consumers(senders):
+    users = list(User.objects.filter(username__startswith=PREFIX).order_by("id")[: senders + 1])
+    rooms = list(Room.objects.filter(name__startswith=PREFIX).order_by("id")[:senders])
+    # O primeiro usuário só recebe as mensagens diretas
+    recipient = users[0]
+    consumers = []
+    for user, room in zip(users[1:], rooms):
+        consumer = ChatConsumer()
+        consumer.user = user
+        consumer.room_id = room.id
+        consumer.chat_type = "room"
+        consumers.append(consumer)
+    return consumers, recipient.id
+
+
+def percentile(ordered, fraction):
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 3)
+
+
+async def phase(consumers, messages, save):
+    samples = []
+
+    async def sender(consumer):
+        for i in range(messages):
+            started = time.perf_counter()
+            await save(consumer, i)
+            samples.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(sender(consumer) for consumer in consumers))
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        "messages_per_s": round(len(samples) / elapsed, 1),
+        "p50_ms": percentile(samples, 0.5),
+        "p95_ms": percentile(samples, 0.95),
+        "p99_ms": percentile(samples, 0.99),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+async def worker(consumers, recipient_id, messages):
+    room = await phase(
+        consumers,
+        messages,
+        lambda consumer, i: consumer.save_room_message(f"sala {i}", room_id=consumer.room_id),
+    )
+    direct = await phase(
+        consumers,
+        messages,
+        lambda consumer, i: consumer.save_direct_message(f"direta {i}", recipient_id),
+    )
+    return {"room": room, "direct": direct}
+
+
+def run_worker(args):
+    consumers, recipient_id = make_consumers(args.senders)
+    room_cache.load()
+    # A conexão do processo principal não deve ir para as threads
+    connections.close_all()
+    with override_settings(CHAT_DB={"MODE": args.worker, "WORKERS": args.workers}):
+        loop = asyncio.new_event_loop()
+        result = loop.run_until_complete(worker(consumers, recipient_id, args.messages))
+    print(json.dumps({**result, "executor": database.get_stats()}), flush=True)
+
+
+def run_mode(mode, senders, args):
+    command = [
+        sys.executable, "-m", "benchmarks.db_executor", "--worker", mode,
+        "--senders", str(senders), "--messages", str(args.messages),
+        "--workers", str(args.workers),
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--senders", default="100,1000,5000")
+    parser.add_argument("--messages", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.senders = int(args.senders)
+        run_worker(args)
+        return
+
+    setup_database()
+    sizes = [int(size) for size in args.senders.split(",")]
+    prepare(max(sizes))
+    for senders in sizes:
+        for mode in args.modes.split(","):
+            result = run_mode(mode, senders, args)
+            print(json.dumps({"mode": mode, "senders": senders, **result}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Benchmark de vazão de mensagens diretas com várias abas abertas por destinatário.
+
+    python -m benchmarks.dm_throughput --tabs 1 5 20 --messages 500
+
+Mede mensagens/s do envio até a entrega em todas as abas e quantos UPDATEs de
+confirmação de leitura foram necessários (chat/receipts.py).
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from chat import receipts
+
+
+async def run(tabs, total):
+    sender = await database_sync_to_async(User.objects.get_or_create)(username="bench_dm_sender")
+    recipient = await database_sync_to_async(User.objects.get_or_create)(
+        username="bench_dm_recipient"
+    )
+    sender, recipient = sender[0], recipient[0]
+
+    sender_socket = await connect_consumer(sender)
+    recipient_sockets = [await connect_consumer(recipient) for _ in range(tabs)]
+    before = receipts.get_stats()
+
+    started = time.perf_counter()
+    for i in range(total):
+        await sender_socket.send_json_to(
+            {"type": "direct", "message": f"dm {i}", "user_to_id": recipient.id}
+        )
+        await sender_socket.receive_json_from(timeout=5)
+        for socket in recipient_sockets:
+            await socket.receive_json_from(timeout=5)
+    elapsed = time.perf_counter() - started
+
+    for socket in recipient_sockets + [sender_socket]:
+        await socket.disconnect()
+    after = receipts.get_stats()
+
+    return {
+        "tabs": tabs,
+        "messages": total,
+        "messages_per_sec": round(total / elapsed, 1),
+        "receipt_updates": after.get("updates", 0) - before.get("updates", 0),
+        "rows_marked": after.get("rows_marked", 0) - before.get("rows_marked", 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tabs", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--messages", type=int, default=500)
+    args = parser.parse_args()
+
+    setup_database()
+    for tabs in args.tabs:
+        print(json.dumps(asyncio.run(run(tabs, args.messages))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark de memória da exportação do histórico (chat/export.py).
+
+    python -m benchmarks.export --sizes 10000 100000 300000
+
+Para cada tamanho uma sala com esse número de mensagens é exportada num processo
+separado, e o pico de memória (ru_maxrss) é medido antes e depois:
+    -> stream: stream_export (o que o endpoint envia), NDJSON
+    -> naive: o histórico inteiro carregado e serializado de uma vez (como fazer a
+       exportação pelo queryset do admin)
+O crescimento do stream deve ficar constante enquanto o naive cresce com a sala.
+"""
+
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks.common import setup_database
+from django.contrib.auth.models import User
+from chat import export
+from chat.models import Message, Room
+from chat.pagination import serialize_history
+
+MODES = ("stream", "naive")
+
+
+def prepare(size):
+    user = User.objects.get_or_create(username="bench_export")[0]
+    room = Room.objects.get_or_create(name=f"bench_export_{size}")[0]
+    missing = size - Message.objects.filter(room=room).count()
+    for start in range(0, missing, 10000):
+        Message.objects.bulk_create(
+            [
+                Message(room=room, user=user, content=f"mensagem de exportação {start + n}")
+                for n in range(min(10000, missing - start))
+            ],
+            batch_size=1000,
+        )
+    return room
+
+
+def peak_rss_mb():
+    # Linux: ru_maxrss em KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def consume(room):
+    written = 0
+    async for chunk in export.stream_export(*export.room_source(room), "ndjson"):
+        written += len(chunk)
+    return written
+
+
+def run_worker(room_id, mode):
+    room = Room.objects.get(id=room_id)
+    before = peak_rss_mb()
+    started = time.perf_counter()
+    if mode == "stream":
+        written = asyncio.run(consume(room))
+    else:
+        messages = list(export.room_source(room)[0].select_related("user"))
+        written = len(json.dumps(serialize_history(messages)).encode())
+    print(json.dumps({
+        "seconds": round(time.perf_counter() - started, 3),
+        "mb": round(written / 2**20, 1),
+        "rss_growth_mb": round(peak_rss_mb() - before, 1),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--room", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.room, args.mode)
+        return
+
+    setup_database()
+    for size in args.sizes:
+        room = prepare(size)
+        for mode in args.modes:
+            command = [
+                sys.executable, "-m", "benchmarks.export", "--worker",
+                "--room", str(room.id), "--mode", mode,
+            ]
+            output = subprocess.run(command, capture_output=True, text=True, check=True)
+            print(json.dumps({"size": size, "mode": mode, **json.loads(output.stdout)}), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark do custo de fan-out de uma mensagem em função do tamanho da sala.
+
+    python -m benchmarks.fanout --sizes 10 100 1000 5000
+
+Para cada tamanho mede:
+    -> encode_legacy_ms: um json.dumps por socket (como era o handler room_message)
+    -> encode_once_ms: protocol.render uma vez por group_send (implementação atual)
+    -> fanout_ms: do envio até todos os sockets receberem a mensagem
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from benchmarks.wire_protocol import SAMPLE, legacy_fanout, timed
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from chat import protocol
+from chat.models import Room
+
+
+async def measure_fanout(size):
+    user = (await database_sync_to_async(User.objects.get_or_create)(username="bench_fanout"))[0]
+    room = (await database_sync_to_async(Room.objects.get_or_create)(name="bench_fanout"))[0]
+    # Cada socket recebe uma mensagem por rodada; a capacidade padrão do layer já basta
+    sockets = [await connect_consumer(user, room_id=room.id) for _ in range(size)]
+
+    event = protocol.event("room", SAMPLE, handler="room_message")
+    started = time.perf_counter()
+    await get_channel_layer().group_send(f"chat_room_{room.id}", event)
+    for socket in sockets:
+        await socket.receive_from(timeout=60)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    for socket in sockets:
+        await socket.disconnect()
+    return round(elapsed, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    args = parser.parse_args()
+
+    setup_database()
+    for size in args.sizes:
+        print(json.dumps({
+            "room_size": size,
+            "encode_legacy_ms": round(timed(lambda: legacy_fanout(size)), 4),
+            "encode_once_ms": round(timed(lambda: protocol.render("room", SAMPLE)), 4),
+            "fanout_ms": asyncio.run(measure_fanout(size)),
+        }))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark da paginação do histórico de salas e DMs: cursor (keyset) vs. OFFSET.
+
+    python -m benchmarks.history_pagination --sizes 10000 1000000 10000000
+
+Para cada tamanho a sala e uma conversa direta são completadas até N mensagens e são medidas:
+    -> keyset_latest: página mais recente (sem cursor)
+    -> keyset_middle: página com before=<id do meio do histórico>
+    -> offset_middle: room.messages.order_by("timestamp")[N/2:N/2+50]
+    -> dm_latest / dm_middle: as mesmas páginas de keyset na conversa direta
+       (mensagens alternando as duas direções)
+"""
+
+import argparse
+import json
+from datetime import timedelta
+
+from benchmarks.common import measure, setup_database, summarize
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from chat.models import Message, Room
+from chat.pagination import direct_history, room_history
+
+CHUNK = 50000
+PAGE = 50
+
+
+def seed_room(room, user, total):
+    current = Message.objects.filter(room=room).count()
+    start = timezone.now() - timedelta(seconds=total)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(current, total, CHUNK):
+            rows = [
+                (room.id, user.id, f"mensagem {i}", start + timedelta(seconds=i), False)
+                for i in range(offset, min(offset + CHUNK, total))
+            ]
+            cursor.executemany(
+                "INSERT INTO chat_message (room_id, user_id, content, timestamp, is_read) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+
+
+def seed_conversation(user, other, total):
+    current = Message.objects.filter(room__isnull=True, user__in=(user, other)).count()
+    start = timezone.now() - timedelta(seconds=total)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(current, total, CHUNK):
+            rows = [
+                (
+                    *((user.id, other.id) if i % 2 else (other.id, user.id)),
+                    f"mensagem {i}",
+                    start + timedelta(seconds=i),
+                    False,
+                )
+                for i in range(offset, min(offset + CHUNK, total))
+            ]
+            cursor.executemany(
+                "INSERT INTO chat_message (user_id, user_to_id, content, timestamp, is_read) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    setup_database()
+    user, _ = User.objects.get_or_create(username="bench_history")
+    other, _ = User.objects.get_or_create(username="bench_history_dm")
+    room, _ = Room.objects.get_or_create(name="bench_history")
+
+    results = []
+    for size in sorted(args.sizes):
+        seed_room(room, user, size)
+        ids = Message.objects.filter(room=room).order_by("id").values_list("id", flat=True)
+        middle_id = ids[size // 2]
+        seed_conversation(user, other, size)
+        dm_ids = (
+            Message.objects.filter(room__isnull=True, user__in=(user, other))
+            .order_by("id")
+            .values_list("id", flat=True)
+        )
+        dm_middle_id = dm_ids[size // 2]
+
+        result = {
+            "messages": size,
+            "keyset_latest": summarize(measure(lambda: room_history(room, limit=PAGE), args.repeat)),
+            "keyset_middle": summarize(
+                measure(lambda: room_history(room, before=middle_id, limit=PAGE), args.repeat)
+            ),
+            "offset_middle": summarize(
+                measure(
+                    lambda: list(
+                        room.messages.order_by("timestamp")[size // 2 : size // 2 + PAGE]
+                    ),
+                    args.repeat,
+                )
+            ),
+            "dm_latest": summarize(
+                measure(lambda: direct_history(user, other, limit=PAGE), args.repeat)
+            ),
+            "dm_middle": summarize(
+                measure(
+                    lambda: direct_history(user, other, before=dm_middle_id, limit=PAGE),
+                    args.repeat,
+                )
+            ),
+        }
+        results.append(result)
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark do inbox de mensagens diretas (/api/conversations/).
+
+    python -m benchmarks.inbox --dms 10 100000
+
+Compara, para usuários com N mensagens diretas:
+    -> legacy: varredura de todas as mensagens do usuário agrupando em Python (implementação antiga)
+    -> conversation: consulta única na tabela Conversation
+"""
+
+import argparse
+import json
+from datetime import timedelta
+
+from benchmarks.common import measure, setup_database, summarize
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import Client
+from django.utils import timezone
+from chat.conversations import record_direct_messages
+from chat.models import Message
+
+PARTNERS = 200
+CHUNK = 20000
+
+
+def legacy_conversations(user):
+    conversations = {}
+    for msg in Message.objects.filter(
+        Q(user=user, user_to__isnull=False) | Q(user_to=user)
+    ).select_related("user", "user_to"):
+        other_user = msg.user_to if msg.user == user else msg.user
+        conv = conversations.setdefault(
+            other_user.id, {"timestamp": msg.timestamp, "has_unread": False}
+        )
+        conv["timestamp"] = max(conv["timestamp"], msg.timestamp)
+        if msg.user_to == user and not msg.is_read:
+            conv["has_unread"] = True
+    return sorted(conversations.values(), key=lambda x: x["timestamp"], reverse=True)
+
+
+def seed_user(total):
+    user, created = User.objects.get_or_create(username=f"bench_inbox_{total}")
+    if not created:
+        return user
+
+    partners = [
+        User.objects.create(username=f"bench_inbox_{total}_{i}")
+        for i in range(min(PARTNERS, total))
+    ]
+    start = timezone.now() - timedelta(seconds=total)
+    with transaction.atomic(), connection.cursor() as cursor:
+        rows = []
+        for i in range(total):
+            partner = partners[i % len(partners)]
+            sender, recipient = (user, partner) if i % 2 else (partner, user)
+            rows.append((sender.id, recipient.id, f"dm {i}", start + timedelta(seconds=i), i % 3 == 0))
+        cursor.executemany(
+            "INSERT INTO chat_message (user_id, user_to_id, content, timestamp, is_read) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            rows,
+        )
+
+    messages = Message.objects.filter(Q(user=user) | Q(user_to=user)).order_by("id")
+    for offset in range(0, total, CHUNK):
+        record_direct_messages(list(messages[offset:offset + CHUNK]))
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dms", type=int, nargs="+", default=[10, 100_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_database()
+    for total in args.dms:
+        user = seed_user(total)
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        result = {
+            "dms": total,
+            "legacy": summarize(measure(lambda: legacy_conversations(user), args.repeat)),
+            "conversation_api": summarize(
+                measure(lambda: client.get("/api/conversations/"), args.repeat)
+            ),
+        }
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
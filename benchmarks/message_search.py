@@ -0,0 +1,88 @@
+"""
+Benchmark da busca de mensagens: índice FTS5 vs. content__icontains (LIKE '%...%').
+
+    python -m benchmarks.message_search --sizes 100000 1000000 10000000
+
+Para cada tamanho o banco é completado até N mensagens (o índice é mantido pelos
+triggers) e são medidas, para um termo comum e um termo raro (1 a cada 10000):
+    -> icontains: página mais recente com LIKE, como a busca do admin fazia
+    -> fts_recent: mesma página pelo índice (sort=recent)
+    -> fts_rank: página mais relevante pelo índice (sort=rank)
+"""
+
+import argparse
+import json
+import random
+from datetime import timedelta
+
+from benchmarks.common import measure, setup_database, summarize
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from chat import search
+from chat.models import Message, Room
+
+CHUNK = 50000
+RARE_EVERY = 10000
+WORDS = (
+    "oi olá bom dia boa tarde noite alguém viu jogo ontem sala chat mensagem projeto "
+    "django python código teste amanhã hoje legal valeu obrigado sim não banco índice"
+).split()
+TERMS = {"common": "jogo", "rare": "paralelepípedo"}
+
+
+def content(rng, i):
+    words = rng.choices(WORDS, k=rng.randint(3, 15))
+    if i % RARE_EVERY == 0:
+        words.insert(rng.randrange(len(words)), TERMS["rare"])
+    return " ".join(words)
+
+
+def seed(room, user, total):
+    current = Message.objects.count()
+    rng = random.Random(current)
+    start = timezone.now() - timedelta(seconds=total)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for offset in range(current, total, CHUNK):
+            cursor.executemany(
+                "INSERT INTO chat_message (room_id, user_id, content, timestamp, is_read) "
+                "VALUES (%s, %s, %s, %s, %s)",
+                [
+                    (room.id, user.id, content(rng, i), start + timedelta(seconds=i), False)
+                    for i in range(offset, min(offset + CHUNK, total))
+                ],
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_database()
+    user, _ = User.objects.get_or_create(username="bench_search")
+    room, _ = Room.objects.get_or_create(name="bench_search")
+
+    for size in sorted(args.sizes):
+        seed(room, user, size)
+        result = {"messages": size}
+        for name, term in TERMS.items():
+            result[name] = {
+                "icontains": summarize(
+                    measure(lambda: search.icontains_page(user, term, None, 20), args.repeat)
+                ),
+                "fts_recent": summarize(
+                    measure(
+                        lambda: search.search_messages(user, term, sort="recent"), args.repeat
+                    )
+                ),
+                "fts_rank": summarize(
+                    measure(lambda: search.search_messages(user, term, sort="rank"), args.repeat)
+                ),
+            }
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
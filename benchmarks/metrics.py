@@ -0,0 +1,153 @@
+"""
+Benchmark (e teste de custo) das métricas (chat/metrics.py).
+
+    python -m benchmarks.metrics --calls 200000 --members 100 --messages 300
+
+    -> send_path: custo por mensagem dos pontos de medida do envio (mensagem
+       recebida, fan-out do group_send, tempo de banco do save e frame escrito)
+       contra o mesmo caminho sem medida, com as métricas desligadas e ligadas.
+       Sai com erro se o custo com as métricas ligadas passar de MAX_OVERHEAD_US
+    -> fanout: uma sala com 'members' sockets recebendo 'messages' mensagens pelo
+       ChatConsumer, com as métricas desligadas e ligadas
+    -> http: latência de uma view com e sem o MetricsMiddleware, e de uma coleta
+       de /metrics
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from benchmarks.common import connect_consumer, setup_database, summarize
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.test import Client, override_settings
+from django.urls import reverse
+from chat.metrics import Metrics, metrics
+from chat.models import Room
+
+MAX_OVERHEAD_US = 5
+ENABLED = {"ENABLED": True}
+DISABLED = {"ENABLED": False}
+
+
+async def send_path(calls, instrument):
+    """O que o ChatConsumer faz por mensagem, com (ou sem) os pontos de medida."""
+    recorder = Metrics()
+    recorder.groups["chat_room_1"] = 100
+
+    async def save():
+        return None
+
+    timed_save = recorder.timed("save_room_message")(save)
+    started = time.perf_counter()
+    if instrument:
+        for _ in range(calls):
+            recorder.message_received("room")
+            await timed_save()
+            recorder.group_sent("room", "chat_room_1")
+            recorder.frame_sent()
+    else:
+        for _ in range(calls):
+            await save()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def bench_send_path(calls):
+    baseline = asyncio.run(send_path(calls, instrument=False))
+    results = {}
+    for name, settings in (("disabled", DISABLED), ("enabled", ENABLED)):
+        with override_settings(CHAT_METRICS=settings):
+            elapsed = asyncio.run(send_path(calls, instrument=True))
+        results[f"{name}_overhead_us"] = round(elapsed - baseline, 3)
+    return {"bench": "send_path", "calls": calls, "baseline_us": round(baseline, 3), **results}
+
+
+def prepare():
+    user = User.objects.get_or_create(username="bench_metrics")[0]
+    room = Room.objects.get_or_create(name="bench_metrics")[0]
+    return user, room
+
+
+async def fanout(members, messages, enabled):
+    user, room = await database_sync_to_async(prepare)()
+    listeners = [await connect_consumer(user, room_id=room.id) for _ in range(members)]
+    sender = listeners[0]
+
+    started = time.perf_counter()
+    for i in range(messages):
+        await sender.send_to(text_data=json.dumps({"message": f"métrica {i}"}))
+    for socket in listeners:
+        for _ in range(messages):
+            while json.loads(await socket.receive_from(timeout=60)).get("type") != "room":
+                pass  # presença
+    elapsed = time.perf_counter() - started
+
+    for socket in listeners:
+        await socket.disconnect()
+    return {
+        "bench": "fanout",
+        "metrics": enabled,
+        "members": members,
+        "messages": messages,
+        "total_s": round(elapsed, 3),
+        "messages_per_s": round(messages / elapsed, 1),
+    }
+
+
+def bench_http(user, requests):
+    results = {"bench": "http", "requests": requests}
+    url = reverse("chat:get_rooms_presence")
+    for name, settings in (("disabled", DISABLED), ("enabled", ENABLED)):
+        with override_settings(CHAT_METRICS=settings):
+            # Client novo: a pilha de middlewares é montada no primeiro request
+            client = Client()
+            client.force_login(user)
+            client.get(url)
+            samples = []
+            for _ in range(requests):
+                started = time.perf_counter()
+                client.get(url)
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = summarize(samples)
+            if name == "enabled":
+                started = time.perf_counter()
+                response = Client().get("/metrics")
+                results["scrape_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                results["scrape_bytes"] = len(response.content)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    send = bench_send_path(args.calls)
+    print(json.dumps(send), flush=True)
+
+    setup_database()
+    # Rodada descartada: a primeira sala aquece caches e banco e pareceria mais lenta
+    with override_settings(CHAT_METRICS=DISABLED):
+        asyncio.run(fanout(args.members, args.messages // 10 or 1, False))
+    for enabled in (False, True):
+        with override_settings(CHAT_METRICS=ENABLED if enabled else DISABLED):
+            result = asyncio.run(fanout(args.members, args.messages, enabled))
+        print(json.dumps(result), flush=True)
+    user, _ = prepare()
+    print(json.dumps(bench_http(user, args.requests)), flush=True)
+    metrics.clear()
+
+    if send["enabled_overhead_us"] > MAX_OVERHEAD_US:
+        sys.exit(
+            f"Métricas custam {send['enabled_overhead_us']} µs por mensagem no envio "
+            f"(máximo {MAX_OVERHEAD_US} µs)"
+        )
+
+
+if __name__ == "__main__":
+    main()
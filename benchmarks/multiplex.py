@@ -0,0 +1,149 @@
+"""
+Benchmark do socket multiplexado (MultiplexConsumer, ws/chat/) contra um socket por
+sala mais o socket das mensagens diretas.
+
+    python -m benchmarks.multiplex --users 1000 10000 --rooms-per-user 5
+
+Cada usuário fica em 'rooms-per-user' salas e no chat direto:
+    -> separate: rooms-per-user + 1 sockets por usuário (ws/chat/room/<id>/ e ws/chat/direct/)
+    -> multiplex: 1 socket por usuário com um subscribe por sala
+Cada modo roda num processo próprio e relata sockets, inscrições em grupos do channel
+layer, memória residente (RSS) acrescentada pelas conexões e tempo até todos estarem
+prontos.
+
+O InMemoryChannelLayer percorre todos os canais e grupos a cada receive (expiração),
+o que torna dezenas de milhares de sockets num processo quadrático; o benchmark usa
+uma subclasse sem essa varredura (as mensagens aqui nunca expiram).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import override_settings
+from chat.consumers import MultiplexConsumer
+from chat.models import Room
+
+PREFIX = "bench_mx_"
+ROOMS = 100
+CHUNK = 500
+MODES = ("separate", "multiplex")
+
+
+class ScanlessChannelLayer(InMemoryChannelLayer):
+    def _clean_expired(self):
+        pass
+
+
+def prepare(users):
+    existing = User.objects.filter(username__startswith=PREFIX).count()
+    User.objects.bulk_create(
+        [User(username=f"{PREFIX}{i}", password="!") for i in range(existing, users)]
+    )
+    Room.objects.bulk_create(
+        [Room(name=f"{PREFIX}{i}") for i in range(ROOMS)], ignore_conflicts=True
+    )
+
+
+def current_rss_mb():
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def connect_separate(user, room_ids):
+    sockets = [await connect_consumer(user, room_id=room_id, timeout=60) for room_id in room_ids]
+    sockets.append(await connect_consumer(user, timeout=60))
+    return sockets
+
+
+async def connect_multiplex(user, room_ids):
+    socket = await connect_consumer(user, consumer=MultiplexConsumer, timeout=60)
+    for room_id in room_ids:
+        await socket.send_json_to({"type": "subscribe", "room_id": room_id})
+        while (await socket.receive_json_from(timeout=60)).get("type") != "subscribed":
+            pass  # eventos de presença da sala
+    return [socket]
+
+
+async def run_worker(mode, user_list, room_ids, rooms_per_user):
+    connect = connect_separate if mode == "separate" else connect_multiplex
+    before = current_rss_mb()
+    started = time.perf_counter()
+
+    sockets = []
+    for start in range(0, len(user_list), CHUNK):
+        chunk = user_list[start:start + CHUNK]
+        for user_sockets in await asyncio.gather(*(
+            connect(user, [room_ids[(i + n) % len(room_ids)] for n in range(rooms_per_user)])
+            for i, user in enumerate(chunk, start)
+        )):
+            sockets += user_sockets
+
+    elapsed = time.perf_counter() - started
+    growth = current_rss_mb() - before
+    layer = get_channel_layer()
+    return {
+        "mode": mode,
+        "users": len(user_list),
+        "sockets": len(sockets),
+        "sockets_per_user": len(sockets) / len(user_list),
+        "group_memberships": sum(len(channels) for channels in layer.groups.values()),
+        "connect_s": round(elapsed, 2),
+        "rss_growth_mb": round(growth, 1),
+        "kb_per_user": round(growth * 1024 / len(user_list), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--rooms-per-user", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        user_list = list(
+            User.objects.filter(username__startswith=PREFIX).order_by("id")[: args.users[0]]
+        )
+        room_ids = list(
+            Room.objects.filter(name__startswith=PREFIX).order_by("id").values_list("id", flat=True)
+        )
+        layers = {"default": {"BACKEND": "benchmarks.multiplex.ScanlessChannelLayer"}}
+        with override_settings(CHANNEL_LAYERS=layers):
+            # Sem asyncio.run: cancelar dezenas de milhares de consumers na saída
+            # demora mais que o benchmark e não faz parte da medida
+            loop = asyncio.new_event_loop()
+            result = loop.run_until_complete(
+                run_worker(args.worker, user_list, room_ids, args.rooms_per_user)
+            )
+        print(json.dumps(result), flush=True)
+        os._exit(0)
+
+    setup_database()
+    prepare(max(args.users))
+    # Os workers abrem as próprias conexões com o banco
+    connections.close_all()
+    for users in args.users:
+        for mode in args.modes:
+            command = [
+                sys.executable, "-m", "benchmarks.multiplex", "--worker", mode,
+                "--users", str(users), "--rooms-per-user", str(args.rooms_per_user),
+            ]
+            output = subprocess.run(command, capture_output=True, text=True, check=True)
+            print(output.stdout.strip(), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Benchmark da presença/digitação numa sala grande.
+
+    python -m benchmarks.presence --sizes 100 1000 --typists 50 --seconds 3
+
+Para cada tamanho conecta N sockets (usuários distintos) na mesma sala e faz
+'typists' deles mandarem um frame de digitação a cada 20 ms (uma tecla) durante
+'seconds' segundos. Relata:
+    -> keystrokes: frames de digitação recebidos pelo servidor
+    -> broadcasts: eventos de presença enviados ao grupo (no máximo um por tick)
+    -> frames_per_socket: mensagens que cada socket recebeu no período
+    -> naive_frames_per_socket: o que cada socket receberia com um evento por tecla
+    -> online: contagem de online da sala depois das conexões
+
+Roda com o balde de digitação (CHAT_RATE_LIMIT["TYPING_RATE"]) desligado: ele
+descartaria quase todas as teclas e o teste mediria o limite, não a agregação.
+
+O InMemoryChannelLayer varre todos os canais a cada receive, então acima de alguns
+milhares de sockets no mesmo processo o custo medido é o do layer, não o da presença.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.test import override_settings
+from chat.models import Room
+from chat.presence import get_config, presence
+from chat.ratelimit import rate_limiter
+
+KEYSTROKE_MS = 20
+PREFIX = "bench_presence_"
+
+
+def prepare(size):
+    User.objects.bulk_create(
+        [User(username=f"{PREFIX}{i}", password="!") for i in range(size)],
+        ignore_conflicts=True,
+        batch_size=1000,
+    )
+    room = Room.objects.get_or_create(name="bench_presence")[0]
+    users = list(User.objects.filter(username__startswith=PREFIX).order_by("id")[:size])
+    return room, users
+
+
+def drain(sockets):
+    # Só conta e descarta o que chegou; ler frame a frame de 10 mil sockets levaria minutos
+    total = 0
+    for socket in sockets:
+        total += socket.output_queue.qsize()
+        while not socket.output_queue.empty():
+            socket.output_queue.get_nowait()
+    return total
+
+
+async def type_for(socket, seconds):
+    sent = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        await socket.send_json_to({"type": "typing"})
+        sent += 1
+        await asyncio.sleep(KEYSTROKE_MS / 1000)
+    return sent
+
+
+async def run(size, typists, seconds):
+    room, users = await database_sync_to_async(prepare)(size)
+    tick = get_config()["TICK_MS"] / 1000
+
+    sockets = [await connect_consumer(user, room_id=room.id, timeout=30) for user in users]
+    await asyncio.sleep(tick * 2)
+    online = presence.online_count(room.id)
+    drain(sockets)
+
+    before = presence.get_stats()["broadcasts"]
+    keystrokes = sum(
+        await asyncio.gather(*(type_for(socket, seconds) for socket in sockets[:typists]))
+    )
+    await asyncio.sleep(tick * 2)
+    frames = drain(sockets)
+    broadcasts = presence.get_stats()["broadcasts"] - before
+
+    for socket in sockets:
+        await socket.disconnect()
+    return {
+        "sockets": size,
+        "online": online,
+        "typists": typists,
+        "keystrokes": keystrokes,
+        "broadcasts": broadcasts,
+        "frames_per_socket": round(frames / size, 1),
+        "naive_frames_per_socket": keystrokes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--typists", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=3)
+    args = parser.parse_args()
+
+    setup_database()
+    with override_settings(CHAT_RATE_LIMIT={"TYPING_RATE": None}):
+        rate_limiter.reload()
+        for size in args.sizes:
+            print(json.dumps(asyncio.run(run(size, min(args.typists, size), args.seconds))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark do limite de mensagens (chat/ratelimit.py).
+
+    python -m benchmarks.rate_limit --calls 1000000 --users 10000 --flood 500
+
+    -> check: custo de rate_limiter.check() por mensagem (baldes de conexão, usuário
+       e sala), com o limite desligado, aceitando (limites altos, 'users' usuários
+       diferentes) e rejeitando
+    -> flood: um cliente envia 'flood' mensagens seguidas numa sala com 'members'
+       sockets, sem e com o limite: mensagens gravadas, rejeitadas e tempo até o
+       remetente receber todas as respostas
+    -> sync: dois workers (dois RateLimiter) dividindo o limite do mesmo usuário
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.test import override_settings
+from chat.models import Message, Room
+from chat.ratelimit import RateLimiter, rate_limiter
+
+HIGH_LIMITS = {
+    "ENABLED": True,
+    "CONNECTION_RATE": 1e9,
+    "CONNECTION_BURST": 1e9,
+    "USER_RATE": 1e9,
+    "USER_BURST": 1e9,
+    "ROOM_RATE": 1e9,
+    "ROOM_BURST": 1e9,
+}
+
+
+def per_call_ns(calls, users, settings):
+    with override_settings(CHAT_RATE_LIMIT=settings):
+        limiter = RateLimiter()
+        connection = limiter.connection_bucket()
+        check = limiter.check
+        started = time.perf_counter()
+        for i in range(calls):
+            check(i % users, 1, connection)
+        elapsed = time.perf_counter() - started
+    return round(elapsed / calls * 1e9), limiter.get_stats()
+
+
+def bench_check(calls, users):
+    results = {}
+    for name, settings in (
+        ("disabled", {"ENABLED": False}),
+        ("allowed", HIGH_LIMITS),
+        ("rejected", {"ENABLED": True, "CONNECTION_RATE": 1, "CONNECTION_BURST": 1}),
+    ):
+        ns, stats = per_call_ns(calls, users, settings)
+        rejected = sum(value for key, value in stats.items() if key.startswith("rejected"))
+        results[name] = {"ns_per_call": ns, "allowed": stats["allowed"], "rejected": rejected}
+    return {"bench": "check", "calls": calls, "users": users, **results}
+
+
+def prepare():
+    user = User.objects.get_or_create(username="bench_rate_limit")[0]
+    room = Room.objects.get_or_create(name="bench_rate_limit")[0]
+    return user, room
+
+
+def count_messages(room):
+    return Message.objects.filter(room=room).count()
+
+
+async def flood(members, messages, enabled):
+    user, room = await database_sync_to_async(prepare)()
+    rate_limiter.reload()
+    listeners = [await connect_consumer(user, room_id=room.id) for _ in range(members)]
+    sender = await connect_consumer(user, room_id=room.id)
+    before = await database_sync_to_async(count_messages)(room)
+
+    started = time.perf_counter()
+    for i in range(messages):
+        await sender.send_to(text_data=json.dumps({"message": f"flood {i}"}))
+    replies = {"room": 0, "rate_limited": 0}
+    while sum(replies.values()) < messages:
+        payload = json.loads(await sender.receive_from(timeout=60))
+        if payload.get("type") in replies:
+            replies[payload["type"]] += 1
+    elapsed = time.perf_counter() - started
+    saved = await database_sync_to_async(count_messages)(room) - before
+
+    for socket in listeners + [sender]:
+        await socket.disconnect()
+    return {
+        "bench": "flood",
+        "limit": enabled,
+        "members": members,
+        "sent": messages,
+        "saved": saved,
+        "rejected": replies["rate_limited"],
+        "total_s": round(elapsed, 3),
+    }
+
+
+def bench_sync(messages):
+    # Cada worker sozinho aceitaria USER_BURST; juntos devem aceitar só um BURST
+    with override_settings(CHAT_RATE_LIMIT={"ENABLED": True, "CONNECTION_RATE": None, "ROOM_RATE": None}):
+        first, second = RateLimiter(), RateLimiter()
+        accepted = sum(first.check(1) is None for _ in range(messages))
+        second.receive_sync(first.snapshot())
+        accepted += sum(second.check(1) is None for _ in range(messages))
+        return {
+            "bench": "sync",
+            "burst": first.config["USER_BURST"],
+            "sent_per_worker": messages,
+            "accepted_total": accepted,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--flood", type=int, default=500)
+    args = parser.parse_args()
+
+    print(json.dumps(bench_check(args.calls, args.users)), flush=True)
+
+    setup_database()
+    for enabled in (False, True):
+        settings = {"ENABLED": enabled, "SYNC_MS": 60000}
+        with override_settings(CHAT_RATE_LIMIT=settings):
+            print(json.dumps(asyncio.run(flood(args.members, args.flood, enabled))), flush=True)
+    rate_limiter.reload()
+
+    print(json.dumps(bench_sync(30)))
+
+
+if __name__ == "__main__":
+    main()
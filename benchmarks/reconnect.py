@@ -0,0 +1,170 @@
+"""
+Benchmark da retomada após reconexão (chat/recent.py) com 1.000 clientes.
+
+    python -m benchmarks.reconnect --clients 1000 --rooms 10 --missed 20
+
+Os clientes ficam conectados em 'rooms' salas (com histórico), caem todos ao mesmo
+tempo e cada sala recebe 'missed' mensagens enquanto estão fora. Cenários:
+    -> restart: deploy (o processo perde os buffers); todos reconectam de uma vez
+       com ?last_message_id e recebem só a lacuna
+    -> blip: queda de rede (o worker continua com os buffers em memória)
+    -> full_reload: o que acontecia antes, cada cliente recarregando room_detail
+Relata o tempo até todos os clientes terem a lacuna, frames e bytes por cliente e
+quantas consultas ao banco a retomada fez (aquecimentos + lacunas lidas do banco).
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+from chat.models import Message, Room
+from chat.recent import recent_messages
+
+HISTORY = 1000
+CHUNK = 100
+
+
+def prepare(rooms):
+    user = User.objects.get_or_create(username="bench_reconnect")[0]
+    room_ids = []
+    for i in range(rooms):
+        room = Room.objects.get_or_create(name=f"bench_reconnect_{i}")[0]
+        missing = HISTORY - Message.objects.filter(room=room).count()
+        Message.objects.bulk_create(
+            [Message(room=room, user=user, content=f"histórico {n}") for n in range(missing)],
+            batch_size=1000,
+        )
+        room_ids.append(room.id)
+    return user, room_ids
+
+
+def send_missed(user, room_ids, missed):
+    # Mensagens enviadas (por outros workers) enquanto os clientes estavam fora
+    Message.objects.bulk_create(
+        [
+            Message(room_id=room_id, user=user, content=f"perdida {n}")
+            for room_id in room_ids
+            for n in range(missed)
+        ]
+    )
+
+
+def last_ids(room_ids):
+    return {room_id: Message.objects.filter(room_id=room_id).latest("id").id for room_id in room_ids}
+
+
+async def connect_all(user, assignments, last_seen=None):
+    sockets = []
+    for start in range(0, len(assignments), CHUNK):
+        chunk = assignments[start:start + CHUNK]
+        sockets += await asyncio.gather(*(
+            connect_consumer(
+                user,
+                room_id=room_id,
+                timeout=60,
+                query=f"last_message_id={last_seen[room_id]}" if last_seen else "",
+            )
+            for room_id in chunk
+        ))
+    return sockets
+
+
+async def read_gap(socket):
+    frames = size = 0
+    while True:
+        text = await socket.receive_from(timeout=60)
+        payload = json.loads(text)
+        if payload.get("type") == "resume":
+            return frames, size, payload["complete"]
+        if payload.get("type") == "room":
+            frames += 1
+            size += len(text.encode())
+
+
+async def storm(user, assignments, room_ids, missed, restart):
+    sockets = await connect_all(user, assignments)
+    last_seen = await database_sync_to_async(last_ids)(room_ids)
+
+    for socket in sockets:
+        await socket.disconnect()
+    if restart:
+        recent_messages.rooms.clear()
+    else:
+        # Na queda de rede o worker continua com a sala (outros clientes seguem nela)
+        for room_id in room_ids:
+            recent_messages.attach(room_id)
+            await recent_messages.ensure_warm(room_id)
+    await database_sync_to_async(send_missed)(user, room_ids, missed)
+    if not restart:
+        # As mensagens novas chegam ao buffer pelo handler dos sockets que ficaram
+        for room_id in room_ids:
+            await database_sync_to_async(recent_messages.warm)(room_id)
+
+    before = recent_messages.get_stats()
+    started = time.perf_counter()
+    sockets = await connect_all(user, assignments, last_seen)
+    gaps = await asyncio.gather(*(read_gap(socket) for socket in sockets))
+    elapsed = time.perf_counter() - started
+    after = recent_messages.get_stats()
+
+    for socket in sockets:
+        await socket.disconnect()
+    if not restart:
+        for room_id in room_ids:
+            recent_messages.detach(room_id)
+    return {
+        "scenario": "restart" if restart else "blip",
+        "clients": len(sockets),
+        "total_s": round(elapsed, 3),
+        "frames_per_client": sum(frames for frames, _, _ in gaps) / len(gaps),
+        "bytes_per_client": round(sum(size for _, size, _ in gaps) / len(gaps)),
+        "incomplete": sum(1 for _, _, complete in gaps if not complete),
+        "db_queries": (after["warms"] - before["warms"])
+        + (after["resumes_from_db"] - before["resumes_from_db"]),
+    }
+
+
+def full_reload(user, assignments):
+    client = Client()
+    client.force_login(user)
+    size = 0
+    started = time.perf_counter()
+    # Agrupado por sala para gravar a sessão (room_id) só uma vez por sala
+    for room_id in sorted(assignments):
+        if client.session.get("room_id") != room_id:
+            session = client.session
+            session["room_id"] = room_id
+            session.save()
+        response = client.get(reverse("chat:room_detail", args=[room_id]))
+        size += len(response.content)
+    return {
+        "scenario": "full_reload",
+        "clients": len(assignments),
+        "total_s": round(time.perf_counter() - started, 3),
+        "bytes_per_client": round(size / len(assignments)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--missed", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_database()
+    user, room_ids = prepare(args.rooms)
+    assignments = [room_ids[i % len(room_ids)] for i in range(args.clients)]
+    for restart in (True, False):
+        print(json.dumps(asyncio.run(storm(user, assignments, room_ids, args.missed, restart))))
+    print(json.dumps(full_reload(user, assignments)))
+
+
+if __name__ == "__main__":
+    main()
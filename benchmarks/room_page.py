@@ -0,0 +1,85 @@
+"""
+Benchmark do room_detail e da API de histórico com o buffer de mensagens recentes
+(chat/recent.py).
+
+    python -m benchmarks.room_page --history 1000 --repeat 200
+
+Para a página da sala e para /api/messages/room/<id>/ (página mais recente) mede:
+    -> cold: buffer descartado antes de cada requisição (o caminho antigo: consulta
+       as 50 últimas mensagens com select_related)
+    -> warm: buffer em memória
+Relata a latência e o número de consultas por requisição: total (sessão e usuário
+incluídos) e só as que tocam chat_message.
+"""
+
+import argparse
+import json
+import time
+
+from benchmarks.common import setup_database, summarize
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from chat.models import Message, Room
+from chat.recent import recent_messages
+
+
+def prepare(history):
+    user = User.objects.get_or_create(username="bench_room_page")[0]
+    room = Room.objects.get_or_create(name="bench_room_page")[0]
+    missing = history - Message.objects.filter(room=room).count()
+    Message.objects.bulk_create(
+        [Message(room=room, user=user, content=f"mensagem {n}") for n in range(missing)],
+        batch_size=1000,
+    )
+    return user, room
+
+
+def run(client, url, repeat, cold):
+    samples, queries, message_queries = [], 0, 0
+    for _ in range(repeat):
+        if cold:
+            recent_messages.rooms.clear()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(url)
+            samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200
+        queries += len(captured)
+        message_queries += sum(1 for query in captured if "chat_message" in query["sql"])
+    return {
+        **summarize(samples),
+        "queries": queries / repeat,
+        "message_queries": message_queries / repeat,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--history", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_database()
+    user, room = prepare(args.history)
+    client = Client()
+    client.force_login(user)
+    session = client.session
+    session["room_id"] = room.id
+    session.save()
+
+    pages = {
+        "room_detail": reverse("chat:room_detail", args=[room.id]),
+        "history_api": reverse("chat:get_room_messages", args=[room.id]),
+    }
+    for name, url in pages.items():
+        result = {"page": name}
+        for mode in ("cold", "warm"):
+            result[mode] = run(client, url, args.repeat, cold=mode == "cold")
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
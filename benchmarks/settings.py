@@ -0,0 +1,23 @@
+"""
+Settings usados pelos benchmarks: mesmo projeto, mas com um banco SQLite separado
+para nunca tocar no db.sqlite3 de desenvolvimento.
+"""
+
+import os
+
+from djangochat.settings import *  # noqa: F401,F403
+
+DATABASES = {
+    "default": {
+        **DATABASES["default"],  # noqa: F405 (mantém as opções do CHAT_SQLITE["MODE"])
+        "NAME": os.environ.get("BENCH_DB", BASE_DIR / "bench.sqlite3"),  # noqa: F405
+    }
+}
+
+DEBUG = False
+
+ALLOWED_HOSTS = ["localhost", "testserver"]
+
+# Os benchmarks enviam sem pausa para medir capacidade; o limite de mensagens tem
+# o próprio benchmark (benchmarks/rate_limit.py), que o liga explicitamente
+CHAT_RATE_LIMIT = {"ENABLED": False}
@@ -0,0 +1,208 @@
+"""
+Teste de estresse do SQLite com muitos remetentes simultâneos, comparando os modos
+de CHAT_SQLITE (ver chat/database.py).
+
+    python -m benchmarks.sqlite_concurrency --workers 4 --senders 50 --messages 20
+
+Para cada modo sobe 'workers' processos (como vários workers do daphne no mesmo
+banco); cada processo tem 'senders' usuários, cada um com um consumer de sala e um
+de mensagens diretas, enviando ao mesmo tempo, enquanto 'readers' threads leem o
+histórico das salas (como as views HTTP). Relata mensagens/s, latência do envio
+até o eco e quantos erros "database is locked" chegaram aos clientes ou aos leitores.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import connect_consumer, setup_database, summarize
+from django.contrib.auth.models import User
+from django.db import connection
+from chat import database
+from chat.models import Room
+from chat.pagination import room_history
+
+MODES = ["default", "concurrent"]
+USER_PREFIX = "bench_sqlite_"
+
+
+def prepare(users):
+    setup_database()
+    User.objects.bulk_create(
+        [User(username=f"{USER_PREFIX}{i}", password="!") for i in range(users)],
+        ignore_conflicts=True,
+    )
+    # Uma sala por remetente: o teste mede as gravações, não o fan-out
+    Room.objects.bulk_create(
+        [Room(name=f"{USER_PREFIX}{i}") for i in range(users)], ignore_conflicts=True
+    )
+
+
+def reset_journal(mode):
+    # O WAL fica gravado no arquivo; o modo padrão precisa voltar ao journal clássico
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode = {'WAL' if mode == 'concurrent' else 'DELETE'}")
+    connection.close()
+
+
+class Readers:
+    """Threads que leem o histórico da sala em laço, como requisições HTTP paralelas."""
+
+    def __init__(self, rooms, count):
+        self.rooms = rooms
+        self.stop = threading.Event()
+        self.reads = 0
+        self.lock_errors = 0
+        self.threads = [threading.Thread(target=self.loop) for _ in range(count)]
+
+    def loop(self):
+        from django.db import connections
+
+        i = 0
+        while not self.stop.is_set():
+            i += 1
+            try:
+                list(room_history(self.rooms[i % len(self.rooms)], limit=50))
+                self.reads += 1
+            except Exception as e:
+                if "locked" not in str(e):
+                    raise
+                self.lock_errors += 1
+            # Intervalo entre requisições; sem ele as threads só disputariam o GIL
+            self.stop.wait(0.005)
+        connections.close_all()
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+async def send_all(sockets, user, peer, messages, stats):
+    for i in range(messages):
+        frame = {"message": f"estresse {i}", "client_key": f"{user.id}-{i}-{time.time_ns()}"}
+        if i % 2:
+            frame.update(type="direct", user_to_id=peer.id)
+            socket = sockets["direct"]
+        else:
+            frame["type"] = "room"
+            socket = sockets["room"]
+
+        started = time.perf_counter()
+        await socket.send_json_to(frame)
+        while True:
+            data = await socket.receive_json_from(timeout=60)
+            if "error" in data:
+                stats["lock_errors" if "locked" in data["error"] else "errors"] += 1
+                break
+            if data.get("client_key", "").endswith(frame["client_key"]):
+                stats["latencies"].append((time.perf_counter() - started) * 1000)
+                break
+
+
+def load(model, field):
+    return list(model.objects.filter(**{f"{field}__startswith": USER_PREFIX}).order_by("id"))
+
+
+async def worker(index, senders, messages, start_at):
+    users = await database.db_read(load)(User, "username")
+    rooms = await database.db_read(load)(Room, "name")
+    mine = list(zip(users, rooms))[index * senders:(index + 1) * senders]
+    sockets = [
+        {
+            "room": await connect_consumer(user, room_id=room.id),
+            "direct": await connect_consumer(user),
+        }
+        for user, room in mine
+    ]
+    stats = {"latencies": [], "lock_errors": 0, "errors": 0}
+
+    await asyncio.sleep(max(0, start_at - time.time()))
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        send_all(pair, user, users[(index * senders + i + 1) % len(users)], messages, stats)
+        for i, (pair, (user, _)) in enumerate(zip(sockets, mine))
+    ))
+    elapsed = time.perf_counter() - started
+
+    for pair in sockets:
+        for socket in pair.values():
+            await socket.disconnect()
+    return {**stats, "elapsed": elapsed}
+
+
+def run_worker(args):
+    with Readers(load(Room, "name"), args.readers) as readers:
+        result = asyncio.run(worker(args.index, args.senders, args.messages, args.start_at))
+    result.update(
+        reads=readers.reads,
+        read_lock_errors=readers.lock_errors,
+        writer=database.get_stats(),
+    )
+    print(json.dumps(result))
+
+
+def run_mode(mode, args):
+    reset_journal(mode)
+    start_at = time.time() + 3 + args.senders * 0.01
+    command = [
+        sys.executable, "-m", "benchmarks.sqlite_concurrency", "--worker",
+        "--senders", str(args.senders),
+        "--messages", str(args.messages), "--readers", str(args.readers),
+        "--start-at", str(start_at),
+    ]
+    env = {**os.environ, "CHAT_SQLITE_MODE": mode}
+    processes = [
+        subprocess.Popen(command + ["--index", str(i)], env=env, stdout=subprocess.PIPE, text=True)
+        for i in range(args.workers)
+    ]
+    results = [json.loads(process.communicate()[0]) for process in processes]
+
+    latencies = [ms for result in results for ms in result["latencies"]]
+    elapsed = max(result["elapsed"] for result in results)
+    return {
+        "mode": mode,
+        "senders": args.workers * args.senders,
+        "messages": len(latencies),
+        "messages_per_sec": round(len(latencies) / elapsed, 1),
+        **(summarize(latencies) if latencies else {}),
+        "lock_errors": sum(result["lock_errors"] for result in results),
+        "other_errors": sum(result["errors"] for result in results),
+        "reads": sum(result["reads"] for result in results),
+        "read_lock_errors": sum(result["read_lock_errors"] for result in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--senders", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--start-at", type=float, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    prepare(args.workers * args.senders)
+    for mode in args.modes:
+        print(json.dumps(run_mode(mode, args)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Benchmark do rastreamento de latência (chat/tracing.py).
+
+    python -m benchmarks.tracing --calls 200000 --members 20 --messages 200
+
+    -> cost: custo por mensagem do rastreamento no caminho do remetente e de um
+       destinatário, sem amostragem, com 1% e com 100% (com e sem arquivo)
+    -> cross_worker: broker local (chat/broker.py) e dois processos, um com 'members'
+       sockets na sala e outro com o remetente, os dois gravando no mesmo arquivo
+       de traces com SAMPLE_RATE 1. Relata quantos traces tiveram etapas nos dois
+       processos e a latência por etapa
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from benchmarks.common import connect_consumer, setup_database, summarize
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from django.test import override_settings
+from chat.models import Room
+from chat.tracing import STAGES, Tracer
+
+ROLES = ("listen", "send")
+
+
+def per_message_us(calls, rate, path=None):
+    with override_settings(CHAT_TRACING={"SAMPLE_RATE": rate, "FILE": path, "FLUSH_MS": 100}):
+        tracer = Tracer()
+        started = time.perf_counter()
+        for _ in range(calls):
+            trace = tracer.start("room")
+            if trace is not None:
+                trace.room_id = 1
+                trace.mark("parse")
+                trace.mark("save")
+                context = trace.context()
+                trace.mark("group_send")
+                tracer.delivered(context, time.time())
+        elapsed = time.perf_counter() - started
+        tracer.flush()
+    return round(elapsed / calls * 1e6, 3)
+
+
+def bench_cost(calls):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "traces.jsonl")
+        return {
+            "bench": "cost",
+            "calls": calls,
+            "off_us": per_message_us(calls, 0.0),
+            "sample_1pct_us": per_message_us(calls, 0.01),
+            "sample_all_us": per_message_us(calls, 1.0),
+            "sample_all_file_us": per_message_us(calls // 10, 1.0, path),
+        }
+
+
+def prepare():
+    user = User.objects.get_or_create(username="bench_tracing")[0]
+    room = Room.objects.get_or_create(name="bench_tracing")[0]
+    return user, room
+
+
+async def listen(members, messages):
+    user, room = await database_sync_to_async(prepare)()
+    sockets = [await connect_consumer(user, room_id=room.id) for _ in range(members)]
+    print("ready", flush=True)
+    for socket in sockets:
+        received = 0
+        while received < messages:
+            if json.loads(await socket.receive_from(timeout=60)).get("type") == "room":
+                received += 1
+    # O último frame é escrito depois do receive do teste; espera o callback
+    await asyncio.sleep(0.1)
+    for socket in sockets:
+        await socket.disconnect()
+
+
+async def send(messages):
+    user, room = await database_sync_to_async(prepare)()
+    sender = await connect_consumer(user, room_id=room.id)
+    for i in range(messages):
+        await sender.send_to(text_data=json.dumps({"message": f"trace {i}"}))
+        while json.loads(await sender.receive_from(timeout=60)).get("type") != "room":
+            pass
+    await sender.disconnect()
+
+
+def run_worker(args):
+    layers = {
+        "default": {"BACKEND": "chat.layers.BrokerChannelLayer", "CONFIG": {"path": args.broker}}
+    }
+    tracing = {"SAMPLE_RATE": 1.0, "FILE": args.trace_file, "FLUSH_MS": 100}
+    with override_settings(CHANNEL_LAYERS=layers, CHAT_TRACING=tracing):
+        if args.worker == "listen":
+            asyncio.run(listen(args.members, args.messages))
+        else:
+            asyncio.run(send(args.messages))
+
+
+def summarize_file(path):
+    stages = defaultdict(list)
+    pids = defaultdict(set)
+    for line in open(path):
+        span = json.loads(line)
+        stages[span["stage"]].append(span["ms"])
+        pids[span["trace"]].add(span["pid"])
+    return {
+        "traces": len(pids),
+        "cross_process_traces": sum(1 for trace_pids in pids.values() if len(trace_pids) > 1),
+        "stages": {stage: summarize(stages[stage]) for stage in STAGES if stage in stages},
+    }
+
+
+def bench_cross_worker(members, messages):
+    with tempfile.TemporaryDirectory() as directory:
+        broker_path = os.path.join(directory, "broker.sock")
+        trace_file = os.path.join(directory, "traces.jsonl")
+        broker = subprocess.Popen(
+            [sys.executable, "manage.py", "chat_broker", "--path", broker_path],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            while not os.path.exists(broker_path):
+                time.sleep(0.05)
+            command = [
+                sys.executable, "-m", "benchmarks.tracing", "--broker", broker_path,
+                "--trace-file", trace_file, "--members", str(members),
+                "--messages", str(messages), "--worker",
+            ]
+            listener = subprocess.Popen(command + ["listen"], stdout=subprocess.PIPE, text=True)
+            assert listener.stdout.readline().strip() == "ready"
+            subprocess.run(command + ["send"], check=True)
+            listener.communicate(timeout=300)
+        finally:
+            broker.terminate()
+            broker.wait()
+        return {
+            "bench": "cross_worker",
+            "members": members,
+            "messages": messages,
+            **summarize_file(trace_file),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--members", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--worker", choices=ROLES, help=argparse.SUPPRESS)
+    parser.add_argument("--broker", help=argparse.SUPPRESS)
+    parser.add_argument("--trace-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    print(json.dumps(bench_cost(args.calls)), flush=True)
+    setup_database()
+    print(json.dumps(bench_cross_worker(args.members, args.messages)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
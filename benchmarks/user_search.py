@@ -0,0 +1,90 @@
+"""
+Benchmark da busca de usuários: diretório em memória vs. icontains em auth_user.
+
+    python -m benchmarks.user_search --sizes 10000 100000 1000000
+
+Para cada tamanho a tabela é completada até N usuários e são medidas:
+    -> icontains: a consulta antiga da view (username/first_name__icontains, 10 linhas)
+    -> build_s: carga inicial do diretório (uma vez por processo)
+    -> lookup: busca no índice por prefixos de 1, 3 e 6 letras, por um username
+       exato, por um trecho do meio do nome e por um texto sem resultado (o pior
+       caso do icontains: varre a tabela)
+    -> search: a busca da view sem cache (um usuário diferente por chamada); com
+       menos de 10 resultados no índice ela é completada pelo índice de trigramas
+    -> cached: a mesma busca repetida pelo mesmo usuário (cache de RESULT_TTL)
+"""
+
+import argparse
+import itertools
+import json
+import random
+import time
+
+from benchmarks.common import measure, setup_database, summarize
+from django.contrib.auth.models import User
+from django.db.models import Q
+from chat.directory import UserDirectory
+
+FIRST_NAMES = (
+    "Ana Bruno Carla Daniel Eduarda Felipe Gabriela Heitor Isabela João Júlia Lucas "
+    "Mariana Miguel Natália Otávio Paula Rafael Sofia Thiago Valéria Vinícius"
+).split()
+SURNAMES = (
+    "Silva Santos Oliveira Souza Rodrigues Ferreira Alves Pereira Lima Gomes Costa "
+    "Ribeiro Martins Carvalho Almeida Lopes Araújo Fernandes"
+).split()
+QUERIES = ["m", "mar", "marian", "bench_user_4242", "ilva", "zzqx"]
+
+
+def seed(total, chunk=20000):
+    rng = random.Random(total)
+    current = User.objects.filter(username__startswith="bench_user_").count()
+    for offset in range(current, total, chunk):
+        User.objects.bulk_create(
+            [
+                User(
+                    username=f"bench_user_{i}",
+                    first_name=f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}",
+                    password="!",
+                )
+                for i in range(offset, min(offset + chunk, total))
+            ],
+            batch_size=1000,
+        )
+
+
+def icontains(query):
+    return list(
+        User.objects.filter(Q(username__icontains=query) | Q(first_name__icontains=query))[:10]
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    setup_database()
+    for size in sorted(args.sizes):
+        seed(size)
+        directory = UserDirectory()
+        started = time.perf_counter()
+        directory.build()
+        result = {"users": size, "build_s": round(time.perf_counter() - started, 2)}
+
+        requesters = itertools.count(2)
+        for query in QUERIES:
+            result[query] = {
+                "icontains": summarize(measure(lambda: icontains(query), max(5, args.repeat // 20))),
+                "lookup": summarize(measure(lambda: directory.lookup(query, exclude=1), args.repeat)),
+                "search": summarize(
+                    measure(lambda: directory.search(next(requesters), query), args.repeat)
+                ),
+                "cached": summarize(measure(lambda: directory.search(1, query), args.repeat)),
+            }
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
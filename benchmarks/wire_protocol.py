@@ -0,0 +1,98 @@
+"""
+Benchmark do protocolo de envio (chat/protocol.py) numa sala de 1.000 membros.
+
+    python -m benchmarks.wire_protocol --members 1000
+
+Mede:
+    -> bytes por mensagem em cada protocolo ("json" e "chat.v2")
+    -> CPU de codificação por fan-out: um json.dumps por socket (implementação antiga)
+       vs. render() uma vez por group_send
+    -> tempo de um fan-out real até todos os sockets receberem a mensagem
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+from benchmarks.common import connect_consumer, setup_database
+from channels.db import database_sync_to_async
+from django.contrib.auth.models import User
+from chat import protocol
+from chat.models import Room
+
+SAMPLE = {
+    "id": 123456,
+    "room_id": 12,
+    "content": "Bom dia a todos, alguém viu o jogo de ontem?",
+    "username": "usuario_exemplo",
+    "user_id": 4321,
+    "timestamp": "2025-11-20 22:42:00",
+    "timestamp_ms": 1763678520000,
+    "is_read": False,
+    "client_key": "4321:9f2c4e1b7a6d4f0e8c3b2a1d0e9f8a7b",
+}
+
+
+def legacy_fanout(members):
+    for _ in range(members):
+        json.dumps({
+            "type": "room",
+            "message_id": SAMPLE["id"],
+            "message": SAMPLE["content"],
+            "username": SAMPLE["username"],
+            "user_id": SAMPLE["user_id"],
+            "timestamp": SAMPLE["timestamp"],
+            "client_key": SAMPLE["client_key"],
+        })
+
+
+def timed(func, repeat=20):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def real_fanout(members, subprotocols):
+    user = (await database_sync_to_async(User.objects.get_or_create)(username="bench_wire"))[0]
+    room = (await database_sync_to_async(Room.objects.get_or_create)(name="bench_wire"))[0]
+    sockets = [
+        await connect_consumer(user, room_id=room.id, subprotocols=subprotocols)
+        for _ in range(members)
+    ]
+
+    started = time.perf_counter()
+    await sockets[0].send_json_to({"type": "room", "message": SAMPLE["content"]})
+    for socket in sockets:
+        await socket.receive_from(timeout=30)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    for socket in sockets:
+        await socket.disconnect()
+    return round(elapsed, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_database()
+    payloads = protocol.render("room", SAMPLE)
+    print(json.dumps({
+        "members": args.members,
+        "bytes_per_message": {name: len(text.encode()) for name, text in payloads.items()},
+        "encode_ms_per_fanout": {
+            "legacy_per_socket": round(timed(lambda: legacy_fanout(args.members)), 4),
+            "render_once": round(timed(lambda: protocol.render("room", SAMPLE)), 4),
+        },
+        "fanout_ms": {
+            protocol.JSON: asyncio.run(real_fanout(args.members, None)),
+            protocol.COMPACT: asyncio.run(real_fanout(args.members, [protocol.COMPACT])),
+        },
+    }))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
 from django.contrib import admin
-from .models import Room, Message
+from django.db.models import Q
+from django.utils.text import smart_split, unescape_string_literal
+from .models import Room, Message, Conversation
+from . import search
 
 
 @admin.register(Room)
 class RoomAdmin(admin.ModelAdmin):
-    list_display = ("name", "is_active", "created_at")
+    list_display = ("name", "is_active", "retention_days", "created_at")
     list_filter = ("is_active", "created_at")
     search_fields = ("name", "description")
     ordering = ("-created_at",)
     fieldsets = (
         ("Informações da Sala", {"fields": ("name", "description", "is_active")}),
+        ("Retenção", {"fields": ("retention_days",)}),
     )
 
 
@@ -20,7 +24,31 @@ class MessageAdmin(admin.ModelAdmin):
     search_fields = ("user__username", "user__first_name", "content")
     ordering = ("-timestamp",)
 
+    def get_search_results(self, request, queryset, search_term):
+        # No SQLite o conteúdo é buscado no índice FTS5 em vez de LIKE '%...%'
+        if not search_term or not search.is_available() or not search.build_match(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        # Autor como no admin (cada termo em username ou first_name), sem alterar
+        # search_fields: a instância do ModelAdmin é compartilhada entre as requisições
+        by_user = queryset
+        for term in smart_split(search_term):
+            if term[0] in "\"'" and term[-1] == term[0]:
+                term = unescape_string_literal(term)
+            by_user = by_user.filter(
+                Q(user__username__icontains=term) | Q(user__first_name__icontains=term)
+            )
+        by_content = queryset.filter(id__in=search.match_ids(search_term))
+        return by_user | by_content, False
+
     def content_preview(self, obj):
         return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
 
     content_preview.short_description = "Conteúdo"
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ("user_a", "user_b", "last_timestamp", "unread_a", "unread_b")
+    search_fields = ("user_a__username", "user_b__username")
+    ordering = ("-last_timestamp",)
+    raw_id_fields = ("user_a", "user_b", "last_message")
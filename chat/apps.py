@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "chat"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from .database import configure_connection
+
+        # Registra os sinais que invalidam o cache de salas
+        from . import signals  # noqa: F401
+
+        # Pragmas do modo SQLite concorrente em cada conexão nova
+        connection_created.connect(configure_connection)
@@ -0,0 +1,265 @@
+import asyncio
+import time
+from collections import OrderedDict
+from importlib import import_module
+
+from channels.auth import AuthMiddlewareStack
+from channels.middleware import BaseMiddleware
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth import (
+    BACKEND_SESSION_KEY,
+    HASH_SESSION_KEY,
+    SESSION_KEY,
+    get_user_model,
+    load_backend,
+)
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from .database import db_read
+
+"""
+    Autenticação dos WebSockets com cache (no lugar do AuthMiddlewareStack):
+       -> O AuthMiddleware do Channels lê a sessão e depois o usuário: duas consultas
+          por handshake, e numa onda de reconexões depois de um deploy são milhares
+       -> Cache do processo: chave de sessão -> (user_id, hash da sessão) por
+          SESSION_TTL segundos e user_id -> usuário por USER_TTL segundos. Com o
+          cache quente o handshake não faz consulta nem salta para a thread do banco
+       -> Misses simultâneos viram lotes: enquanto um lote está no banco os próximos
+          handshakes se acumulam e o lote seguinte lê todos numa consulta de sessões
+          (session_key IN ...) e uma de usuários (id IN ...)
+       -> A validação é a mesma do django.contrib.auth.get_user: backend da sessão
+          em AUTHENTICATION_BACKENDS, usuário ativo e hash da senha (ou dos
+          SECRET_KEY_FALLBACKS) igual ao gravado na sessão
+       -> Logout (user_logged_out) tira a sessão do cache e alterar o usuário (senha,
+          is_active...) tira o usuário, neste processo na hora; nos outros workers
+          vale o TTL
+       -> Com SESSION_ENGINE "signed_cookies" a sessão nem passa pelo banco, só o
+          usuário
+       -> ENABLED False volta ao AuthMiddlewareStack do Channels
+"""
+
+DEFAULTS = {
+    "ENABLED": True,
+    "SESSION_TTL": 30,
+    "USER_TTL": 30,
+    "MAX_CACHED": 10000,
+    "MAX_BATCH": 500,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_AUTH_CACHE", {}))
+    return config
+
+
+def session_store():
+    return import_module(settings.SESSION_ENGINE).SessionStore
+
+
+def read_sessions(keys):
+    """Dados das sessões válidas entre 'keys' (chave -> dict)."""
+    store = session_store()
+    if issubclass(store, DatabaseSessionStore):
+        # db e cached_db: uma consulta para o lote inteiro
+        rows = store.get_model_class().objects.filter(
+            session_key__in=keys, expire_date__gt=timezone.now()
+        ).values_list("session_key", "session_data")
+        decoder = store()
+        return {key: decoder.decode(data) for key, data in rows}
+    sessions = {}
+    for key in keys:
+        data = store(key).load()
+        if data:
+            sessions[key] = data
+    return sessions
+
+
+def read_users(backend_path, user_ids):
+    """Usuários que o backend aceitaria (user_id -> usuário)."""
+    backend = load_backend(backend_path)
+    if isinstance(backend, ModelBackend):
+        users = get_user_model()._default_manager.filter(pk__in=user_ids)
+        return {user.pk: user for user in users if backend.user_can_authenticate(user)}
+    users = {}
+    for user_id in user_ids:
+        user = backend.get_user(user_id)
+        if user is not None:
+            users[user_id] = user
+    return users
+
+
+def session_user(data):
+    """(backend, user_id) de uma sessão logada num backend aceito, ou None."""
+    backend_path = data.get(BACKEND_SESSION_KEY)
+    if SESSION_KEY not in data or backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return None
+    return backend_path, get_user_model()._meta.pk.to_python(data[SESSION_KEY])
+
+
+def session_hashes(user):
+    """Hashes de sessão aceitos para o usuário (o atual e os dos SECRET_KEY_FALLBACKS)."""
+    if not hasattr(user, "get_session_auth_hash"):
+        return None
+    return (user.get_session_auth_hash(), *user.get_session_auth_fallback_hash())
+
+
+def hash_matches(session_hash, hashes):
+    if hashes is None:
+        return True
+    return bool(session_hash) and any(
+        constant_time_compare(session_hash, accepted) for accepted in hashes
+    )
+
+
+class AuthCache:
+    def __init__(self):
+        self.sessions = OrderedDict()  # chave -> (user_id, hash, expira_em)
+        self.users = OrderedDict()  # user_id -> (usuário, hashes aceitos, expira_em)
+        self.pending = {}  # chave -> future dos handshakes esperando o próximo lote
+        self.flushing = False
+        self.loop = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "batches": 0,
+            "sessions_loaded": 0,
+            "users_loaded": 0,
+            "rejected": 0,
+            "invalidations": 0,
+        }
+
+    def lookup(self, session_key):
+        """Usuário da sessão se sessão e usuário estão no cache, senão None."""
+        now = time.monotonic()
+        session = self.sessions.get(session_key)
+        if session is None or session[2] <= now:
+            return None
+        user = self.users.get(session[0])
+        if user is None or user[2] <= now or not hash_matches(session[1], user[1]):
+            return None
+        return user[0]
+
+    async def aget_user(self, session_key):
+        """Usuário do handshake: do cache ou do próximo lote de leituras."""
+        if not session_key:
+            return AnonymousUser()
+        user = self.lookup(session_key)
+        if user is not None:
+            self.stats["hits"] += 1
+            return user
+
+        self.stats["misses"] += 1
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.pending = {}
+            self.flushing = False
+        future = self.pending.get(session_key)
+        if future is None:
+            future = self.pending[session_key] = loop.create_future()
+            if not self.flushing:
+                self.flushing = True
+                loop.create_task(self.flush())
+        return await future
+
+    async def flush(self):
+        try:
+            while self.pending:
+                batch = dict(list(self.pending.items())[: get_config()["MAX_BATCH"]])
+                for key in batch:
+                    del self.pending[key]
+                try:
+                    users = await db_read(self.load)(list(batch))
+                except Exception as error:
+                    for future in batch.values():
+                        if not future.done():
+                            future.set_exception(error)
+                    continue
+                for key, future in batch.items():
+                    if not future.done():
+                        future.set_result(users.get(key) or AnonymousUser())
+        finally:
+            self.flushing = False
+
+    def load(self, keys):
+        """Lê um lote de sessões e os usuários que faltam no cache (na thread do banco)."""
+        config = get_config()
+        now = time.monotonic()
+        self.stats["batches"] += 1
+        sessions = read_sessions(keys)
+        self.stats["sessions_loaded"] += len(sessions)
+
+        by_backend = {}
+        logged_in = {}
+        for key, data in sessions.items():
+            session = session_user(data)
+            if session is None:
+                continue
+            backend_path, user_id = logged_in[key] = session
+            cached = self.users.get(user_id)
+            if cached is None or cached[2] <= now:
+                by_backend.setdefault(backend_path, set()).add(user_id)
+
+        for backend_path, user_ids in by_backend.items():
+            loaded = read_users(backend_path, list(user_ids))
+            self.stats["users_loaded"] += len(loaded)
+            for user_id in user_ids:
+                self.users.pop(user_id, None)
+            for user_id, user in loaded.items():
+                self.users[user_id] = (user, session_hashes(user), now + config["USER_TTL"])
+
+        resolved = {}
+        for key, (_, user_id) in logged_in.items():
+            user = self.users.get(user_id)
+            session_hash = sessions[key].get(HASH_SESSION_KEY)
+            self.sessions.pop(key, None)
+            if user is None or not hash_matches(session_hash, user[1]):
+                self.stats["rejected"] += 1
+                continue
+            self.sessions[key] = (user_id, session_hash, now + config["SESSION_TTL"])
+            resolved[key] = user[0]
+
+        for entries in (self.sessions, self.users):
+            while len(entries) > config["MAX_CACHED"]:
+                entries.popitem(last=False)
+        return resolved
+
+    def discard_session(self, session_key):
+        if self.sessions.pop(session_key, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def discard_user(self, user_id):
+        if self.users.pop(user_id, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def clear(self):
+        self.sessions.clear()
+        self.users.clear()
+
+    def get_stats(self):
+        return {**self.stats, "sessions": len(self.sessions), "users": len(self.users)}
+
+
+auth_cache = AuthCache()
+
+
+class CachedAuthMiddleware(BaseMiddleware):
+    """Preenche scope["user"] pelo auth_cache (precisa do CookieMiddleware antes)."""
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        session_key = scope.get("cookies", {}).get(settings.SESSION_COOKIE_NAME)
+        scope["user"] = await auth_cache.aget_user(session_key)
+        return await super().__call__(scope, receive, send)
+
+
+def CachedAuthMiddlewareStack(inner):
+    if not get_config()["ENABLED"]:
+        return AuthMiddlewareStack(inner)
+    # SessionMiddleware mantém scope["session"] (preguiçoso: só lê se alguém usar)
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import struct
+import time
+
+"""
+    Broker local para o channel layer multi-processo (chat/layers.py):
+       -> Cada worker (processo do Daphne) abre uma conexão por Unix domain socket
+       -> O broker guarda os grupos (grupo -> canais) de todos os workers
+       -> group_send é resolvido aqui: um único frame por worker com a lista de
+          canais locais daquele worker, em vez de um frame por canal
+       -> Canais específicos ("specific.<worker>!<id>") são roteados para o worker dono
+       -> Quando um worker cai, os canais dele saem de todos os grupos (se ele já
+          reconectou com o mesmo id, a conexão nova e os grupos dela ficam)
+       -> Backpressure: depois de cada frame o broker espera o buffer de saída do
+          próprio remetente escoar; entregas para um worker cujo buffer passou de
+          max_buffer bytes são descartadas (o worker não está lendo), como o
+          ChannelFull de um canal cheio
+
+    Os frames são JSON precedidos pelo tamanho (4 bytes, big-endian).
+"""
+
+HEADER = struct.Struct("!I")
+
+
+async def read_frame(reader):
+    header = await reader.readexactly(HEADER.size)
+    (size,) = HEADER.unpack(header)
+    return json.loads(await reader.readexactly(size))
+
+
+def encode_frame(frame):
+    payload = json.dumps(frame, separators=(",", ":")).encode()
+    return HEADER.pack(len(payload)) + payload
+
+
+def channel_owner(channel):
+    """Id do worker dono de um canal específico ('prefixo.<worker>!<id>')."""
+    if "!" not in channel:
+        return None
+    return channel[: channel.index("!")].rsplit(".", 1)[-1]
+
+
+class Broker:
+    def __init__(self, group_expiry=86400, max_buffer=4 * 1024 * 1024):
+        self.group_expiry = group_expiry
+        self.max_buffer = max_buffer
+        self.clients = {}
+        self.groups = {}
+        self.stats = {"frames_in": 0, "frames_out": 0, "group_sends": 0, "dropped": 0}
+
+    async def handle_client(self, reader, writer):
+        client_id = None
+        try:
+            hello = await read_frame(reader)
+            client_id = hello["client"]
+            self.clients[client_id] = writer
+
+            while True:
+                frame = await read_frame(reader)
+                self.stats["frames_in"] += 1
+                self.dispatch(frame)
+                if "seq" in frame:
+                    self.write(writer, {"op": "ack", "seq": frame["seq"]})
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # Um worker que reconectou já tem outra conexão com o mesmo id: a antiga
+            # não pode levar embora os canais e os grupos da nova
+            if client_id is not None and self.clients.get(client_id) is writer:
+                del self.clients[client_id]
+                self.drop_client_channels(client_id)
+            writer.close()
+
+    def dispatch(self, frame):
+        op = frame["op"]
+        if op == "send":
+            self.deliver(frame["channel"], [frame["channel"]], frame["message"])
+        elif op == "group_add":
+            self.groups.setdefault(frame["group"], {})[frame["channel"]] = time.time()
+        elif op == "group_discard":
+            members = self.groups.get(frame["group"])
+            if members:
+                members.pop(frame["channel"], None)
+                if not members:
+                    self.groups.pop(frame["group"], None)
+        elif op == "group_send":
+            self.group_send(frame["group"], frame["message"])
+        elif op == "flush":
+            self.groups = {}
+
+    def group_send(self, group, message):
+        self.stats["group_sends"] += 1
+        members = self.groups.get(group)
+        if not members:
+            return
+
+        # Remove membros expirados e agrupa os canais por worker
+        expired_before = time.time() - self.group_expiry
+        by_client = {}
+        for channel, joined in list(members.items()):
+            if joined < expired_before:
+                members.pop(channel, None)
+                continue
+            by_client.setdefault(channel_owner(channel), []).append(channel)
+
+        for client_id, channels in by_client.items():
+            self.deliver(channels[0], channels, message)
+
+    def deliver(self, routing_channel, channels, message):
+        writer = self.clients.get(channel_owner(routing_channel))
+        if writer is None:
+            return
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            self.stats["dropped"] += 1
+            return
+        self.write(writer, {"op": "deliver", "channels": channels, "message": message})
+
+    def write(self, writer, frame):
+        if not writer.is_closing():
+            writer.write(encode_frame(frame))
+            self.stats["frames_out"] += 1
+
+    def drop_client_channels(self, client_id):
+        for group, members in list(self.groups.items()):
+            for channel in list(members):
+                if channel_owner(channel) == client_id:
+                    members.pop(channel, None)
+            if not members:
+                self.groups.pop(group, None)
+
+
+async def serve(path, group_expiry=86400, max_buffer=4 * 1024 * 1024):
+    """Roda o broker no Unix domain socket 'path' até ser cancelado."""
+    if os.path.exists(path):
+        os.unlink(path)
+
+    broker = Broker(group_expiry=group_expiry, max_buffer=max_buffer)
+    server = await asyncio.start_unix_server(broker.handle_client, path=path)
+    os.chmod(path, 0o600)
+    async with server:
+        await server.serve_forever()
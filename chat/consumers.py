@@ -1,8 +1,23 @@
+import functools
 import json
+import time
+import uuid
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from django.db import transaction
 from .models import Room, Message
+from .conversations import record_direct_messages
+from .database import db_read, db_write, uses_async_orm
+from .directory import user_directory
+from .metrics import metrics
+from .outbound import OutboundQueue, get_config as get_outbound_config
+from .presence import presence
+from .ratelimit import rate_limiter
+from .recent import recent_messages
+from .rooms import room_cache
+from .tracing import tracer
+from . import persistence, protocol, receipts
 
 """
     Mensagens em Salas (Room Chat):
@@ -10,17 +25,32 @@ from .models import Room, Message
        -> Ele é conectado diretamente a um grupo (neste caso a sala)
        -> Mensagens enviadas são salvas com 'room' definido e 'user_to' = None
        -> As mensagens são enviadas para todos os usuários conectados ao grupo
+       -> Ao reconectar com ?last_message_id=N recebe só as mensagens posteriores a N
+          (chat/recent.py) seguidas de um evento "resume"
     
     Mensagens Diretas (Direct Messages):
        -> Usuário se conecta a um chat privado com outro usuário
        -> Mensagens enviadas são salvas com 'user_to' definido e 'room' = None
        -> As mensagens são enviadas apenas para o destinatário específico
+
+    Envio: os handlers escrevem direto enquanto o buffer do transporte escoa; com o
+    cliente lendo devagar os frames vão para uma fila limitada (chat/outbound.py)
+
+    Socket multiplexado (ws/chat/, MultiplexConsumer): uma conexão por usuário com as
+    mensagens diretas e as salas inscritas por comandos subscribe/unsubscribe
+
+    Limite: cada mensagem passa pelos token buckets da conexão, do usuário e da sala
+    antes de ser gravada; acima do limite o socket recebe "rate_limited" (chat/ratelimit.py)
 """
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    # Trace da mensagem em tratamento (chat/tracing.py); None quando não amostrada
+    trace = None
+
     async def connect(self):
         self.room_id = self.scope["url_route"]["kwargs"].get("room_id")
         self.user = self.scope["user"]
+        self.protocol = protocol.negotiate(self.scope.get("subprotocols"))
         
         if not self.user.is_authenticated:
             await self.close()
@@ -28,156 +58,469 @@ class ChatConsumer(AsyncWebsocketConsumer):
         
         # Determina o tipo de chat (sala ou dm)
         if self.room_id:
+            # Metadados da sala vêm do cache do processo (sem consulta com o cache quente)
+            room = await room_cache.aget(self.room_id)
+            if room is None or not room.is_active:
+                await self.close()
+                return
+            self.room_id = room.id
             self.chat_type = "room"
             self.group_name = f"chat_room_{self.room_id}"
         else:
             self.chat_type = "direct"
             self.group_name = f"chat_user_{self.user.id}"
         
+        await self.open()
+
+        if self.chat_type == "room":
+            recent_messages.attach(self.room_id)
+            self.attached = True
+            await recent_messages.ensure_warm(self.room_id)
+            last_message_id = self.get_last_message_id()
+            if last_message_id is not None:
+                await self.resume(self.room_id, last_message_id)
+
+        # Presença: entra na contagem da sala (ou só como online, no chat direto)
+        await presence.ensure_started()
+        presence.join(self.room_id if self.chat_type == "room" else None, self.user.id)
+        self.present = True
+
+    async def open(self):
+        """Entra no grupo do socket, aceita a conexão e prepara a fila de saída e o limite."""
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        
-        await self.accept()
+        metrics.group_joined(self.group_name)
+
+        if self.protocol == protocol.COMPACT:
+            await self.accept(subprotocol=protocol.COMPACT)
+        else:
+            await self.accept()
+        metrics.connected(self.endpoint())
+
+        self.outbound = OutboundQueue(
+            self.write_frame, self.evict, self.scope.get("write_buffer")
+        )
+        # Sala -> id da última mensagem entregue pela retomada
+        self.last_sent = {}
+        self.rate_bucket = rate_limiter.connection_bucket()
+        self.typing_bucket = rate_limiter.connection_bucket("TYPING")
+        # Destinatários de digitação já validados por este socket
+        self.typing_peers = set()
+        await rate_limiter.ensure_started()
 
     async def disconnect(self, close_code):
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            metrics.group_left(self.group_name)
+        if hasattr(self, "outbound"):
+            self.outbound.close()
+            metrics.disconnected(self.endpoint())
+        if getattr(self, "attached", False):
+            recent_messages.detach(self.room_id)
+        if getattr(self, "present", False):
+            presence.leave(self.room_id if self.chat_type == "room" else None, self.user.id)
+
+        # Garante que as mensagens pendentes do lote sejam gravadas antes de encerrar
+        if persistence.is_batched():
+            await persistence.get_batcher().flush()
+        await receipts.get_receipts().flush()
 
     async def receive(self, text_data):
+        self.trace = tracer.start(self.endpoint())
+        try:
+            await self.handle_frame(json.loads(text_data))
+        except json.JSONDecodeError:
+            await self.send_event("error", {"error": "Formato JSON inválido"})
+        except Exception as e:
+            await self.send_event("error", {"error": str(e)})
+
+    async def handle_frame(self, data):
         """
         Formato esperado:
         - Para sala: {"message": "texto", "type": "room"}
         - Para dm: {"message": "texto", "type": "direct", "user_to_id": 123}
+        - Opcional: "client_key" (chave de idempotência gerada pelo cliente)
+        - Digitação: {"type": "typing"} (sala) ou {"type": "typing", "user_to_id": 123};
+          "active": false encerra antes de expirar
+        O formato de entrada é o mesmo nos dois protocolos (ver chat/protocol.py).
         """
-        try:
-            text_data_json = json.loads(text_data)
-            message_content = text_data_json.get("message", "").strip()
-            message_type = text_data_json.get("type", "room")
-            user_to_id = text_data_json.get("user_to_id")
-            
-            if not message_content:
-                return
-            
-            if message_type == "direct" and user_to_id:
-                saved_message = await self.save_direct_message(message_content, user_to_id)
-                
-                recipient_group = f"chat_user_{user_to_id}"
-                await self.channel_layer.group_send(
-                    recipient_group,
-                    {
-                        "type": "direct_message",
-                        "message_id": saved_message["id"],
-                        "message": saved_message["content"],
-                        "username": saved_message["username"],
-                        "user_id": saved_message["user_id"],
-                        "timestamp": saved_message["timestamp"],
-                        "is_read": saved_message["is_read"],
-                    },
-                )
-                
-                # Envia também para o próprio remetente (para aparecer imediatamente)
-                sender_group = f"chat_user_{self.user.id}"
-                await self.channel_layer.group_send(
-                    sender_group,
-                    {
-                        "type": "direct_message",
-                        "message_id": saved_message["id"],
-                        "message": saved_message["content"],
-                        "username": saved_message["username"],
-                        "user_id": saved_message["user_id"],
-                        "timestamp": saved_message["timestamp"],
-                        "is_read": True,
-                    },
-                )
-                
-            else:
-                saved_message = await self.save_room_message(message_content)
-                
-                await self.channel_layer.group_send(
-                    self.group_name,
-                    {
-                        "type": "room_message",
-                        "message_id": saved_message["id"],
-                        "message": saved_message["content"],
-                        "username": saved_message["username"],
-                        "user_id": saved_message["user_id"],
-                        "timestamp": saved_message["timestamp"],
-                    },
-                )
-                
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({"error": "Formato JSON inválido"}))
-        except Exception as e:
-            await self.send(text_data=json.dumps({"error": str(e)}))
+        message_content = data.get("message", "").strip()
+        message_type = data.get("type", "room")
+        user_to_id = data.get("user_to_id")
+        client_key = data.get("client_key")
+        room_id = self.frame_room(data)
+
+        if message_type == "typing":
+            await self.update_typing(user_to_id, room_id, data.get("active", True))
+            return
+
+        if not message_content:
+            return
+
+        # Antes de gravar e distribuir: um cliente inundando a sala não custa nada
+        is_direct = message_type == "direct" and user_to_id
+        metrics.message_received("direct" if is_direct else "room")
+        limited = rate_limiter.check(
+            self.user.id, None if is_direct else room_id, self.rate_bucket
+        )
+        if limited is not None:
+            scope, retry_after_ms = limited
+            await self.queue_frame(
+                protocol.encode(
+                    self.protocol,
+                    "rate_limited",
+                    {"scope": scope, "retry_after_ms": retry_after_ms, "client_key": client_key},
+                ),
+                key="rate_limited",
+            )
+            return
+
+        trace = self.trace
+        if trace is not None:
+            trace.kind = "direct" if is_direct else "room"
+            trace.room_id = None if is_direct else room_id
+            trace.mark("parse")
+
+        if is_direct:
+            saved_message = await self.save_direct_message(
+                message_content, user_to_id, client_key
+            )
+            if trace is not None:
+                trace.mark("save")
+            presence.set_direct_typing(int(user_to_id), self.user.id, active=False)
+
+            # Codificado uma única vez; o mesmo evento vai para o destinatário e
+            # para o próprio remetente (para aparecer imediatamente)
+            event = protocol.event(
+                "direct",
+                saved_message,
+                handler="direct_message",
+                message_id=saved_message["id"],
+                user_id=saved_message["user_id"],
+                client_key=saved_message["client_key"],
+            )
+            if trace is not None:
+                event["trace"] = trace.context()
+            for group in (f"chat_user_{user_to_id}", f"chat_user_{self.user.id}"):
+                metrics.group_sent("direct", group)
+                await self.channel_layer.group_send(group, event)
+
+        else:
+            saved_message = await self.save_room_message(message_content, client_key, room_id)
+            if trace is not None:
+                trace.mark("save")
+            presence.set_typing(room_id, self.user.id, active=False)
+
+            event = protocol.event(
+                "room",
+                saved_message,
+                handler="room_message",
+                room_id=room_id,
+                message_id=saved_message["id"],
+                message=saved_message,
+            )
+            if trace is not None:
+                event["trace"] = trace.context()
+            metrics.group_sent("room", f"chat_room_{room_id}")
+            await self.channel_layer.group_send(f"chat_room_{room_id}", event)
+
+        if trace is not None:
+            trace.mark("group_send")
+
+    def frame_room(self, data):
+        """Sala a que o frame se refere: a do socket (None no chat direto)."""
+        return self.room_id if self.chat_type == "room" else None
+
+    def endpoint(self):
+        # Rótulo das métricas de conexão (chat/metrics.py)
+        return self.chat_type
+
+    async def update_typing(self, user_to_id, room_id, active):
+        # Só marca em memória; o aviso sai agregado no próximo tick (chat/presence.py)
+        if not rate_limiter.check_typing(self.typing_bucket):
+            return
+        if user_to_id:
+            user_to_id = int(user_to_id)
+            # Só para usuários que existem: qualquer id viraria um grupo chat_user_<id>
+            if user_to_id not in self.typing_peers:
+                if not await user_directory.user_exists(user_to_id):
+                    raise User.DoesNotExist("User matching query does not exist.")
+                self.typing_peers.add(user_to_id)
+            presence.set_direct_typing(user_to_id, self.user.id, bool(active))
+        elif room_id is not None:
+            presence.set_typing(room_id, self.user.id, bool(active))
+
+    async def send_event(self, kind, data):
+        """Envia um evento só para este socket, no protocolo negociado."""
+        await self.queue_frame(protocol.encode(self.protocol, kind, data))
+
+    async def chat_payload(self, event):
+        """Handler genérico: enfileira o payload já codificado no protocolo deste socket."""
+        context = event.get("trace")
+        written = None
+        if context is not None:
+            # Mensagem amostrada: as etapas deste lado fecham quando o frame for escrito
+            written = functools.partial(tracer.delivered, context, time.time())
+        await self.queue_frame(event["payloads"][self.protocol], event.get("coalesce"), written)
+
+    async def queue_frame(self, text, key=None, written=None):
+        # 'key' identifica eventos de estado que podem substituir o anterior (coalesce)
+        await self.outbound.put(text, key, written)
+
+    async def write_frame(self, text):
+        await self.send(text_data=text)
+        metrics.frame_sent()
+
+    async def evict(self):
+        # Cliente lento demais: fecha para ele reconectar em vez de acumular frames
+        await self.close(code=get_outbound_config()["CLOSE_CODE"])
 
     async def room_message(self, event):
-        await self.send(
-            text_data=json.dumps({
-                "type": "room",
-                "message_id": event["message_id"],
-                "message": event["message"],
-                "username": event["username"],
-                "user_id": event["user_id"],
-                "timestamp": event["timestamp"],
-            })
+        room_id = event.get("room_id", self.room_id)
+        message_id = event.get("message_id")
+        recent_messages.record(room_id, event.get("message"), event["payloads"])
+        # Já entregue pela retomada (chegou ao grupo enquanto o connect respondia)
+        last_sent_id = self.last_sent.get(room_id)
+        if last_sent_id is not None and message_id is not None:
+            if message_id <= last_sent_id:
+                return
+        await self.chat_payload(event)
+
+    def get_last_message_id(self):
+        params = parse_qs(self.scope.get("query_string", b"").decode())
+        try:
+            return int(params["last_message_id"][0])
+        except (KeyError, ValueError):
+            return None
+
+    async def resume(self, room_id, last_message_id):
+        """Envia as mensagens da sala posteriores a last_message_id e um evento "resume"."""
+        rows = None
+        if not persistence.is_batched():
+            rows = recent_messages.since(room_id, last_message_id)
+        complete = True
+        if rows is None:
+            rows, complete = await db_read(recent_messages.load_gap)(room_id, last_message_id)
+
+        for message_id, payloads in rows:
+            await self.queue_frame(payloads[self.protocol])
+        if rows:
+            self.last_sent[room_id] = rows[-1][0]
+        await self.send_event(
+            "resume", {"room_id": room_id, "replayed": len(rows), "complete": complete}
         )
 
+    async def room_updated(self, event):
+        # Sala alterada (admin, outro worker...): descarta o cache e fecha se foi desativada
+        room_cache.invalidate()
+        if not event["is_active"]:
+            await self.chat_payload(event)
+            await self.outbound.flush(timeout=self.outbound.send_timeout)
+            await self.close()
+
     async def direct_message(self, event):
-        await self.mark_message_as_read(event["message_id"])
-        
-        await self.send(
-            text_data=json.dumps({
-                "type": "direct",
-                "message_id": event["message_id"],
-                "message": event["message"],
-                "username": event["username"],
-                "user_id": event["user_id"],
-                "timestamp": event["timestamp"],
-                "is_read": True,  # Marca como lida ao receber
-            })
-        )
+        # O eco para o próprio remetente não é uma leitura
+        if event["user_id"] != self.user.id:
+            await self.mark_message_as_read(event)
 
-    @database_sync_to_async
-    def save_room_message(self, message_content):
-        room = Room.objects.get(id=self.room_id)
-        msg = Message.objects.create(
-            room=room,
-            user=self.user,
-            content=message_content,
-            user_to=None
+        await self.chat_payload(event)
+
+    @metrics.timed("save_room_message")
+    async def save_room_message(self, message_content, client_key=None, room_id=None):
+        room = await room_cache.aget(room_id)
+        if room is None or not room.is_active:
+            raise Room.DoesNotExist("Sala indisponível.")
+
+        client_key = self.make_client_key(client_key)
+        if persistence.is_batched():
+            msg = persistence.build_message(
+                self.user, message_content, client_key, room_id=room.id
+            )
+            msg = await persistence.get_batcher().enqueue(msg, self.message_dropped)
+            return self.serialize_message(msg)
+        if uses_async_orm():
+            msg = await Message.objects.acreate(
+                room_id=room.id,
+                user=self.user,
+                content=message_content,
+                user_to=None,
+                client_key=client_key,
+            )
+            return self.serialize_message(msg)
+        return await self.create_room_message(message_content, client_key, room.id)
+
+    @metrics.timed("save_direct_message")
+    async def save_direct_message(self, message_content, user_to_id, client_key=None):
+        client_key = self.make_client_key(client_key)
+        if persistence.is_batched():
+            # A mensagem sai antes de ser gravada: o destinatário é conferido agora
+            user_to_id = int(user_to_id)
+            if not await user_directory.user_exists(user_to_id):
+                raise User.DoesNotExist("User matching query does not exist.")
+            msg = persistence.build_message(
+                self.user, message_content, client_key, user_to_id=user_to_id
+            )
+            msg = await persistence.get_batcher().enqueue(msg, self.message_dropped)
+            return self.serialize_message(msg)
+        return await self.create_direct_message(message_content, user_to_id, client_key)
+
+    async def message_dropped(self, message):
+        # Persistência em lote: a mensagem já distribuída não foi gravada no flush
+        await self.send_event(
+            "failed", {"client_key": message.client_key, "error": "Mensagem não gravada."}
         )
+
+    def make_client_key(self, client_key):
+        return persistence.make_client_key(self.user.id, client_key or uuid.uuid4().hex)
+
+    def serialize_message(self, msg):
         return {
+            # No modo em lote o id só existe depois do flush; a client_key identifica a mensagem
             "id": msg.id,
+            "room_id": msg.room_id,
             "content": msg.content,
-            "username": msg.user.username,
-            "user_id": msg.user.id,
+            "username": self.user.username,
+            "user_id": self.user.id,
             "timestamp": msg.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "timestamp_ms": int(msg.timestamp.timestamp() * 1000),
+            "is_read": msg.is_read,
+            "client_key": msg.client_key,
         }
 
-    @database_sync_to_async
-    def save_direct_message(self, message_content, user_to_id):
-        user_to = User.objects.get(id=user_to_id)
+    @db_write
+    def create_room_message(self, message_content, client_key, room_id):
         msg = Message.objects.create(
-            room=None,
+            room_id=room_id,
             user=self.user,
-            user_to=user_to,
             content=message_content,
-            is_read=False
+            user_to=None,
+            client_key=client_key,
         )
-        return {
-            "id": msg.id,
-            "content": msg.content,
-            "username": msg.user.username,
-            "user_id": msg.user.id,
-            "timestamp": msg.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            "is_read": msg.is_read,
-        }
+        return self.serialize_message(msg)
+
+    # Também no modo "async": mensagem e conversa precisam da mesma transação
+    @db_write
+    def create_direct_message(self, message_content, user_to_id, client_key):
+        user_to = User.objects.get(id=user_to_id)
+        with transaction.atomic():
+            msg = Message.objects.create(
+                room=None,
+                user=self.user,
+                user_to=user_to,
+                content=message_content,
+                is_read=False,
+                client_key=client_key,
+            )
+            record_direct_messages([msg])
+        return self.serialize_message(msg)
 
-    @database_sync_to_async
-    def mark_message_as_read(self, message_id):
+    @metrics.timed("mark_message_as_read")
+    async def mark_message_as_read(self, event):
+        # Mensagens ainda no lote pendente são marcadas em memória
+        if persistence.is_batched() and persistence.get_batcher().mark_read(
+            event["client_key"], self.user.id
+        ):
+            return
+        receipts.get_receipts().add(
+            self.user.id, event["user_id"], event["message_id"], event["client_key"]
+        )
+
+
+# Máximo de salas inscritas num mesmo socket multiplexado
+MAX_SUBSCRIPTIONS = 50
+
+
+class MultiplexConsumer(ChatConsumer):
+    """
+    Um socket por usuário (ws/chat/) para as mensagens diretas e várias salas:
+       -> Conecta já no grupo do usuário (DMs e digitação), como ws/chat/direct/
+       -> Salas entram e saem por comandos na própria conexão:
+            {"type": "subscribe", "room_id": 1, "last_message_id": 10}  (last_message_id opcional)
+            {"type": "unsubscribe", "room_id": 1}
+          respondidos com "subscribed"/"unsubscribed" (e "resume" com last_message_id)
+       -> Mensagens e digitação de sala levam o room_id: {"type": "room", "room_id": 1, "message": "..."}
+       -> Os eventos enviados são os mesmos dos sockets separados; os de sala trazem
+          room_id para o cliente saber a que sala pertencem
+    Uma aba com cinco salas abertas usa uma conexão, um handshake e uma fila de saída
+    em vez de seis.
+    """
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        self.protocol = protocol.negotiate(self.scope.get("subprotocols"))
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.room_id = None
+        self.chat_type = "direct"
+        self.group_name = f"chat_user_{self.user.id}"
+        self.rooms = set()
+        await self.open()
+
+        await presence.ensure_started()
+        presence.join(None, self.user.id)
+        self.present = True
+
+    async def disconnect(self, close_code):
+        for room_id in list(getattr(self, "rooms", ())):
+            await self.leave_room(room_id)
+        await super().disconnect(close_code)
+
+    async def handle_frame(self, data):
+        message_type = data.get("type")
+        if message_type == "subscribe":
+            await self.subscribe(data.get("room_id"), data.get("last_message_id"))
+        elif message_type == "unsubscribe":
+            room_id = self.frame_room(data)
+            if room_id is not None:
+                await self.leave_room(room_id)
+                await self.send_event("unsubscribed", {"room_id": room_id})
+        else:
+            await super().handle_frame(data)
+
+    def endpoint(self):
+        return "multiplex"
+
+    def frame_room(self, data):
+        # Só salas inscritas neste socket; as outras são tratadas como indisponíveis
         try:
-            msg = Message.objects.get(id=message_id, user_to=self.user)
-            if not msg.is_read:
-                msg.is_read = True
-                msg.save()
-        except Message.DoesNotExist:
-            pass
+            room_id = int(data.get("room_id"))
+        except (TypeError, ValueError):
+            return None
+        return room_id if room_id in self.rooms else None
+
+    async def subscribe(self, room_id, last_message_id=None):
+        room = await room_cache.aget(room_id)
+        if room is None or not room.is_active:
+            raise Room.DoesNotExist("Sala indisponível.")
+
+        if room.id not in self.rooms:
+            if len(self.rooms) >= MAX_SUBSCRIPTIONS:
+                raise ValueError(f"Limite de {MAX_SUBSCRIPTIONS} salas por conexão.")
+            self.rooms.add(room.id)
+            await self.channel_layer.group_add(f"chat_room_{room.id}", self.channel_name)
+            metrics.group_joined(f"chat_room_{room.id}")
+            recent_messages.attach(room.id)
+            await recent_messages.ensure_warm(room.id)
+            presence.join(room.id, self.user.id)
+
+        await self.send_event("subscribed", {"room_id": room.id})
+        if last_message_id is not None:
+            await self.resume(room.id, int(last_message_id))
+
+    async def leave_room(self, room_id):
+        self.rooms.discard(room_id)
+        self.last_sent.pop(room_id, None)
+        await self.channel_layer.group_discard(f"chat_room_{room_id}", self.channel_name)
+        metrics.group_left(f"chat_room_{room_id}")
+        recent_messages.detach(room_id)
+        presence.leave(room_id, self.user.id)
+
+    async def room_updated(self, event):
+        # Sala desativada: avisa e sai só dela; o socket continua com as outras
+        room_cache.invalidate()
+        room_id = event.get("room_id")
+        if not event["is_active"] and room_id in self.rooms:
+            await self.chat_payload(event)
+            await self.leave_room(room_id)
@@ -0,0 +1,135 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Greatest
+from .models import Conversation, Message
+
+"""
+    Manutenção da tabela Conversation (inbox das mensagens diretas):
+       -> Cada mensagem direta gravada atualiza a última mensagem do par e
+          incrementa o contador de não lidas do destinatário
+       -> Marcar mensagens como lidas decrementa (ou zera) o contador do leitor
+       -> Deve ser chamado dentro da mesma transação que grava/atualiza as mensagens
+"""
+
+
+def ordered_pair(user_id, other_id):
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+def unread_field(reader_id, other_id):
+    return "unread_a" if reader_id < other_id else "unread_b"
+
+
+def record_direct_messages(messages):
+    """Atualiza as conversas a partir de mensagens diretas já gravadas (com id)."""
+    latest = {}
+    unread = defaultdict(lambda: {"unread_a": 0, "unread_b": 0})
+
+    for msg in messages:
+        if msg.user_to_id is None or msg.id is None:
+            continue
+        pair = ordered_pair(msg.user_id, msg.user_to_id)
+        if pair not in latest or (msg.timestamp, msg.id) > (
+            latest[pair].timestamp,
+            latest[pair].id,
+        ):
+            latest[pair] = msg
+        if not msg.is_read:
+            unread[pair][unread_field(msg.user_to_id, msg.user_id)] += 1
+
+    with transaction.atomic():
+        for (user_a, user_b), msg in latest.items():
+            counts = unread[(user_a, user_b)]
+            conversation, created = Conversation.objects.get_or_create(
+                user_a_id=user_a,
+                user_b_id=user_b,
+                defaults={
+                    "last_message": msg,
+                    "last_timestamp": msg.timestamp,
+                    **counts,
+                },
+            )
+            if created:
+                continue
+
+            updates = {
+                "unread_a": F("unread_a") + counts["unread_a"],
+                "unread_b": F("unread_b") + counts["unread_b"],
+            }
+            if msg.timestamp >= conversation.last_timestamp:
+                updates.update(last_message=msg, last_timestamp=msg.timestamp)
+            Conversation.objects.filter(pk=conversation.pk).update(**updates)
+
+
+def mark_conversation_read(reader_id, other_user_id):
+    """Zera as não lidas do leitor na conversa com other_user_id."""
+    user_a, user_b = ordered_pair(reader_id, other_user_id)
+    Conversation.objects.filter(user_a_id=user_a, user_b_id=user_b).update(
+        **{unread_field(reader_id, other_user_id): 0}
+    )
+
+
+def decrement_unread(reader_id, other_user_id, count=1):
+    user_a, user_b = ordered_pair(reader_id, other_user_id)
+    field = unread_field(reader_id, other_user_id)
+    Conversation.objects.filter(user_a_id=user_a, user_b_id=user_b).update(
+        **{field: Greatest(F(field) - count, 0)}
+    )
+
+
+def inbox(user):
+    """Conversas do usuário, da mais recente para a mais antiga."""
+    return (
+        Conversation.objects.filter(Q(user_a=user) | Q(user_b=user))
+        .select_related("user_a", "user_b", "last_message")
+        .order_by("-last_timestamp")
+    )
+
+
+def rebuild_conversations():
+    """
+    Recria a tabela Conversation a partir das mensagens diretas (usado depois de
+    cargas em massa que não passam por record_direct_messages).
+    """
+    directions = (
+        Message.objects.filter(user_to__isnull=False)
+        .values("user_id", "user_to_id")
+        .annotate(last_id=Max("id"), unread=Count("id", filter=Q(is_read=False)))
+        .order_by()
+    )
+
+    pairs = {}
+    for row in directions.iterator():
+        pair = pairs.setdefault(
+            ordered_pair(row["user_id"], row["user_to_id"]),
+            {"last_id": 0, "unread_a": 0, "unread_b": 0},
+        )
+        pair["last_id"] = max(pair["last_id"], row["last_id"])
+        pair[unread_field(row["user_to_id"], row["user_id"])] += row["unread"]
+
+    last_ids = [pair["last_id"] for pair in pairs.values()]
+    timestamps = {}
+    for start in range(0, len(last_ids), 500):
+        timestamps.update(
+            Message.objects.filter(id__in=last_ids[start:start + 500]).values_list("id", "timestamp")
+        )
+
+    with transaction.atomic():
+        Conversation.objects.all().delete()
+        Conversation.objects.bulk_create(
+            [
+                Conversation(
+                    user_a_id=user_a,
+                    user_b_id=user_b,
+                    last_message_id=pair["last_id"],
+                    last_timestamp=timestamps[pair["last_id"]],
+                    unread_a=pair["unread_a"],
+                    unread_b=pair["unread_b"],
+                )
+                for (user_a, user_b), pair in pairs.items()
+            ],
+            batch_size=1000,
+        )
+    return len(pairs)
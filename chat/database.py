@@ -0,0 +1,179 @@
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+"""
+    Modo SQLite de alta concorrência (CHAT_SQLITE["MODE"] = "concurrent"):
+       -> Cada conexão nova recebe os PRAGMAS configurados (WAL, synchronous=NORMAL,
+          busy_timeout, mmap_size...): no WAL leitores não bloqueiam o escritor
+       -> Conexões persistentes (CONN_MAX_AGE) e transações BEGIN IMMEDIATE
+          (configurados em settings.DATABASES)
+       -> Todas as gravações de mensagens e confirmações de leitura passam por uma
+          única thread escritora do processo (db_write), então os consumers do mesmo
+          worker nunca disputam o lock de escrita entre si
+       -> As leituras (db_read) rodam em paralelo no pool de threads
+    No modo "default" db_write e db_read equivalem ao database_sync_to_async.
+
+    Caminho dos consumers até o banco (CHAT_DB["MODE"], qualquer banco):
+       -> "sync" (padrão): database_sync_to_async, uma única thread compartilhada do
+          asgiref. Cada salto fecha e reabre a conexão se CONN_MAX_AGE é 0 (o padrão)
+       -> "async": os caminhos quentes dos consumers usam o ORM assíncrono do Django
+          (acreate, aget...). No Django 5.2 ele ainda salta para a mesma thread do
+          asgiref, mas mantém a conexão aberta entre as chamadas. O que precisa de
+          transação (mensagem direta + conversa, confirmações) continua síncrono
+       -> "executor": pool próprio de WORKERS threads para as leituras (db_read) e
+          uma thread própria para as gravações (db_write; o SQLite aceita um escritor
+          por vez), cada thread com a sua conexão aberta enquanto viver. Depois de um
+          erro as conexões inutilizáveis são fechadas
+       -> No modo concorrente do SQLite as gravações ficam sempre na thread escritora
+       -> Passam por db_write/db_read: mensagens de sala e diretas (com a conversa),
+          confirmações de leitura, aquecimento do buffer recente e a lacuna da retomada.
+          A paginação do histórico pela API (views.py) fica de fora: são views
+          síncronas, que o handler ASGI do Django já executa fora do event loop
+"""
+
+DEFAULTS = {
+    "MODE": "default",
+    "PRAGMAS": {},
+    "CONN_MAX_AGE": 0,
+}
+
+EXECUTOR_DEFAULTS = {
+    "MODE": "sync",
+    "WORKERS": 4,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_SQLITE", {}))
+    return config
+
+
+def is_concurrent():
+    return get_config()["MODE"] == "concurrent"
+
+
+def get_executor_config():
+    config = dict(EXECUTOR_DEFAULTS)
+    config.update(getattr(settings, "CHAT_DB", {}))
+    return config
+
+
+def uses_executor():
+    return get_executor_config()["MODE"] == "executor"
+
+
+def uses_async_orm():
+    """ORM assíncrono nas gravações dos consumers (fora do modo concorrente do SQLite)."""
+    return get_executor_config()["MODE"] == "async" and not is_concurrent()
+
+
+def configure_connection(sender, connection, **kwargs):
+    """Receptor de connection_created: aplica os pragmas às conexões SQLite."""
+    if connection.vendor != "sqlite" or not is_concurrent():
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in get_config()["PRAGMAS"].items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+class DatabaseExecutor:
+    """Threads dedicadas ao banco, cada uma com a sua conexão persistente."""
+
+    def __init__(self, workers=1, name="chat-db-writer"):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "busy_ms": 0.0, "wait_ms": 0.0}
+
+    def call(self, submitted, func, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            # Fecha só as conexões quebradas (ou velhas demais); as outras continuam abertas
+            close_old_connections()
+            with self.lock:
+                self.stats["errors"] += 1
+            raise
+        finally:
+            finished = time.perf_counter()
+            with self.lock:
+                self.stats["calls"] += 1
+                self.stats["wait_ms"] += (started - submitted) * 1000
+                self.stats["busy_ms"] += (finished - started) * 1000
+
+    async def run(self, func, *args, **kwargs):
+        # sync_to_async em vez de database_sync_to_async: sem close_old_connections a
+        # cada chamada, a conexão da thread é reaproveitada
+        call = sync_to_async(self.call, thread_sensitive=False, executor=self.executor)
+        return await call(time.perf_counter(), func, *args, **kwargs)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats["busy_ms"] = round(stats["busy_ms"], 3)
+        stats["wait_ms"] = round(stats["wait_ms"], 3)
+        return {**stats, "workers": self.workers}
+
+
+_writer = None
+_reader = None
+_executor_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _executor_lock:
+        if _writer is None:
+            _writer = DatabaseExecutor(1, "chat-db-writer")
+        return _writer
+
+
+def get_reader():
+    global _reader
+    with _executor_lock:
+        if _reader is None:
+            _reader = DatabaseExecutor(get_executor_config()["WORKERS"], "chat-db-reader")
+        return _reader
+
+
+def get_stats():
+    stats = {}
+    for prefix, executor in (("write", _writer), ("read", _reader)):
+        if executor is not None:
+            stats.update({f"{prefix}_{key}": value for key, value in executor.get_stats().items()})
+    return stats
+
+
+def db_write(func):
+    """Como database_sync_to_async, mas pela thread escritora no modo concorrente ou "executor"."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if is_concurrent() or uses_executor():
+            return await get_writer().run(func, *args, **kwargs)
+        return await database_sync_to_async(func)(*args, **kwargs)
+
+    return wrapper
+
+
+def db_read(func):
+    """Como database_sync_to_async, mas em paralelo no pool de threads no modo concorrente."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        if uses_executor():
+            return await get_reader().run(func, *args, **kwargs)
+        return await database_sync_to_async(func, thread_sensitive=not is_concurrent())(
+            *args, **kwargs
+        )
+
+    return wrapper
@@ -0,0 +1,346 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from .database import db_read
+from .search import normalize
+
+"""
+    Diretório de usuários em memória para /api/search-users/:
+       -> Um array ordenado de chaves normalizadas (sem acentos e sem caixa): o
+          username, o first_name inteiro e cada palavra interna dos dois
+       -> A busca é um bisect até o prefixo digitado (sem varrer auth_user)
+       -> O índice é montado numa thread em segundo plano; até ficar pronto (só na
+          primeira carga do processo) a busca usa a consulta icontains antiga
+       -> Ranking: igual ao username/nome > começa com o texto > alguma palavra
+          do nome começa com o texto
+       -> Só as SCAN_LIMIT primeiras chaves com o prefixo (em ordem alfabética) entram
+          no ranking. Os iguais ao texto vêm antes de todas as outras chaves da faixa e
+          nunca ficam de fora; com mais chaves que isso (prefixos de uma ou duas letras)
+          um nome mais curto que está depois do corte não aparece
+       -> O índice de prefixos só acha começos de palavras. Com menos de 'limit'
+          resultados e pelo menos GRAM caracteres, a busca é completada por um índice de
+          trigramas montado junto (trigrama -> ids dos usuários): os candidatos são a
+          interseção das listas dos trigramas do texto, confirmados com o texto no
+          username/nome ("silva" em "joaosilva"), e vêm depois dos resultados do
+          índice, por id. Nenhuma consulta ao banco
+       -> As listas de trigramas só crescem entre duas cargas; usuários alterados ou
+          removidos deixam entradas velhas que a confirmação descarta
+       -> Usuários criados/alterados no processo entram na hora (post_save);
+          os criados em outros workers a cada TTL segundos (só id > último carregado)
+          e o índice inteiro é refeito a cada REBUILD segundos
+       -> Cada usuário tem um cache curto (RESULT_TTL) das últimas buscas, para as
+          repetições da digitação com debounce
+"""
+
+DEFAULTS = {
+    "TTL": 60,
+    "REBUILD": 3600,
+    "RESULT_TTL": 5,
+    "MAX_CACHED": 10000,
+}
+
+# Tipos de chave, na ordem do ranking
+USERNAME, FIRST_NAME, WORD = 0, 1, 2
+
+# Quantas chaves com o prefixo são examinadas antes de ordenar pelo ranking
+SCAN_LIMIT = 200
+
+# Tamanho dos n-gramas do índice de trechos (e mínimo do texto para usá-lo)
+GRAM = 3
+
+# Palavras internas do username/nome ("joao_silva" -> "silva")
+WORD_RE = re.compile(r"[^\W_]+")
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_USER_DIRECTORY", {}))
+    return config
+
+
+def user_keys(username, first_name):
+    """Chaves (texto normalizado, tipo) de um usuário."""
+    username = normalize(username)
+    keys = {(username, USERNAME)}
+    texts = [username]
+    if first_name:
+        first_name = normalize(first_name)
+        keys.add((first_name, FIRST_NAME))
+        texts.append(first_name)
+    for text in texts:
+        keys.update((word, WORD) for word in WORD_RE.findall(text)[1:])
+    return keys
+
+
+def user_texts(username, first_name):
+    """Textos normalizados em que a busca por trecho procura."""
+    return [normalize(username), normalize(first_name)] if first_name else [normalize(username)]
+
+
+def grams(text):
+    return {text[i : i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+class UserDirectory:
+    def __init__(self):
+        self.keys = []
+        self.refs = []  # user_id * 4 + tipo da chave, alinhado com self.keys
+        self.users = {}  # user_id -> (username, first_name)
+        self.grams = {}  # trigrama -> array de user_ids
+        self.max_id = 0
+        self.loaded_at = None
+        self.built_at = None
+        self.results = OrderedDict()
+        self.lock = threading.RLock()
+        self.building = False
+        self.stats = {
+            "searches": 0,
+            "cache_hits": 0,
+            "builds": 0,
+            "fallbacks": 0,
+            "substring_searches": 0,
+            "refreshes": 0,
+            "updates": 0,
+        }
+
+    # Carga
+
+    def build(self):
+        entries = []
+        append = entries.append
+        users = {}
+        index = {}
+        max_id = 0
+        for user_id, username, first_name in (
+            User.objects.filter(is_active=True)
+            .values_list("id", "username", "first_name")
+            .iterator(chunk_size=10000)
+        ):
+            users[user_id] = (username, first_name)
+            max_id = max(max_id, user_id)
+            ref = user_id * 4
+            for key, kind in user_keys(username, first_name):
+                append((key, ref + kind))
+            for gram in set().union(*map(grams, user_texts(username, first_name))):
+                ids = index.get(gram)
+                if ids is None:
+                    ids = index[gram] = array("q")
+                ids.append(user_id)
+        entries.sort()
+
+        with self.lock:
+            self.keys = [key for key, _ in entries]
+            self.refs = [ref for _, ref in entries]
+            self.users = users
+            self.grams = index
+            self.max_id = max_id
+            self.results.clear()
+            self.loaded_at = self.built_at = time.monotonic()
+            self.stats["builds"] += 1
+
+    def refresh(self, ttl):
+        """Traz só os usuários criados depois da última carga (por outros workers)."""
+        with self.lock:
+            # Só uma thread faz o refresh de cada janela
+            if time.monotonic() - self.loaded_at < ttl:
+                return
+            self.loaded_at = time.monotonic()
+            max_id = self.max_id
+
+        new_users = list(
+            User.objects.filter(is_active=True, id__gt=max_id).values_list(
+                "id", "username", "first_name"
+            )
+        )
+        with self.lock:
+            for user_id, username, first_name in new_users:
+                if user_id not in self.users:
+                    self.add(user_id, username, first_name)
+            if new_users:
+                self.results.clear()
+            self.stats["refreshes"] += 1
+
+    def build_in_background(self):
+        try:
+            self.build()
+        finally:
+            self.building = False
+            connection.close()
+
+    def ensure_loaded(self):
+        """Agenda a (re)carga quando preciso; retorna se o índice já pode ser usado."""
+        config = get_config()
+        if self.built_at is None or time.monotonic() - self.built_at >= config["REBUILD"]:
+            with self.lock:
+                start = not self.building
+                self.building = True
+            if start:
+                threading.Thread(
+                    target=self.build_in_background, name="chat-user-directory", daemon=True
+                ).start()
+        elif time.monotonic() - self.loaded_at >= config["TTL"]:
+            self.refresh(config["TTL"])
+        return self.built_at is not None
+
+    # Atualização incremental
+
+    def add(self, user_id, username, first_name):
+        with self.lock:
+            self.users[user_id] = (username, first_name)
+            self.max_id = max(self.max_id, user_id)
+            for key, kind in user_keys(username, first_name):
+                index = bisect_left(self.keys, key)
+                self.keys.insert(index, key)
+                self.refs.insert(index, user_id * 4 + kind)
+            for gram in set().union(*map(grams, user_texts(username, first_name))):
+                self.grams.setdefault(gram, array("q")).append(user_id)
+
+    def remove(self, user_id):
+        with self.lock:
+            old = self.users.pop(user_id, None)
+            if old is None:
+                return
+            for key, kind in user_keys(*old):
+                ref = user_id * 4 + kind
+                index = bisect_left(self.keys, key)
+                while index < len(self.keys) and self.keys[index] == key:
+                    if self.refs[index] == ref:
+                        del self.keys[index]
+                        del self.refs[index]
+                        break
+                    index += 1
+
+    def update(self, user):
+        """Aplica um cadastro ou alteração de usuário (chamado pelo post_save)."""
+        with self.lock:
+            if self.built_at is None:
+                return
+            self.remove(user.id)
+            if user.is_active:
+                self.add(user.id, user.username, user.first_name)
+            self.results.clear()
+            self.stats["updates"] += 1
+
+    def discard(self, user_id):
+        with self.lock:
+            if self.built_at is not None:
+                self.remove(user_id)
+                self.results.clear()
+                self.stats["updates"] += 1
+
+    async def user_exists(self, user_id):
+        """Se o usuário existe: pelo índice quando ele o tem, senão uma consulta."""
+        with self.lock:
+            if self.built_at is not None and user_id in self.users:
+                return True
+        return await db_read(User.objects.filter(id=user_id).exists)()
+
+    # Busca
+
+    def lookup(self, query, exclude=None, limit=10):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+
+        candidates = {}
+        with self.lock:
+            index = bisect_left(self.keys, prefix)
+            end = min(len(self.keys), index + SCAN_LIMIT)
+            while index < end and self.keys[index].startswith(prefix):
+                key, ref = self.keys[index], self.refs[index]
+                user_id, kind = divmod(ref, 4)
+                index += 1
+                if user_id == exclude:
+                    continue
+                tier = kind if key == prefix and kind != WORD else 2 + kind
+                rank = (tier, len(key), key)
+                if user_id not in candidates or rank < candidates[user_id]:
+                    candidates[user_id] = rank
+            ranked = sorted(candidates, key=lambda user_id: (candidates[user_id], user_id))[:limit]
+            users = [(user_id, *self.users[user_id]) for user_id in ranked]
+
+        return [
+            {"id": user_id, "username": username, "first_name": first_name or username}
+            for user_id, username, first_name in users
+        ]
+
+    def substring(self, query, exclude=None, found=(), limit=10):
+        """Completa 'found' (resultados do índice) com o texto no meio do username/nome."""
+        text = normalize(query)
+        self.stats["substring_searches"] += 1
+        skip = {exclude, *(user["id"] for user in found)}
+        users = []
+        with self.lock:
+            postings = sorted((self.grams.get(gram, ()) for gram in grams(text)), key=len)
+            if not postings or not postings[0]:
+                return list(found)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            for user_id in sorted(candidates - skip):
+                user = self.users.get(user_id)
+                if user is not None and any(text in value for value in user_texts(*user)):
+                    users.append((user_id, *user))
+                    if len(found) + len(users) >= limit:
+                        break
+
+        return list(found) + [
+            {"id": user_id, "username": username, "first_name": first_name or username}
+            for user_id, username, first_name in users
+        ]
+
+    def fallback(self, query, exclude=None, limit=10):
+        """Consulta direta no banco, usada enquanto o índice não fica pronto."""
+        self.stats["fallbacks"] += 1
+        users = User.objects.filter(
+            Q(username__icontains=query) | Q(first_name__icontains=query)
+        ).exclude(id=exclude)[:limit]
+        return [
+            {
+                "id": user.id,
+                "username": user.username,
+                "first_name": user.first_name or user.username,
+            }
+            for user in users
+        ]
+
+    def search(self, requester_id, query, limit=10):
+        config = get_config()
+        self.stats["searches"] += 1
+        if not self.ensure_loaded():
+            return self.fallback(query, exclude=requester_id, limit=limit)
+
+        cache_key = (requester_id, normalize(query), limit)
+        now = time.monotonic()
+        with self.lock:
+            cached = self.results.get(cache_key)
+            if cached is not None and cached[0] > now:
+                self.results.move_to_end(cache_key)
+                self.stats["cache_hits"] += 1
+                return cached[1]
+
+        results = self.lookup(query, exclude=requester_id, limit=limit)
+        if len(results) < limit and len(cache_key[1]) >= GRAM:
+            results = self.substring(query, exclude=requester_id, found=results, limit=limit)
+        with self.lock:
+            self.results[cache_key] = (now + config["RESULT_TTL"], results)
+            while len(self.results) > config["MAX_CACHED"]:
+                self.results.popitem(last=False)
+        return results
+
+    def get_stats(self):
+        return {
+            **self.stats,
+            "users": len(self.users),
+            "keys": len(self.keys),
+            "grams": len(self.grams),
+        }
+
+
+user_directory = UserDirectory()
@@ -0,0 +1,111 @@
+import csv
+import io
+import json
+
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from .database import db_read
+from .pagination import direct_messages, room_messages
+from . import retention
+
+"""
+    Exportação do histórico de uma sala ou conversa em NDJSON ou CSV:
+       -> As mensagens são lidas em páginas keyset de CHUNK_SIZE por (timestamp, id),
+          com values_list e .iterator(chunk_size=...) (sem instanciar Message/User nem
+          guardar o queryset em cache): a memória usada não depende do tamanho do
+          histórico
+       -> Cada página é uma consulta curta e independente; nenhuma consulta fica aberta
+          durante o download inteiro, então um cliente lento não segura uma transação
+          de leitura (nem o checkpoint do WAL)
+       -> Começa pelas tabelas de arquivo (chat/retention.py), que são mais antigas
+       -> No ASGI o StreamingHttpResponse recebe um gerador assíncrono (stream_export):
+          com um iterador síncrono o Django lê a resposta inteira para a memória antes
+          de enviar. Cada página é lida numa thread (db_read) e enviada antes da próxima
+"""
+
+CHUNK_SIZE = 2000
+FIELDS = ("id", "user_id", "username", "content", "timestamp", "is_read")
+CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def room_source(room):
+    """(queryset, escopo do arquivo) do histórico de uma sala."""
+    return room_messages(room), retention.room_scope(room.id)
+
+
+def direct_source(user, other_user):
+    return direct_messages(user, other_user), retention.direct_scope(user.id, other_user.id)
+
+
+def iter_pages(queryset, archive, chunk=CHUNK_SIZE):
+    """Páginas de linhas (tuplas na ordem de FIELDS) em ordem cronológica, uma consulta por página."""
+    for page in retention.archived_pages(archive, chunk):
+        yield [
+            (msg.id, msg.user_id, msg.user.username, msg.content, msg.timestamp, msg.is_read)
+            for msg in page
+        ]
+
+    rows = queryset.order_by("timestamp", "id").values_list(
+        "id", "user_id", "user__username", "content", "timestamp", "is_read"
+    )
+    last = None
+    while True:
+        page = rows
+        if last is not None:
+            # Mesma condição (timestamp, id) > cursor da paginação: range scan no índice
+            page = page.filter(timestamp__gte=last[4]).filter(
+                Q(timestamp__gt=last[4]) | Q(id__gt=last[0])
+            )
+        page = list(page[:chunk].iterator(chunk_size=chunk))
+        if page:
+            yield page
+        if len(page) < chunk:
+            return
+        last = page[-1]
+
+
+def encode(rows, fmt, header=False):
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps(
+                {**dict(zip(FIELDS, row)), "timestamp": row[4].isoformat()}, ensure_ascii=False
+            )
+            + "\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(FIELDS)
+    writer.writerows((*row[:4], row[4].isoformat(), row[5]) for row in rows)
+    return buffer.getvalue()
+
+
+def iter_export(queryset, archive, fmt, chunk=CHUNK_SIZE):
+    """Texto da exportação, um pedaço por página (o CSV começa pelo cabeçalho)."""
+    if fmt == "csv":
+        yield encode([], fmt, header=True)
+    for page in iter_pages(queryset, archive, chunk):
+        yield encode(page, fmt)
+
+
+async def stream_export(queryset, archive, fmt, chunk=CHUNK_SIZE):
+    chunks = iter_export(queryset, archive, fmt, chunk)
+    read = db_read(next)
+    while True:
+        text = await read(chunks, None)
+        if text is None:
+            return
+        yield text.encode()
+
+
+def export_response(source, fmt, filename):
+    queryset, archive = source
+    response = StreamingHttpResponse(
+        stream_export(queryset, archive, fmt), content_type=CONTENT_TYPES[fmt]
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    return response
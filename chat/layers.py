@@ -0,0 +1,228 @@
+import asyncio
+import itertools
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from .broker import channel_owner, encode_frame, read_frame
+
+"""
+    Channel layer multi-processo para um único host:
+       -> Cada worker conecta no broker local (python manage.py chat_broker)
+       -> Canais específicos são entregues localmente quando o dono é o próprio worker
+       -> group_add / group_discard / group_send vão para o broker, que faz o fan-out
+          uma vez e devolve um frame por worker
+       -> Só canais específicos (os usados pelos consumers) são suportados em receive()
+       -> Se o broker cai, a conexão tenta voltar em segundo plano (esperas de
+          RECONNECT_DELAYS) e registra de novo os grupos do worker, sem esperar o
+          próximo envio; o que foi enviado com o broker fora se perde (as salas
+          completam a lacuna pela retomada com last_message_id)
+
+    Configuração (djangochat/settings.py):
+        CHANNEL_LAYERS = {"default": {
+            "BACKEND": "chat.layers.BrokerChannelLayer",
+            "CONFIG": {"path": "/tmp/djangochat-broker.sock"},
+        }}
+"""
+
+# Esperas (s) entre as tentativas de reconexão; a última se repete
+RECONNECT_DELAYS = (0.05, 0.1, 0.25, 0.5, 1, 2)
+
+
+class BrokerConnection:
+    """Conexão de um event loop com o broker e as filas dos canais locais."""
+
+    def __init__(self, layer):
+        self.layer = layer
+        self.client_id = uuid.uuid4().hex[:12]
+        self.queues = {}
+        self.groups = {}
+        self.acks = {}
+        self.seq = itertools.count()
+        self.reader = None
+        self.writer = None
+        self.reader_task = None
+        self.reconnect_task = None
+        self.closed = False
+        self.connect_lock = asyncio.Lock()
+
+    async def ensure_connected(self):
+        if self.writer is not None and not self.writer.is_closing():
+            return
+        async with self.connect_lock:
+            if self.writer is not None and not self.writer.is_closing():
+                return
+            self.reader, self.writer = await asyncio.open_unix_connection(self.layer.path)
+            self.writer.write(encode_frame({"op": "hello", "client": self.client_id}))
+            self.reader_task = asyncio.ensure_future(self.read_loop(self.reader))
+
+            # Reconexão: registra de novo os grupos deste worker
+            for group, channels in self.groups.items():
+                for channel in channels:
+                    self.writer.write(
+                        encode_frame({"op": "group_add", "group": group, "channel": channel})
+                    )
+            await self.writer.drain()
+
+    async def read_loop(self, reader):
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame["op"] == "deliver":
+                    for channel in frame["channels"]:
+                        self.put(channel, frame["message"])
+                elif frame["op"] == "ack":
+                    future = self.acks.pop(frame["seq"], None)
+                    if future is not None and not future.done():
+                        future.set_result(True)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            if self.writer is not None:
+                self.writer.close()
+            for future in self.acks.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Conexão com o broker perdida"))
+            self.acks.clear()
+            if not self.closed:
+                self.reconnect_task = asyncio.ensure_future(self.reconnect())
+
+    async def reconnect(self):
+        """Volta a conectar assim que o broker reaparecer, sem esperar um envio do worker."""
+        for attempt in itertools.count():
+            await asyncio.sleep(RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)])
+            if self.closed:
+                return
+            try:
+                await self.ensure_connected()
+                return
+            except OSError:
+                continue
+
+    def close(self):
+        self.closed = True
+        for task in (self.reconnect_task, self.reader_task):
+            if task is not None:
+                task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+    def queue(self, channel):
+        queue = self.queues.get(channel)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.layer.get_capacity(channel))
+            self.queues[channel] = queue
+        return queue
+
+    def put(self, channel, message):
+        try:
+            self.queue(channel).put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def request(self, frame, wait=False):
+        await self.ensure_connected()
+        if wait:
+            seq = next(self.seq)
+            frame["seq"] = seq
+            future = asyncio.get_running_loop().create_future()
+            self.acks[seq] = future
+        self.writer.write(encode_frame(frame))
+        await self.writer.drain()
+        if wait:
+            await future
+
+
+class BrokerChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        path="/tmp/djangochat-broker.sock",
+        expiry=60,
+        capacity=100,
+        channel_capacity=None,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.path = path
+        # Uma conexão por event loop (streams asyncio não podem ser compartilhados entre loops)
+        self.connections = {}
+
+    def connection(self):
+        loop = asyncio.get_running_loop()
+        # Descarta conexões de loops já encerrados (ex.: chamadas via async_to_sync)
+        for closed_loop in [other for other in self.connections if other.is_closed()]:
+            closed = self.connections.pop(closed_loop)
+            if closed.writer is not None:
+                closed.writer.transport.abort()
+        connection = self.connections.get(loop)
+        if connection is None:
+            connection = BrokerConnection(self)
+            self.connections[loop] = connection
+        return connection
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        connection = self.connection()
+
+        if channel_owner(channel) == connection.client_id:
+            if not connection.put(channel, message):
+                raise ChannelFull(channel)
+            return
+        await connection.request({"op": "send", "channel": channel, "message": message})
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        connection = self.connection()
+        await connection.ensure_connected()
+
+        queue = connection.queue(channel)
+        try:
+            return await queue.get()
+        finally:
+            if queue.empty():
+                connection.queues.pop(channel, None)
+
+    async def new_channel(self, prefix="specific."):
+        connection = self.connection()
+        return f"{prefix}{connection.client_id}!{uuid.uuid4().hex[:12]}"
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        connection = self.connection()
+        connection.groups.setdefault(group, set()).add(channel)
+        await connection.request(
+            {"op": "group_add", "group": group, "channel": channel}, wait=True
+        )
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        connection = self.connection()
+        channels = connection.groups.get(group)
+        if channels:
+            channels.discard(channel)
+            if not channels:
+                connection.groups.pop(group, None)
+        await connection.request(
+            {"op": "group_discard", "group": group, "channel": channel}, wait=True
+        )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        await self.connection().request({"op": "group_send", "group": group, "message": message})
+
+    async def flush(self):
+        connection = self.connection()
+        connection.queues = {}
+        connection.groups = {}
+        await connection.request({"op": "flush"}, wait=True)
+
+    async def close(self):
+        connection = self.connections.pop(asyncio.get_running_loop(), None)
+        if connection is not None:
+            connection.close()
@@ -0,0 +1,272 @@
+import asyncio
+import statistics
+import threading
+import time
+import uuid
+
+from channels.testing import HttpCommunicator, WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.utils.module_loading import import_string
+from .models import Message, Room
+
+"""
+    Teste de carga em processo (sem rede) contra a aplicação ASGI do projeto:
+       -> Popula usuários, salas e mensagens com bulk_create
+       -> Abre M clientes WebSocket simulados (salas e mensagens diretas) passando
+          pelo AuthMiddlewareStack com cookies de sessão reais
+       -> Cada cliente envia mensagens e mede o tempo até receber o próprio broadcast
+       -> Depois mede as APIs JSON com as mesmas sessões
+       -> Relata p50/p95/p99, mensagens/s e número de consultas ao banco
+"""
+
+USER_PREFIX = "load_"
+
+
+class QueryCounter:
+    """Conta as consultas de todas as conexões (de qualquer thread) enquanto ativo."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        # Conexões abertas antes do teste não passariam pelo sinal
+        connections.close_all()
+        connection_created.connect(self.install)
+        return self
+
+    def __exit__(self, *exc):
+        connection_created.disconnect(self.install)
+        for connection in connections.all(initialized_only=True):
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+    def take(self):
+        with self.lock:
+            count, self.count = self.count, 0
+        return count
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered), 3),
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": round(ordered[-1], 3),
+    }
+
+
+def seed(users, rooms, messages_per_room):
+    """Cria (ou reaproveita) os dados do teste de carga em lote."""
+    existing = User.objects.filter(username__startswith=USER_PREFIX).count()
+    User.objects.bulk_create(
+        [
+            User(username=f"{USER_PREFIX}{i}", first_name=f"Carga {i}", password="!")
+            for i in range(existing, users)
+        ],
+        batch_size=1000,
+    )
+    user_list = list(User.objects.filter(username__startswith=USER_PREFIX).order_by("id")[:users])
+
+    room_list = []
+    for i in range(rooms):
+        room, _ = Room.objects.get_or_create(name=f"{USER_PREFIX}sala_{i}")
+        room_list.append(room)
+        missing = messages_per_room - room.messages.count()
+        Message.objects.bulk_create(
+            [
+                Message(room=room, user=user_list[j % len(user_list)], content=f"carga {j}")
+                for j in range(max(0, missing))
+            ],
+            batch_size=1000,
+        )
+    return user_list, room_list
+
+
+def session_cookie(user):
+    engine = import_string(settings.SESSION_ENGINE)
+    session = engine.SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f"{settings.SESSION_COOKIE_NAME}={session.session_key}".encode()
+
+
+class Client:
+    def __init__(self, application, user, cookie, room, peer, direct=False):
+        self.application = application
+        self.user = user
+        self.cookie = cookie
+        self.room = room
+        self.peer = peer
+        self.direct = direct
+        self.latencies = []
+        self.received = 0
+        self.errors = 0
+        self.rate_limited = 0
+
+    @property
+    def headers(self):
+        return [(b"cookie", self.cookie), (b"host", b"localhost")]
+
+    async def run(self, messages):
+        path = "/ws/chat/direct/" if self.direct else f"/ws/chat/room/{self.room.id}/"
+        socket = WebsocketCommunicator(self.application, path, headers=self.headers)
+        connected, _ = await socket.connect(timeout=10)
+        if not connected:
+            self.errors += messages
+            return
+
+        for i in range(messages):
+            key = uuid.uuid4().hex
+            expected = f"{self.user.id}:{key}"
+            frame = {"message": f"carga {i}", "client_key": key}
+            if self.direct:
+                frame.update(type="direct", user_to_id=self.peer.id)
+            else:
+                frame["type"] = "room"
+
+            started = time.perf_counter()
+            await socket.send_json_to(frame)
+            try:
+                while True:
+                    data = await socket.receive_json_from(timeout=10)
+                    self.received += 1
+                    if data.get("client_key") == expected:
+                        self.latencies.append((time.perf_counter() - started) * 1000)
+                        break
+                    if data.get("type") == "rate_limited":
+                        self.rate_limited += 1
+                        break
+                    if "error" in data:
+                        self.errors += 1
+                        break
+            except asyncio.TimeoutError:
+                self.errors += 1
+
+        await socket.disconnect()
+
+    async def get(self, path):
+        communicator = HttpCommunicator(self.application, "GET", path, headers=self.headers)
+        started = time.perf_counter()
+        response = await communicator.get_response(timeout=10)
+        elapsed = (time.perf_counter() - started) * 1000
+
+        # Encerra a requisição como o servidor faria depois de enviar a resposta
+        await communicator.send_input({"type": "http.disconnect"})
+        await communicator.wait(timeout=10)
+        return elapsed, response["status"]
+
+
+async def run_websockets(clients, messages):
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(messages) for client in clients))
+    return time.perf_counter() - started
+
+
+async def run_http(clients, requests):
+    endpoints = {
+        "conversations": lambda client: "/api/conversations/",
+        "room_messages": lambda client: f"/api/messages/room/{client.room.id}/",
+        "direct_messages": lambda client: f"/api/messages/direct/{client.peer.id}/",
+        "search_users": lambda client: f"/api/search-users/?q={USER_PREFIX}1",
+    }
+    results = {}
+    for name, path_for in endpoints.items():
+        samples, errors = [], 0
+        for _ in range(requests):
+            timings = await asyncio.gather(*(client.get(path_for(client)) for client in clients))
+            for elapsed, status in timings:
+                samples.append(elapsed)
+                errors += status != 200
+        results[name] = {**percentiles(samples), "errors": errors}
+    return results
+
+
+def run(
+    users=100,
+    rooms=5,
+    messages_per_room=1000,
+    clients=50,
+    messages=20,
+    direct_ratio=0.2,
+    http_requests=5,
+    rate_limit=False,
+):
+    from djangochat.asgi import application
+    from .ratelimit import rate_limiter
+
+    user_list, room_list = seed(users, rooms, messages_per_room)
+    active = user_list[:clients]
+
+    sim = []
+    direct_every = round(1 / direct_ratio) if direct_ratio else 0
+    for i, user in enumerate(active):
+        peer = user_list[(i + 1) % len(user_list)]
+        room = room_list[i % len(room_list)]
+        direct = bool(direct_every) and i % direct_every == 0
+        sim.append(Client(application, user, session_cookie(user), room, peer, direct))
+
+    # Os clientes enviam sem pausa: com o limite ligado a maioria seria rejeitada
+    # e o teste mediria o limite, não a capacidade do servidor
+    limits = {**getattr(settings, "CHAT_RATE_LIMIT", {}), "ENABLED": rate_limit}
+    with QueryCounter() as counter:
+        with override_settings(CHAT_RATE_LIMIT=limits):
+            rate_limiter.reload()
+            elapsed = asyncio.run(run_websockets(sim, messages))
+        rate_limiter.reload()
+        ws_queries = counter.take()
+        http = asyncio.run(run_http(sim, http_requests))
+        http_queries = counter.take()
+
+    sent = sum(len(client.latencies) for client in sim)
+    return {
+        "config": {
+            "users": users,
+            "rooms": rooms,
+            "messages_per_room": messages_per_room,
+            "clients": clients,
+            "messages_per_client": messages,
+            "direct_ratio": direct_ratio,
+            "http_requests_per_client": http_requests,
+            "persistence": getattr(settings, "CHAT_PERSISTENCE", {}).get("MODE", "direct"),
+            "channel_layer": settings.CHANNEL_LAYERS["default"]["BACKEND"],
+            "rate_limit": rate_limit,
+        },
+        "websocket": {
+            "room": percentiles([ms for c in sim if not c.direct for ms in c.latencies]),
+            "direct": percentiles([ms for c in sim if c.direct for ms in c.latencies]),
+            "messages_sent": sent,
+            "messages_received": sum(client.received for client in sim),
+            "messages_per_sec": round(sent / elapsed, 1) if elapsed else 0,
+            "errors": sum(client.errors for client in sim),
+            "rate_limited": sum(client.rate_limited for client in sim),
+            "db_queries": ws_queries,
+            "db_queries_per_message": round(ws_queries / sent, 2) if sent else 0,
+        },
+        "http": {**http, "db_queries": http_queries},
+    }
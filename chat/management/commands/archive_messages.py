@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from chat import retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Move as mensagens mais antigas que o prazo de retenção (Room.retention_days / "
+        "CHAT_RETENTION) para as tabelas mensais de arquivo, em lotes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--room", type=int, nargs="+", help="Só estas salas (ids)")
+        parser.add_argument("--chunk", type=int, help="Mensagens por lote (padrão CHAT_RETENTION['CHUNK'])")
+        parser.add_argument(
+            "--pause-ms", type=int, help="Pausa entre lotes (padrão CHAT_RETENTION['PAUSE_MS'])"
+        )
+        parser.add_argument("--no-direct", action="store_true", help="Não arquiva mensagens diretas")
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Só conta as mensagens que seriam movidas"
+        )
+
+    def handle(self, *args, **options):
+        archiver = retention.Archiver(
+            chunk=options["chunk"], pause_ms=options["pause_ms"], dry_run=options["dry_run"]
+        )
+        total = 0
+        started = time.perf_counter()
+
+        for label, queryset in archiver.scopes(options["room"], direct=not options["no_direct"]):
+            scope_started = time.perf_counter()
+            moved = archiver.archive(queryset)
+            elapsed = time.perf_counter() - scope_started
+            total += moved
+            if moved:
+                self.stdout.write(f"{label}: {self.report(moved, elapsed, options['dry_run'])}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(self.report(total, elapsed, options["dry_run"])))
+
+    def report(self, moved, elapsed, dry_run):
+        if dry_run:
+            return f"{moved} mensagens a mover"
+        return f"{moved} mensagens movidas em {elapsed:.1f}s ({moved / max(elapsed, 1e-6):.0f}/s)"
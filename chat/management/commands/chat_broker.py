@@ -0,0 +1,42 @@
+import asyncio
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from chat.broker import serve
+
+
+class Command(BaseCommand):
+    help = "Roda o broker local do channel layer multi-processo (chat.layers.BrokerChannelLayer)"
+
+    def add_arguments(self, parser):
+        config = settings.CHANNEL_LAYERS["default"].get("CONFIG", {})
+        parser.add_argument(
+            "--path",
+            default=config.get("path", "/tmp/djangochat-broker.sock"),
+            help="Caminho do Unix domain socket",
+        )
+        parser.add_argument(
+            "--group-expiry",
+            type=int,
+            default=config.get("group_expiry", 86400),
+            help="Segundos até um canal sair automaticamente de um grupo",
+        )
+        parser.add_argument(
+            "--max-buffer",
+            type=int,
+            default=config.get("max_buffer", 4 * 1024 * 1024),
+            help="Bytes pendentes para um worker acima dos quais as entregas são descartadas",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Broker escutando em {options['path']}")
+        try:
+            asyncio.run(
+                serve(
+                    options["path"],
+                    group_expiry=options["group_expiry"],
+                    max_buffer=options["max_buffer"],
+                )
+            )
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,63 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from chat import export
+from chat.models import Room
+
+
+class Command(BaseCommand):
+    help = "Exporta o histórico de uma sala ou conversa (arquivo incluído) em NDJSON ou CSV"
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument("--room", type=int, help="Id da sala")
+        target.add_argument(
+            "--direct",
+            type=int,
+            nargs=2,
+            metavar=("USER_ID", "OTHER_ID"),
+            help="Conversa entre dois usuários",
+        )
+        parser.add_argument("--format", choices=sorted(export.CONTENT_TYPES), default="ndjson")
+        parser.add_argument("--output", help="Arquivo de saída (padrão: stdout)")
+        parser.add_argument("--chunk", type=int, default=export.CHUNK_SIZE, help="Mensagens por consulta")
+
+    def handle(self, *args, **options):
+        if options["room"] is not None:
+            try:
+                source = export.room_source(Room.objects.get(id=options["room"]))
+            except Room.DoesNotExist:
+                raise CommandError(f"Sala {options['room']} não encontrada.")
+        else:
+            users = User.objects.in_bulk(options["direct"])
+            if len(users) != len(set(options["direct"])):
+                raise CommandError("Usuário não encontrado.")
+            source = export.direct_source(*(users[user_id] for user_id in options["direct"]))
+
+        fmt = options["format"]
+        output = (
+            open(options["output"], "w", encoding="utf-8", newline="")
+            if options["output"]
+            else sys.stdout
+        )
+        exported = 0
+        started = time.perf_counter()
+        try:
+            if fmt == "csv":
+                output.write(export.encode([], fmt, header=True))
+            for page in export.iter_pages(*source, chunk=options["chunk"]):
+                output.write(export.encode(page, fmt))
+                exported += len(page)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            self.style.SUCCESS(
+                f"{exported} mensagens exportadas em {elapsed:.1f}s "
+                f"({exported / max(elapsed, 1e-6):.0f}/s)"
+            )
+        )
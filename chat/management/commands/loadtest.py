@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand
+from chat import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga em processo dos WebSockets e das APIs JSON. "
+        "Use com --settings benchmarks.settings para não tocar no banco de desenvolvimento."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--rooms", type=int, default=5)
+        parser.add_argument("--messages-per-room", type=int, default=1000)
+        parser.add_argument("--clients", type=int, default=50, help="Clientes WebSocket simultâneos")
+        parser.add_argument("--messages", type=int, default=20, help="Mensagens enviadas por cliente")
+        parser.add_argument(
+            "--direct-ratio",
+            type=float,
+            default=0.2,
+            help="Fração dos clientes que usa mensagens diretas em vez de sala",
+        )
+        parser.add_argument("--http-requests", type=int, default=5, help="Requisições por API e cliente")
+        parser.add_argument(
+            "--rate-limit",
+            action="store_true",
+            help="Mantém o limite de mensagens (CHAT_RATE_LIMIT) ligado durante o teste",
+        )
+        parser.add_argument("--output", help="Arquivo para gravar o resultado em JSON")
+
+    def handle(self, *args, **options):
+        if options["clients"] > options["users"]:
+            options["users"] = options["clients"]
+
+        result = loadtest.run(
+            users=options["users"],
+            rooms=options["rooms"],
+            messages_per_room=options["messages_per_room"],
+            clients=options["clients"],
+            messages=options["messages"],
+            direct_ratio=options["direct_ratio"],
+            http_requests=options["http_requests"],
+            rate_limit=options["rate_limit"],
+        )
+
+        output = json.dumps(result, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+            self.stdout.write(f"Resultado gravado em {options['output']}")
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,77 @@
+import json
+
+from django.core.management.base import BaseCommand
+from chat.seeding import Seeder
+
+
+class Command(BaseCommand):
+    help = (
+        "Popula o banco com usuários, salas e mensagens em massa. "
+        "Sem opções cria apenas as salas de exemplo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=0)
+        parser.add_argument("--rooms", type=int, default=3)
+        parser.add_argument("--room-messages", type=int, default=0)
+        parser.add_argument("--direct-messages", type=int, default=0)
+        parser.add_argument(
+            "--hot-skew",
+            type=float,
+            default=1.0,
+            help="Concentração das mensagens nas salas mais quentes (0 = uniforme)",
+        )
+        parser.add_argument("--dm-pairs", type=int, default=1000, help="Pares distintos de DM")
+        parser.add_argument(
+            "--pair-skew",
+            type=float,
+            default=1.0,
+            help="Concentração das DMs nos pares mais ativos (0 = uniforme)",
+        )
+        parser.add_argument(
+            "--unread-ratio", type=float, default=0.1, help="Fração das DMs não lidas"
+        )
+        parser.add_argument("--days", type=int, default=30, help="Janela de tempo das mensagens")
+        parser.add_argument("--seed", type=int, default=42, help="Semente do gerador")
+        parser.add_argument("--chunk", type=int, default=50000, help="Linhas por bloco")
+        parser.add_argument("--user-prefix", default="user_")
+        parser.add_argument("--password", help="Senha dos usuários gerados (padrão: inutilizável)")
+        parser.add_argument(
+            "--raw",
+            action="store_true",
+            help="Usa executemany e pragmas de carga do SQLite (mais rápido)",
+        )
+        parser.add_argument("--json", action="store_true", help="Imprime o relatório em JSON")
+
+    def handle(self, *args, **options):
+        seeder = Seeder(
+            seed=options["seed"],
+            chunk=options["chunk"],
+            raw=options["raw"],
+            days=options["days"],
+            user_prefix=options["user_prefix"],
+            password=options["password"],
+            stdout=None if options["json"] else self.stdout,
+        )
+
+        previous = seeder.tune_sqlite() if options["raw"] else {}
+        try:
+            user_ids = seeder.seed_users(options["users"])
+            room_ids = seeder.seed_rooms(options["rooms"])
+            seeder.seed_room_messages(
+                options["room_messages"], room_ids, user_ids, options["hot_skew"]
+            )
+            seeder.seed_direct_messages(
+                options["direct_messages"],
+                user_ids,
+                options["dm_pairs"],
+                options["pair_skew"],
+                options["unread_ratio"],
+            )
+        finally:
+            seeder.restore_sqlite(previous)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(seeder.report, indent=2))
+        else:
+            self.stdout.write(self.style.SUCCESS("Dados criados com sucesso!"))
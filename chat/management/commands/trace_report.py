@@ -0,0 +1,68 @@
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from chat.tracing import STAGES
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Resume o arquivo de traces (CHAT_TRACING['FILE']): latência por etapa das "
+        "mensagens amostradas e os traces mais lentos"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Arquivo JSON lines gravado pelos workers")
+        parser.add_argument("--room", type=int, help="Só mensagens desta sala")
+        parser.add_argument("--kind", choices=("room", "direct"), help="Só salas ou só diretas")
+        parser.add_argument("--slowest", type=int, default=5, help="Traces mais lentos listados")
+
+    def handle(self, *args, **options):
+        stages = defaultdict(list)
+        traces = defaultdict(dict)
+        try:
+            with open(options["path"]) as trace_file:
+                for line in trace_file:
+                    span = json.loads(line)
+                    if options["room"] is not None and span["room_id"] != options["room"]:
+                        continue
+                    if options["kind"] and span["kind"] != options["kind"]:
+                        continue
+                    stages[span["stage"]].append(span["ms"])
+                    # Etapas do remetente (uma por trace) e a pior entrega entre os destinatários
+                    trace = traces[span["trace"]]
+                    trace[span["stage"]] = max(trace.get(span["stage"], 0), span["ms"])
+        except FileNotFoundError:
+            raise CommandError(f"Arquivo não encontrado: {options['path']}")
+
+        if not stages:
+            self.stdout.write("Nenhuma etapa registrada.")
+            return
+
+        self.stdout.write(
+            f"{'etapa':<12}{'n':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+        )
+        for stage in STAGES:
+            ordered = sorted(stages.get(stage, ()))
+            if not ordered:
+                continue
+            self.stdout.write(
+                f"{stage:<12}{len(ordered):>8}{percentile(ordered, 0.5):>10.3f}"
+                f"{percentile(ordered, 0.95):>10.3f}{percentile(ordered, 0.99):>10.3f}"
+                f"{ordered[-1]:>10.3f}"
+            )
+
+        slowest = sorted(
+            (trace for trace in traces.items() if "total" in trace[1]),
+            key=lambda trace: trace[1]["total"],
+            reverse=True,
+        )[: options["slowest"]]
+        if slowest:
+            self.stdout.write("\nMais lentos (pior destinatário):")
+        for trace_id, trace in slowest:
+            parts = ", ".join(f"{stage} {trace[stage]:.1f}" for stage in STAGES if stage in trace)
+            self.stdout.write(f"  {trace_id}: {parts} ms")
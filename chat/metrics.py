@@ -0,0 +1,326 @@
+import functools
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+
+"""
+    Métricas no formato texto do Prometheus (GET /metrics):
+       -> Contadores, gauges e histogramas em dicionários do processo, sem locks nem
+          dependências; cada worker expõe os próprios números (o Prometheus soma)
+       -> Sockets: conexões/desconexões por endpoint, sockets ativos por sala,
+          mensagens recebidas, frames enviados e tamanho do fan-out de cada
+          group_send (sockets do grupo neste worker)
+       -> Banco por mensagem: tempo de save_room_message, save_direct_message,
+          mark_message_as_read e da gravação das confirmações em lote
+       -> HTTP: latência e número de consultas por view (MetricsMiddleware)
+       -> Na coleta também saem os get_stats() dos serviços (cache de salas,
+          presença, filas de saída, limite de mensagens...)
+       -> ENABLED False (padrão): cada ponto de medida é um 'if' e retorno, o
+          middleware sai da pilha e /metrics responde 404
+       -> TOKEN: se definido, a coleta exige "Authorization: Bearer <TOKEN>"
+"""
+
+DEFAULTS = {
+    "ENABLED": False,
+    "TOKEN": None,
+}
+
+# Segundos (banco, views) e sockets por group_send
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+FANOUT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_METRICS", {}))
+    return config
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+    def clear(self):
+        self.values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # [contagem por faixa (a última é +Inf), soma, total]
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} {self.kind}"
+        names = self.labels + ("le",)
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(names, labels + (format_value(bound),))
+                yield f"{self.name}_bucket{bucket_labels} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(total)}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {count}"
+
+
+def service_stats():
+    """get_stats() dos serviços do processo, lidos só na coleta."""
+    from . import database, outbound, persistence, receipts
+    from .auth import auth_cache
+    from .directory import user_directory
+    from .presence import presence
+    from .ratelimit import rate_limiter
+    from .recent import recent_messages
+    from .rooms import room_cache
+    from .tracing import tracer
+
+    return {
+        "room_cache": room_cache.get_stats,
+        "recent_messages": recent_messages.get_stats,
+        "presence": presence.get_stats,
+        "outbound": outbound.get_stats,
+        "persistence": persistence.get_stats,
+        "receipts": receipts.get_stats,
+        "db_executor": database.get_stats,
+        "rate_limit": rate_limiter.get_stats,
+        "auth_cache": auth_cache.get_stats,
+        "user_directory": user_directory.get_stats,
+        "tracing": tracer.get_stats,
+    }
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.token = None
+        # Grupo -> sockets deste worker (fan-out e sockets por sala)
+        self.groups = {}
+        self.connections = Counter(
+            "chat_ws_connections_total", "Sockets aceitos.", ("endpoint",)
+        )
+        self.disconnections = Counter(
+            "chat_ws_disconnections_total", "Sockets encerrados.", ("endpoint",)
+        )
+        self.received = Counter(
+            "chat_messages_received_total", "Mensagens recebidas dos clientes.", ("type",)
+        )
+        self.frames_sent = Counter("chat_ws_frames_sent_total", "Frames escritos nos sockets.")
+        self.fanout = Histogram(
+            "chat_group_send_fanout",
+            "Sockets do grupo (neste worker) em cada group_send de mensagem.",
+            FANOUT_BUCKETS,
+            ("type",),
+        )
+        self.db_seconds = Histogram(
+            "chat_db_seconds", "Tempo de banco por operação.", LATENCY_BUCKETS, ("operation",)
+        )
+        self.http_seconds = Histogram(
+            "chat_http_request_seconds", "Latência das views.", LATENCY_BUCKETS, ("view",)
+        )
+        self.http_queries = Histogram(
+            "chat_http_request_queries", "Consultas ao banco por request.", QUERY_BUCKETS, ("view",)
+        )
+        self.metrics = [
+            self.connections,
+            self.disconnections,
+            self.received,
+            self.frames_sent,
+            self.fanout,
+            self.db_seconds,
+            self.http_seconds,
+            self.http_queries,
+        ]
+        self.reload()
+
+    def reload(self):
+        """Relê CHAT_METRICS (na importação e quando os settings mudam)."""
+        config = get_config()
+        self.enabled = config["ENABLED"]
+        self.token = config["TOKEN"]
+        return config
+
+    # Pontos de medida: todos retornam na primeira linha com as métricas desligadas
+
+    def connected(self, endpoint):
+        if self.enabled:
+            self.connections.inc(endpoint)
+
+    def disconnected(self, endpoint):
+        if self.enabled:
+            self.disconnections.inc(endpoint)
+
+    def group_joined(self, group):
+        if self.enabled:
+            self.groups[group] = self.groups.get(group, 0) + 1
+
+    def group_left(self, group):
+        if not self.enabled:
+            return
+        count = self.groups.get(group, 0) - 1
+        if count > 0:
+            self.groups[group] = count
+        else:
+            self.groups.pop(group, None)
+
+    def message_received(self, kind):
+        if self.enabled:
+            self.received.inc(kind)
+
+    def group_sent(self, kind, group):
+        if self.enabled:
+            self.fanout.observe(self.groups.get(group, 0), kind)
+
+    def frame_sent(self):
+        if self.enabled:
+            self.frames_sent.inc()
+
+    def timed(self, operation):
+        """Decorator de corrotina: soma o tempo em chat_db_seconds{operation}."""
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return await func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self.db_seconds.observe(time.perf_counter() - started, operation)
+
+            return wrapper
+
+        return decorator
+
+    def request_finished(self, view, seconds, queries):
+        self.http_seconds.observe(seconds, view)
+        self.http_queries.observe(queries, view)
+
+    # Coleta
+
+    def render(self):
+        from .tracing import tracer
+
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        lines.extend(tracer.stages.render())
+
+        rooms = Gauge("chat_room_sockets", "Sockets conectados à sala neste worker.", ("room",))
+        direct = 0
+        for group, count in self.groups.items():
+            if group.startswith("chat_room_"):
+                rooms.set(count, group[len("chat_room_"):])
+            else:
+                direct += count
+        lines.extend(rooms.render())
+        direct_sockets = Gauge("chat_direct_sockets", "Sockets nos grupos de mensagens diretas.")
+        direct_sockets.set(direct)
+        lines.extend(direct_sockets.render())
+
+        for service, get_stats in service_stats().items():
+            for key, value in sorted(get_stats().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE chat_{service}_{key} gauge")
+                    lines.append(f"chat_{service}_{key} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        self.groups.clear()
+        for metric in self.metrics:
+            metric.clear()
+
+
+metrics = Metrics()
+
+
+@receiver(setting_changed)
+def reload_metrics(setting, **kwargs):
+    if setting == "CHAT_METRICS":
+        metrics.reload()
+
+
+class MetricsMiddleware:
+    """Latência e consultas por view. Fica fora da pilha com as métricas desligadas."""
+
+    def __init__(self, get_response):
+        if not metrics.enabled:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(count):
+            response = self.get_response(request)
+        match = request.resolver_match
+        metrics.request_finished(
+            match.view_name if match else "unmatched", time.perf_counter() - started, queries
+        )
+        return response
@@ -0,0 +1,67 @@
+# Generated migration for the Conversation backfill
+from django.db import migrations
+from django.db.models import Count, Max, Q
+
+
+def backfill_conversations(apps, schema_editor):
+    """
+    Cria um Conversation para cada par de usuários que já trocou mensagens diretas
+    """
+    Message = apps.get_model('chat', 'Message')
+    Conversation = apps.get_model('chat', 'Conversation')
+
+    # Agrega por direção (remetente -> destinatário) e junta as duas direções do par
+    directions = (
+        Message.objects.filter(user_to__isnull=False)
+        .values('user_id', 'user_to_id')
+        .annotate(last_id=Max('id'), unread=Count('id', filter=Q(is_read=False)))
+    )
+
+    pairs = {}
+    for row in directions.iterator():
+        user_a, user_b = sorted((row['user_id'], row['user_to_id']))
+        pair = pairs.setdefault(
+            (user_a, user_b), {'last_id': 0, 'unread_a': 0, 'unread_b': 0}
+        )
+        pair['last_id'] = max(pair['last_id'], row['last_id'])
+        # As mensagens não lidas contam para o destinatário
+        if row['user_to_id'] == user_a:
+            pair['unread_a'] += row['unread']
+        else:
+            pair['unread_b'] += row['unread']
+
+    # Busca os timestamps em blocos para não estourar o limite de parâmetros do SQLite
+    last_ids = [pair['last_id'] for pair in pairs.values()]
+    timestamps = {}
+    for start in range(0, len(last_ids), 500):
+        timestamps.update(
+            Message.objects.filter(id__in=last_ids[start:start + 500])
+            .values_list('id', 'timestamp')
+        )
+
+    Conversation.objects.bulk_create(
+        [
+            Conversation(
+                user_a_id=user_a,
+                user_b_id=user_b,
+                last_message_id=pair['last_id'],
+                last_timestamp=timestamps[pair['last_id']],
+                unread_a=pair['unread_a'],
+                unread_b=pair['unread_b'],
+            )
+            for (user_a, user_b), pair in pairs.items()
+        ],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_conversation'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='room',
+            name='retention_days',
+            field=models.PositiveIntegerField(blank=True, help_text="Dias até as mensagens serem arquivadas. Vazio: CHAT_RETENTION['ROOM_DAYS'].", null=True),
+        ),
+    ]
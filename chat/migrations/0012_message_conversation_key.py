@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:34
+
+import django.db.models.expressions
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_room_retention_days'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conversation_key',
+            field=models.GeneratedField(db_persist=False, expression=django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(django.db.models.functions.comparison.Least(models.F('user'), models.F('user_to')), '*', models.Value(4294967296)), '+', django.db.models.functions.comparison.Greatest(models.F('user'), models.F('user_to'))), null=True, output_field=models.BigIntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation_key', 'timestamp', 'id'], name='message_conversation_idx'),
+        ),
+    ]
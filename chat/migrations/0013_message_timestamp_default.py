@@ -0,0 +1,24 @@
+# Generated migration: Message.timestamp passa de auto_now_add para default=timezone.now
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_conversation_key'),
+    ]
+
+    # A coluna não muda, só o estado do modelo: um AlterField normal recriaria
+    # chat_message no SQLite (e com ela sumiriam os triggers do índice de busca)
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='message',
+                    name='timestamp',
+                    field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+                ),
+            ],
+        ),
+    ]
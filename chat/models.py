@@ -1,6 +1,17 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest, Least
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+
+# Chave da conversa de uma mensagem direta: menor id * CONVERSATION_SHIFT + maior id
+CONVERSATION_SHIFT = 2**32
+
+
+def conversation_key(user_id, other_id):
+    return min(user_id, other_id) * CONVERSATION_SHIFT + max(user_id, other_id)
 
 
 # Create your models here.
@@ -9,6 +20,12 @@ class Room(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
+    # Dias até as mensagens irem para o arquivo (chat/retention.py); vazio usa o padrão
+    retention_days = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Dias até as mensagens serem arquivadas. Vazio: CHAT_RETENTION['ROOM_DAYS'].",
+    )
 
     def __str__(self):
         return self.name
@@ -32,8 +49,21 @@ class Message(models.Model):
     )
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="messages")
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Default (e não auto_now_add): quem já tem o horário, como a persistência em lote
+    # (o mesmo do broadcast) e as cargas de teste, grava o seu sem ele ser recarimbado
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     is_read = models.BooleanField(default=False)
+    # Chave de idempotência (prefixada pelo id do remetente) usada pela persistência em lote
+    client_key = models.CharField(max_length=64, null=True, blank=True, unique=True)
+    # Par da conversa (ver conversation_key) calculado pelo banco em qualquer INSERT,
+    # inclusive bulk_create e SQL direto; NULL nas mensagens de sala
+    conversation_key = models.GeneratedField(
+        expression=Least(F("user"), F("user_to")) * CONVERSATION_SHIFT
+        + Greatest(F("user"), F("user_to")),
+        output_field=models.BigIntegerField(),
+        db_persist=False,
+        null=True,
+    )
 
     def __str__(self):
         if self.room:
@@ -43,11 +73,12 @@ class Message(models.Model):
 
     def clean(self):
         """Validação: room OU user_to deve estar definido, mas não ambos"""
-        if self.room and self.user_to:
+        # Usa os ids para não buscar a sala/usuário no banco a cada mensagem
+        if self.room_id and self.user_to_id:
             raise ValidationError(
                 "Mensagem não pode ser para sala E usuário ao mesmo tempo."
             )
-        if not self.room and not self.user_to:
+        if not self.room_id and not self.user_to_id:
             raise ValidationError("Mensagem deve ser para uma sala OU para um usuário.")
 
     def save(self, *args, **kwargs):
@@ -61,5 +92,58 @@ class Message(models.Model):
 
     class Meta:
         ordering = ["-timestamp"]
+        # Índices para a paginação por cursor (chat/pagination.py)
+        indexes = [
+            models.Index(fields=["room", "timestamp", "id"], name="message_room_cursor_idx"),
+            models.Index(
+                fields=["user", "user_to", "timestamp", "id"], name="message_direct_cursor_idx"
+            ),
+            # As duas direções de uma conversa numa só faixa do índice
+            models.Index(
+                fields=["conversation_key", "timestamp", "id"],
+                name="message_conversation_idx",
+            ),
+        ]
         verbose_name = "Mensagem"
         verbose_name_plural = "Mensagens"
+
+
+class Conversation(models.Model):
+    """
+    Resumo desnormalizado de uma conversa direta (um registro por par de usuários).
+    O par é guardado em ordem (user_a.id < user_b.id) e é mantido por chat/conversations.py.
+    """
+
+    user_a = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="conversations_as_a"
+    )
+    user_b = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="conversations_as_b"
+    )
+    last_message = models.ForeignKey(
+        Message, null=True, blank=True, on_delete=models.SET_NULL, related_name="+"
+    )
+    last_timestamp = models.DateTimeField()
+    unread_a = models.PositiveIntegerField(default=0)
+    unread_b = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_a.username} ↔ {self.user_b.username}"
+
+    def other_user(self, user):
+        return self.user_b if user.id == self.user_a_id else self.user_a
+
+    def unread_for(self, user):
+        return self.unread_a if user.id == self.user_a_id else self.unread_b
+
+    class Meta:
+        ordering = ["-last_timestamp"]
+        constraints = [
+            models.UniqueConstraint(fields=["user_a", "user_b"], name="conversation_pair_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["user_a", "-last_timestamp"], name="conversation_a_inbox_idx"),
+            models.Index(fields=["user_b", "-last_timestamp"], name="conversation_b_inbox_idx"),
+        ]
+        verbose_name = "Conversa"
+        verbose_name_plural = "Conversas"
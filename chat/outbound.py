@@ -0,0 +1,225 @@
+import asyncio
+import functools
+import time
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+"""
+    Fila de saída por conexão (backpressure):
+       -> O acúmulo real fica no buffer de escrita do transporte: no Daphne o send do
+          ASGI nunca espera, o frame vai direto para o buffer do Twisted. O
+          WriteBufferMiddleware expõe o tamanho desse buffer ao consumer
+          (scope["write_buffer"])
+       -> Buffer abaixo de HIGH_WATER bytes e nada na fila: o handler escreve direto,
+          sem fila e sem tarefa (o caminho de quase todos os frames)
+       -> Buffer acima de HIGH_WATER (cliente que parou de ler): os frames vão para
+          uma fila limitada e uma tarefa os escreve conforme o buffer escoa; a tarefa
+          termina quando a fila esvazia
+       -> Sem scope["write_buffer"] (outro servidor, testes) o send pode esperar
+          (ex.: drain do uvicorn): todo frame passa pela fila e pela tarefa
+       -> Fila cheia (MAX_QUEUE frames), conforme POLICY:
+            "drop_oldest": descarta o frame mais antigo
+            "coalesce": eventos de estado (presença, digitação) substituem o anterior
+                        da mesma chave; sem chave, descarta o mais antigo
+            "disconnect": fecha o socket com CLOSE_CODE (o cliente reconecta)
+       -> Um socket que fica SEND_TIMEOUT segundos sem conseguir escrever (buffer
+          cheio ou send parado) é fechado em qualquer política
+       -> get_stats(): escritas diretas, profundidade das filas, descartes,
+          coalescências e expulsões
+"""
+
+DEFAULTS = {
+    "MAX_QUEUE": 256,
+    "POLICY": "drop_oldest",
+    "SEND_TIMEOUT": 30,
+    "CLOSE_CODE": 4008,
+    "HIGH_WATER": 65536,
+    "POLL_MS": 10,
+}
+
+POLICIES = ("drop_oldest", "coalesce", "disconnect")
+
+_queues = weakref.WeakSet()
+_totals = {
+    "direct": 0,
+    "queued": 0,
+    "sent": 0,
+    "dropped": 0,
+    "coalesced": 0,
+    "evictions": 0,
+    "max_depth": 0,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_OUTBOUND", {}))
+    if config["POLICY"] not in POLICIES:
+        raise ValueError(f"CHAT_OUTBOUND['POLICY'] inválida: use {', '.join(POLICIES)}.")
+    return config
+
+
+def write_buffer_probe(send):
+    """
+    Função que retorna os bytes no buffer de escrita do transporte do 'send' do
+    servidor, ou None se o servidor não expõe o transporte.
+    """
+    # Daphne: send = partial(server.handle_reply, protocolo do Autobahn/Twisted)
+    if not isinstance(send, functools.partial) or not send.args:
+        return None
+    transport = getattr(send.args[0], "transport", None)
+    if transport is None:
+        return None
+    if hasattr(transport, "get_write_buffer_size"):
+        return transport.get_write_buffer_size
+
+    # twisted.internet.abstract.FileDescriptor: dataBuffer, offset e _tempDataLen são
+    # internos do Twisted. Só são usados se a leitura funciona agora; senão (outra
+    # versão) o socket fica sem sonda e todo frame passa pela fila
+    def buffered():
+        return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+
+    try:
+        size = buffered()
+    except (AttributeError, TypeError):
+        return None
+    return buffered if isinstance(size, int) and size >= 0 else None
+
+
+class WriteBufferMiddleware:
+    """Põe scope["write_buffer"] nos WebSockets. Deve ser o primeiro da pilha ASGI."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "websocket":
+            probe = write_buffer_probe(send)
+            if probe is not None:
+                scope = {**scope, "write_buffer": probe}
+        return await self.inner(scope, receive, send)
+
+
+class OutboundQueue:
+    """
+    Saída de um socket. 'write' escreve um frame na conexão (o send do consumer),
+    'evict' fecha o socket quando ele é expulso e 'buffered' é o scope["write_buffer"].
+    """
+
+    def __init__(self, write, evict, buffered=None):
+        config = get_config()
+        self.write = write
+        self.evict = evict
+        self.buffered = buffered
+        self.max_queue = config["MAX_QUEUE"]
+        self.policy = config["POLICY"]
+        self.send_timeout = config["SEND_TIMEOUT"]
+        self.high_water = config["HIGH_WATER"]
+        self.poll = config["POLL_MS"] / 1000
+        self.frames = deque()  # (chave de coalescência ou None, texto, callback ou None)
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.closed = False
+        self.task = None
+        _queues.add(self)
+
+    def congested(self):
+        return self.buffered is None or self.buffered() >= self.high_water
+
+    async def put(self, text, key=None, written=None):
+        """Escreve ou enfileira um frame; 'written' é chamado depois que ele for escrito."""
+        if self.closed:
+            return
+        if self.task is None and not self.frames and not self.congested():
+            await self.write(text)
+            _totals["direct"] += 1
+            _totals["sent"] += 1
+            if written is not None:
+                written()
+            return
+
+        if len(self.frames) >= self.max_queue and not self.make_room(key):
+            return
+        self.frames.append((key, text, written))
+        _totals["queued"] += 1
+        _totals["max_depth"] = max(_totals["max_depth"], len(self.frames))
+        self.idle.clear()
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def make_room(self, key):
+        """Abre espaço na fila cheia conforme a política; False se o frame não deve entrar."""
+        if self.policy == "disconnect":
+            self.close(evicted=True)
+            return False
+        if self.policy == "coalesce" and key is not None:
+            for index, (queued_key, _, _) in enumerate(self.frames):
+                if queued_key == key:
+                    del self.frames[index]
+                    _totals["coalesced"] += 1
+                    return True
+        self.frames.popleft()
+        _totals["dropped"] += 1
+        return True
+
+    async def drained(self):
+        """Espera o buffer do transporte baixar de HIGH_WATER; False depois de SEND_TIMEOUT."""
+        deadline = time.monotonic() + self.send_timeout
+        while self.buffered() >= self.high_water:
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(self.poll)
+        return True
+
+    async def run(self):
+        try:
+            while self.frames:
+                if self.buffered is not None and not await self.drained():
+                    self.close(evicted=True)
+                    return
+                _, text, written = self.frames.popleft()
+                try:
+                    await asyncio.wait_for(self.write(text), self.send_timeout)
+                except asyncio.TimeoutError:
+                    self.close(evicted=True)
+                    return
+                _totals["sent"] += 1
+                if written is not None:
+                    written()
+        finally:
+            self.task = None
+            self.idle.set()
+
+    async def flush(self, timeout=None):
+        """Espera a fila esvaziar (ex.: antes de fechar o socket de propósito)."""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def close(self, evicted=False):
+        if self.closed:
+            return
+        self.closed = True
+        self.frames.clear()
+        self.idle.set()
+        if evicted:
+            _totals["evictions"] += 1
+            asyncio.get_running_loop().create_task(self.evict())
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def __len__(self):
+        return len(self.frames)
+
+
+def get_stats():
+    depths = [len(queue) for queue in list(_queues) if not queue.closed]
+    return {
+        **_totals,
+        "connections": len(depths),
+        "depth": sum(depths),
+        "deepest": max(depths, default=0),
+    }
@@ -0,0 +1,117 @@
+from django.db.models import Q
+from .models import Message, conversation_key
+from . import retention
+
+"""
+    Paginação por cursor (keyset) do histórico de mensagens:
+       -> As páginas são ordenadas por (timestamp, id), cobertas pelos índices compostos de Message:
+          (room, timestamp, id) nas salas e (conversation_key, timestamp, id) nas DMs, que
+          põe as duas direções da conversa numa só faixa do índice (sem OR nem ordenação)
+       -> 'before=<id>' retorna as mensagens anteriores à mensagem <id>
+       -> 'after=<id>' retorna as mensagens posteriores à mensagem <id>
+       -> Sem cursor retorna a página mais recente
+       -> O custo de cada página não depende da profundidade do histórico (sem OFFSET)
+       -> Quando a página passa da mensagem mais antiga de chat_message ela continua
+          nas tabelas de arquivo (chat/retention.py), inclusive com cursor arquivado
+"""
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def parse_page_params(params, default_limit=DEFAULT_PAGE_SIZE):
+    """Lê before/after/limit da querystring."""
+    try:
+        before = int(params["before"]) if params.get("before") else None
+        after = int(params["after"]) if params.get("after") else None
+        limit = int(params.get("limit") or default_limit)
+    except ValueError:
+        raise InvalidCursor("Parâmetros de paginação inválidos.")
+
+    if before is not None and after is not None:
+        raise InvalidCursor("Use apenas 'before' ou 'after'.")
+
+    return before, after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def paginate_messages(queryset, before=None, after=None, limit=DEFAULT_PAGE_SIZE, archive=None):
+    """
+    Retorna uma página de mensagens em ordem cronológica.
+    O cursor é resolvido dentro do próprio queryset (uma mensagem de outra sala/conversa é ignorada).
+    'archive' é o escopo (sql, params) do mesmo histórico nas tabelas de arquivo.
+    """
+    cursor_id = before if before is not None else after
+    cursor = None
+    archived_cursor = False
+
+    if cursor_id is not None:
+        cursor = queryset.filter(id=cursor_id).values("timestamp", "id").first()
+        if cursor is None and archive is not None:
+            cursor = retention.find_cursor(archive, cursor_id)
+            archived_cursor = cursor is not None
+        if cursor is None:
+            raise InvalidCursor("Cursor não encontrado.")
+
+        # (timestamp, id) < cursor, escrito com um intervalo em timestamp para que o
+        # SQLite use o índice composto como range scan
+        if before is not None:
+            queryset = queryset.filter(timestamp__lte=cursor["timestamp"]).filter(
+                Q(timestamp__lt=cursor["timestamp"]) | Q(id__lt=cursor["id"])
+            )
+        else:
+            queryset = queryset.filter(timestamp__gte=cursor["timestamp"]).filter(
+                Q(timestamp__gt=cursor["timestamp"]) | Q(id__gt=cursor["id"])
+            )
+
+    if after is not None:
+        # Cursor arquivado: primeiro o resto do arquivo, depois chat_message
+        page = retention.archived_page(archive, after=cursor, limit=limit) if archived_cursor else []
+        return page + list(queryset.order_by("timestamp", "id")[: limit - len(page)])
+
+    page = list(queryset.order_by("-timestamp", "-id")[:limit])
+    page.reverse()
+    if len(page) < limit and archive is not None:
+        # Chegou ao começo de chat_message: completa com as arquivadas (todas mais antigas)
+        oldest = {"timestamp": page[0].timestamp, "id": page[0].id} if page else cursor
+        page = retention.archived_page(archive, before=oldest, limit=limit - len(page)) + page
+    return page
+
+
+def room_messages(room):
+    return Message.objects.filter(room=room)
+
+
+def direct_messages(user, other_user):
+    return Message.objects.filter(conversation_key=conversation_key(user.id, other_user.id))
+
+
+def room_history(room, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    queryset = room_messages(room).select_related("user")
+    return paginate_messages(
+        queryset, before, after, limit, archive=retention.room_scope(room.id)
+    )
+
+
+def direct_history(user, other_user, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    queryset = direct_messages(user, other_user).select_related("user")
+    return paginate_messages(
+        queryset, before, after, limit, archive=retention.direct_scope(user.id, other_user.id)
+    )
+
+
+def serialize_history(messages):
+    return [
+        {
+            "id": msg.id,
+            "user_id": msg.user.id,
+            "username": msg.user.username,
+            "content": msg.content,
+            "timestamp": msg.timestamp.isoformat(),
+            "is_read": msg.is_read,
+        }
+        for msg in messages
+    ]
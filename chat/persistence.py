@@ -0,0 +1,277 @@
+import asyncio
+import atexit
+import time
+from collections import defaultdict
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .conversations import record_direct_messages
+from .database import db_write
+from .models import Message
+from . import protocol
+
+"""
+    Persistência em lote (write-behind) das mensagens do ChatConsumer:
+       -> Ativada com CHAT_PERSISTENCE["MODE"] = "batched" (o padrão continua "direct")
+       -> save_room_message / save_direct_message apenas enfileiram a mensagem
+       -> O broadcast sai imediatamente, identificado pela 'client_key'
+       -> A fila é gravada com bulk_create quando atinge BATCH_SIZE mensagens
+          ou quando a janela de BATCH_WINDOW_MS expira
+       -> Com MAX_PENDING mensagens pendentes o remetente espera o flush (backpressure)
+       -> O disconnect de cada consumer e o atexit do processo forçam o flush final
+       -> Depois de cada flush os ids gravados vão para a sala (ou para os dois lados
+          da conversa) num evento "saved" (client_key -> id), para o cliente avançar
+          o last_message_id da retomada
+       -> Linhas descartadas no flush (ex.: destinatário apagado depois do envio) são
+          avisadas ao remetente com um evento "failed" com a client_key
+"""
+
+DEFAULTS = {
+    "MODE": "direct",
+    "BATCH_SIZE": 200,
+    "BATCH_WINDOW_MS": 20,
+    "MAX_PENDING": 10000,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_PERSISTENCE", {}))
+    return config
+
+
+def is_batched():
+    return get_config()["MODE"] == "batched"
+
+
+def make_client_key(user_id, client_key):
+    # Prefixa com o remetente para que um cliente não colida com as chaves de outro
+    return f"{user_id}:{client_key}"[:64]
+
+
+class MessageBatcher:
+    def __init__(self, batch_size=200, window_ms=20, max_pending=10000):
+        self.batch_size = batch_size
+        self.window = window_ms / 1000
+        self.max_pending = max_pending
+        self.pending = []
+        self.pending_keys = {}
+        # client_key -> callback chamado se a mensagem for descartada no flush
+        self.on_dropped = {}
+        self._timer = None
+        self._lock = asyncio.Lock()
+        self.stats = {
+            "enqueued": 0,
+            "flushes": 0,
+            "flushed_messages": 0,
+            "flush_errors": 0,
+            "dropped": 0,
+            "backpressure_waits": 0,
+            "max_pending": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    async def enqueue(self, message, on_dropped=None):
+        if len(self.pending) >= self.max_pending:
+            self.stats["backpressure_waits"] += 1
+            await self.flush()
+
+        if message.client_key in self.pending_keys:
+            return self.pending_keys[message.client_key]
+
+        self.pending.append(message)
+        self.pending_keys[message.client_key] = message
+        if on_dropped is not None:
+            self.on_dropped[message.client_key] = on_dropped
+        self.stats["enqueued"] += 1
+        self.stats["max_pending"] = max(self.stats["max_pending"], len(self.pending))
+
+        if len(self.pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.window, self._schedule_flush
+            )
+        return message
+
+    def mark_read(self, client_key, reader_id):
+        """Marca como lida uma mensagem ainda não gravada. Retorna False se já foi gravada."""
+        message = self.pending_keys.get(client_key)
+        if message is None:
+            return False
+        if message.user_to_id == reader_id:
+            message.is_read = True
+        return True
+
+    def _schedule_flush(self):
+        self._timer = None
+        asyncio.ensure_future(self._timed_flush())
+
+    async def _timed_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            # Falha no flush por tempo: reagenda para a próxima janela
+            if self._timer is None and self.pending:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.window, self._schedule_flush
+                )
+
+    async def flush(self):
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending:
+                return 0
+
+            batch = self.pending
+            self.pending = []
+            started = time.perf_counter()
+            try:
+                written, dropped = await db_write(write_batch)(batch)
+            except Exception:
+                # Devolve o lote para a fila; o próximo flush tenta de novo
+                self.pending = batch + self.pending
+                self.stats["flush_errors"] += 1
+                raise
+
+            callbacks = {}
+            for message in batch:
+                self.pending_keys.pop(message.client_key, None)
+                callbacks[message.client_key] = self.on_dropped.pop(message.client_key, None)
+            self.stats["flushes"] += 1
+            self.stats["flushed_messages"] += written
+            self.stats["dropped"] += len(dropped)
+            self.stats["last_flush_ms"] = (time.perf_counter() - started) * 1000
+
+            for message in dropped:
+                callback = callbacks.get(message.client_key)
+                if callback is not None:
+                    await callback(message)
+            await notify_saved(batch)
+            return written
+
+    def flush_sync(self):
+        """Flush sem event loop, usado no encerramento do processo."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self.pending = self.pending, []
+        self.pending_keys.clear()
+        self.on_dropped.clear()
+        if batch:
+            write_batch(batch)
+
+    def get_stats(self):
+        return {**self.stats, "pending": len(self.pending)}
+
+
+def write_batch(batch):
+    """
+    Grava o lote de uma vez; se alguma linha for inválida, grava uma a uma.
+    Retorna (gravadas, mensagens descartadas).
+    """
+    # Reenvios de uma client_key já gravada são descartados
+    keys = [message.client_key for message in batch]
+    existing = set()
+    for start in range(0, len(keys), 500):
+        existing.update(
+            Message.objects.filter(client_key__in=keys[start:start + 500]).values_list(
+                "client_key", flat=True
+            )
+        )
+    batch = [message for message in batch if message.client_key not in existing]
+
+    try:
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)
+            record_direct_messages(batch)
+        return len(batch), []
+    except IntegrityError:
+        written = 0
+        dropped = []
+        for message in batch:
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    Message.objects.bulk_create([message])
+                    record_direct_messages([message])
+                written += 1
+            except IntegrityError:
+                # Ex.: destinatário apagado; a mensagem é descartada e o remetente avisado
+                message.pk = None
+                dropped.append(message)
+        return written, dropped
+
+
+async def notify_saved(batch):
+    """Evento "saved" com os ids gravados, um por sala e um para cada lado das conversas."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    groups = defaultdict(dict)
+    for message in batch:
+        if message.pk is None:
+            continue
+        if message.room_id is not None:
+            targets = [(f"chat_room_{message.room_id}", message.room_id)]
+        else:
+            users = (message.user_id, message.user_to_id)
+            targets = [(f"chat_user_{user_id}", None) for user_id in users]
+        for target in targets:
+            groups[target][message.client_key] = message.pk
+    for (group, room_id), ids in groups.items():
+        await channel_layer.group_send(
+            group, protocol.event("saved", {"room_id": room_id, "ids": ids})
+        )
+
+
+# Um batcher por event loop (objetos asyncio não podem ser compartilhados entre loops)
+_batchers = {}
+
+
+def get_batcher():
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        config = get_config()
+        batcher = MessageBatcher(
+            batch_size=config["BATCH_SIZE"],
+            window_ms=config["BATCH_WINDOW_MS"],
+            max_pending=config["MAX_PENDING"],
+        )
+        _batchers[loop] = batcher
+    return batcher
+
+
+def get_stats():
+    stats = {}
+    for batcher in _batchers.values():
+        for key, value in batcher.get_stats().items():
+            if key in ("max_pending", "last_flush_ms"):
+                stats[key] = max(stats.get(key, 0), value)
+            else:
+                stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+def build_message(user, content, client_key, room_id=None, user_to_id=None):
+    # O timestamp é o do broadcast e é o gravado no flush (Message.timestamp não é auto_now_add)
+    return Message(
+        room_id=room_id,
+        user=user,
+        user_to_id=user_to_id,
+        content=content,
+        is_read=False,
+        client_key=client_key,
+        timestamp=timezone.now(),
+    )
+
+
+@atexit.register
+def flush_all():
+    for batcher in list(_batchers.values()):
+        batcher.flush_sync()
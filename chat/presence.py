@@ -0,0 +1,322 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from . import protocol
+
+"""
+    Presença (quem está online) e indicador de digitação:
+       -> connect/disconnect do ChatConsumer registram o socket por sala e por usuário
+       -> Frames {"type": "typing"} só marcam o usuário como digitando em memória
+       -> A cada TICK_MS cada worker envia no máximo um evento por sala alterada
+          (online, quem entrou, quem saiu, quem está digitando) e um por destinatário
+          de DM com digitação alterada: mil teclas no mesmo tick viram uma mensagem
+       -> Salas com LARGE_ROOM ou mais pessoas online recebem no máximo um evento a
+          cada LARGE_TICK_MS: o custo do fan-out (um frame por socket) fica limitado
+       -> Entre workers: cada processo publica a lista dos seus usuários online a cada
+          HEARTBEAT segundos no grupo "chat_presence"; a lista de um worker que parou
+          de publicar expira depois de EXPIRY segundos
+       -> O canal de escuta volta ao grupo a cada heartbeat (os grupos do channel
+          layer expiram) e a escuta sobrevive a erros do channel layer
+       -> A contagem de online é exposta em /api/presence/...
+"""
+
+DEFAULTS = {
+    "TICK_MS": 250,
+    "HEARTBEAT": 5,
+    "EXPIRY": 15,
+    "TYPING_TTL": 3,
+    "MAX_DELTA": 50,
+    "LARGE_ROOM": 1000,
+    "LARGE_TICK_MS": 2000,
+}
+
+GROUP = "chat_presence"
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_PRESENCE", {}))
+    return config
+
+
+class Presence:
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.rooms = defaultdict(Counter)  # sala -> {usuário: sockets} deste worker
+        self.users = Counter()  # usuário -> sockets deste worker (qualquer tipo)
+        self.remote = {}  # worker -> (recebido em, {sala: {usuários}}, {usuários})
+        self.typing = defaultdict(dict)  # sala -> {usuário: expira em}
+        self.direct_typing = defaultdict(dict)  # destinatário -> {remetente: expira em}
+        self.joined = defaultdict(set)
+        self.left = defaultdict(set)
+        self.dirty_rooms = set()
+        self.dirty_users = set()
+        self.last_broadcast = {}  # sala -> instante do último evento
+        self.loop = None
+        self.tasks = []
+        self.stats = {
+            "events": 0,
+            "ticks": 0,
+            "broadcasts": 0,
+            "heartbeats_sent": 0,
+            "heartbeats_received": 0,
+            "listen_errors": 0,
+        }
+
+    # Estado local (chamado pelo consumer)
+
+    def join(self, room_id, user_id):
+        with self.lock:
+            self.stats["events"] += 1
+            self.users[user_id] += 1
+            if room_id is None:
+                return
+            sockets = self.rooms[room_id]
+            sockets[user_id] += 1
+            if sockets[user_id] == 1:
+                self.joined[room_id].add(user_id)
+                self.left[room_id].discard(user_id)
+                self.dirty_rooms.add(room_id)
+
+    def leave(self, room_id, user_id):
+        with self.lock:
+            self.stats["events"] += 1
+            self.users[user_id] -= 1
+            if self.users[user_id] <= 0:
+                del self.users[user_id]
+            if room_id is None or user_id not in self.rooms.get(room_id, ()):
+                return
+            sockets = self.rooms[room_id]
+            sockets[user_id] -= 1
+            if sockets[user_id] <= 0:
+                del sockets[user_id]
+                if not sockets:
+                    del self.rooms[room_id]
+                self.typing[room_id].pop(user_id, None)
+                self.left[room_id].add(user_id)
+                self.joined[room_id].discard(user_id)
+                self.dirty_rooms.add(room_id)
+
+    def set_typing(self, room_id, user_id, active=True):
+        with self.lock:
+            self.stats["events"] += 1
+            typing = self.typing[room_id]
+            if active:
+                if user_id not in typing:
+                    self.dirty_rooms.add(room_id)
+                typing[user_id] = time.monotonic() + get_config()["TYPING_TTL"]
+            elif typing.pop(user_id, None) is not None:
+                self.dirty_rooms.add(room_id)
+
+    def set_direct_typing(self, user_to_id, user_id, active=True):
+        with self.lock:
+            self.stats["events"] += 1
+            typing = self.direct_typing[user_to_id]
+            if active:
+                if user_id not in typing:
+                    self.dirty_users.add(user_to_id)
+                typing[user_id] = time.monotonic() + get_config()["TYPING_TTL"]
+            elif typing.pop(user_id, None) is not None:
+                self.dirty_users.add(user_to_id)
+
+    # Consultas (visão de todos os workers)
+
+    def live_remote(self):
+        expiry = get_config()["EXPIRY"]
+        now = time.monotonic()
+        return [
+            (rooms, users)
+            for seen_at, rooms, users in self.remote.values()
+            if now - seen_at < expiry
+        ]
+
+    def online_users(self, room_id):
+        with self.lock:
+            online = set(self.rooms.get(room_id, ()))
+            for rooms, _ in self.live_remote():
+                online.update(rooms.get(room_id, ()))
+        return online
+
+    def online_count(self, room_id):
+        return len(self.online_users(room_id))
+
+    def room_counts(self, room_ids):
+        with self.lock:
+            remote = self.live_remote()
+            counts = {}
+            for room_id in room_ids:
+                online = set(self.rooms.get(room_id, ()))
+                for rooms, _ in remote:
+                    online.update(rooms.get(room_id, ()))
+                counts[room_id] = len(online)
+        return counts
+
+    def is_online(self, user_ids):
+        with self.lock:
+            remote = self.live_remote()
+            return {
+                user_id: user_id in self.users or any(user_id in users for _, users in remote)
+                for user_id in user_ids
+            }
+
+    # Tick: junta as alterações e envia um evento por sala / destinatário
+
+    def collect(self):
+        """Retorna os eventos do tick e limpa as alterações pendentes."""
+        config = get_config()
+        max_delta = config["MAX_DELTA"]
+        now = time.monotonic()
+        events = []
+        postponed = set()
+        with self.lock:
+            for typing_map, dirty in (
+                (self.typing, self.dirty_rooms),
+                (self.direct_typing, self.dirty_users),
+            ):
+                for key, typing in list(typing_map.items()):
+                    expired = [user_id for user_id, expires in typing.items() if expires <= now]
+                    for user_id in expired:
+                        del typing[user_id]
+                    if expired:
+                        dirty.add(key)
+                    if not typing:
+                        del typing_map[key]
+
+            remote = self.live_remote()
+            for room_id in self.dirty_rooms:
+                online = set(self.rooms.get(room_id, ()))
+                for rooms, _ in remote:
+                    online.update(rooms.get(room_id, ()))
+                if (
+                    len(online) >= config["LARGE_ROOM"]
+                    and now - self.last_broadcast.get(room_id, 0) < config["LARGE_TICK_MS"] / 1000
+                ):
+                    # Sala grande: as alterações se acumulam até a próxima janela
+                    postponed.add(room_id)
+                    continue
+                self.last_broadcast[room_id] = now
+                # Quem ainda está na sala por outro worker não saiu
+                left = self.left.pop(room_id, set()) - online
+                joined = self.joined.pop(room_id, set()) & online
+                events.append((
+                    f"chat_room_{room_id}",
+                    protocol.event("presence", {
+                        "room_id": room_id,
+                        "online": len(online),
+                        "joined": sorted(joined)[:max_delta],
+                        "left": sorted(left)[:max_delta],
+                        "typing": sorted(self.typing.get(room_id, ())),
+                    }, coalesce="presence"),
+                ))
+            for user_to_id in self.dirty_users:
+                events.append((
+                    f"chat_user_{user_to_id}",
+                    protocol.event(
+                        "typing",
+                        {"user_ids": sorted(self.direct_typing.get(user_to_id, ()))},
+                        coalesce="typing",
+                    ),
+                ))
+            for room_id in set(self.last_broadcast) - set(self.rooms) - postponed:
+                del self.last_broadcast[room_id]
+            self.dirty_rooms = postponed
+            self.dirty_users = set()
+            self.stats["ticks"] += 1
+            self.stats["broadcasts"] += len(events)
+        return events
+
+    async def tick(self):
+        channel_layer = get_channel_layer()
+        for group, event in self.collect():
+            await channel_layer.group_send(group, event)
+
+    # Heartbeat entre workers
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "type": "presence.heartbeat",
+                "worker": self.worker_id,
+                "rooms": [[room_id, list(users)] for room_id, users in self.rooms.items()],
+                "users": list(self.users),
+            }
+
+    def receive_heartbeat(self, message):
+        if message.get("worker") == self.worker_id:
+            return
+        with self.lock:
+            self.stats["heartbeats_received"] += 1
+            self.remote[message["worker"]] = (
+                time.monotonic(),
+                {room_id: set(users) for room_id, users in message["rooms"]},
+                set(message["users"]),
+            )
+            expiry = get_config()["EXPIRY"]
+            for worker, (seen_at, _, _) in list(self.remote.items()):
+                if time.monotonic() - seen_at >= expiry:
+                    del self.remote[worker]
+
+    async def run_ticks(self):
+        while True:
+            await asyncio.sleep(get_config()["TICK_MS"] / 1000)
+            try:
+                await self.tick()
+            except Exception:
+                # Um tick com erro não pode parar a presença; o próximo tenta de novo
+                pass
+
+    async def run_heartbeats(self, channel_layer, channel):
+        while True:
+            try:
+                # Renova a inscrição: sem isso o canal sai do grupo depois do
+                # group_expiry do channel layer e o worker para de ouvir os outros
+                await channel_layer.group_add(GROUP, channel)
+                await channel_layer.group_send(GROUP, self.snapshot())
+                self.stats["heartbeats_sent"] += 1
+            except Exception:
+                pass
+            await asyncio.sleep(get_config()["HEARTBEAT"])
+
+    async def listen(self, channel_layer, channel):
+        while True:
+            try:
+                message = await channel_layer.receive(channel)
+                if message.get("type") == "presence.heartbeat":
+                    self.receive_heartbeat(message)
+            except Exception:
+                # Broker reconectando ou heartbeat malformado: a escuta não pode parar
+                self.stats["listen_errors"] += 1
+                await asyncio.sleep(get_config()["HEARTBEAT"])
+
+    async def ensure_started(self):
+        """Sobe as tarefas de tick, heartbeat e escuta no event loop atual (uma vez por loop)."""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(GROUP, channel)
+        self.tasks = [
+            loop.create_task(self.run_ticks()),
+            loop.create_task(self.run_heartbeats(channel_layer, channel)),
+            loop.create_task(self.listen(channel_layer, channel)),
+        ]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "local_users": len(self.users),
+                "rooms": len(self.rooms),
+                "remote_workers": len(self.remote),
+            }
+
+
+presence = Presence()
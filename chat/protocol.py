@@ -0,0 +1,182 @@
+import json
+
+"""
+    Protocolo de envio do ChatConsumer para o navegador:
+       -> "json" (padrão): objetos JSON com as chaves completas, como sempre foi
+       -> "chat.v2" (subprotocolo negociado no handshake): arrays JSON compactos,
+          sem chaves repetidas e com timestamp em milissegundos desde a época
+
+    Formato chat.v2:
+       -> sala:         ["r", message_id, user_id, username, message, timestamp_ms, client_key, room_id]
+       -> direta:       ["d", message_id, user_id, username, message, timestamp_ms, client_key, is_read]
+       -> sala fechada: ["c", room_id]
+       -> presença:     ["p", room_id, online, joined, left, typing]
+       -> digitando:    ["t", user_ids]   (mensagens diretas)
+       -> retomada:     ["s", room_id, replayed, complete]
+       -> limite:       ["l", scope, retry_after_ms, client_key]
+       -> inscrição:    ["+", room_id] / ["-", room_id]   (socket multiplexado)
+       -> erro:         ["e", error]
+       -> gravadas:     ["k", room_id, {client_key: message_id}]   (persistência em lote)
+       -> descartada:   ["f", client_key, error]                   (persistência em lote)
+
+    Os eventos enviados por group_send carregam o texto já codificado para cada
+    protocolo (render), de forma que cada socket apenas escreve a string pronta.
+    Qualquer tipo de evento pode usar o mecanismo: event() monta o dicionário do
+    group_send e o handler padrão do consumer (chat_payload) só escreve o payload.
+"""
+
+JSON = "json"
+COMPACT = "chat.v2"
+
+PROTOCOLS = (JSON, COMPACT)
+
+
+def negotiate(requested):
+    """Escolhe o protocolo a partir dos subprotocolos pedidos pelo cliente."""
+    return COMPACT if COMPACT in (requested or []) else JSON
+
+
+def dumps(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+def encode_json(kind, data):
+    if kind == "room":
+        return json.dumps({
+            "type": "room",
+            "room_id": data["room_id"],
+            "message_id": data["id"],
+            "message": data["content"],
+            "username": data["username"],
+            "user_id": data["user_id"],
+            "timestamp": data["timestamp"],
+            "client_key": data["client_key"],
+        })
+    if kind == "direct":
+        return json.dumps({
+            "type": "direct",
+            "message_id": data["id"],
+            "message": data["content"],
+            "username": data["username"],
+            "user_id": data["user_id"],
+            "timestamp": data["timestamp"],
+            "is_read": True,  # Marca como lida ao receber
+            "client_key": data["client_key"],
+        })
+    if kind == "room_closed":
+        return json.dumps({"type": "room_closed", "room_id": data["room_id"]})
+    if kind == "presence":
+        return json.dumps({
+            "type": "presence",
+            "room_id": data["room_id"],
+            "online": data["online"],
+            "joined": data["joined"],
+            "left": data["left"],
+            "typing": data["typing"],
+        })
+    if kind == "typing":
+        return json.dumps({"type": "typing", "user_ids": data["user_ids"]})
+    if kind == "resume":
+        return json.dumps({
+            "type": "resume",
+            "room_id": data["room_id"],
+            "replayed": data["replayed"],
+            "complete": data["complete"],
+        })
+    if kind in ("subscribed", "unsubscribed"):
+        return json.dumps({"type": kind, "room_id": data["room_id"]})
+    if kind == "rate_limited":
+        return json.dumps({
+            "type": "rate_limited",
+            "scope": data["scope"],
+            "retry_after_ms": data["retry_after_ms"],
+            "client_key": data["client_key"],
+        })
+    if kind == "error":
+        return json.dumps({"error": data["error"]})
+    if kind == "saved":
+        return json.dumps({"type": "saved", "room_id": data["room_id"], "ids": data["ids"]})
+    if kind == "failed":
+        return json.dumps({
+            "type": "failed",
+            "client_key": data["client_key"],
+            "error": data["error"],
+        })
+    raise ValueError(f"Tipo de evento desconhecido: {kind}")
+
+
+def encode_compact(kind, data):
+    if kind == "room":
+        return dumps([
+            "r",
+            data["id"],
+            data["user_id"],
+            data["username"],
+            data["content"],
+            data["timestamp_ms"],
+            data["client_key"],
+            data["room_id"],
+        ])
+    if kind == "direct":
+        return dumps([
+            "d",
+            data["id"],
+            data["user_id"],
+            data["username"],
+            data["content"],
+            data["timestamp_ms"],
+            data["client_key"],
+            True,
+        ])
+    if kind == "room_closed":
+        return dumps(["c", data["room_id"]])
+    if kind == "presence":
+        return dumps([
+            "p",
+            data["room_id"],
+            data["online"],
+            data["joined"],
+            data["left"],
+            data["typing"],
+        ])
+    if kind == "typing":
+        return dumps(["t", data["user_ids"]])
+    if kind == "resume":
+        return dumps(["s", data["room_id"], data["replayed"], data["complete"]])
+    if kind == "subscribed":
+        return dumps(["+", data["room_id"]])
+    if kind == "unsubscribed":
+        return dumps(["-", data["room_id"]])
+    if kind == "rate_limited":
+        return dumps(["l", data["scope"], data["retry_after_ms"], data["client_key"]])
+    if kind == "error":
+        return dumps(["e", data["error"]])
+    if kind == "saved":
+        return dumps(["k", data["room_id"], data["ids"]])
+    if kind == "failed":
+        return dumps(["f", data["client_key"], data["error"]])
+    raise ValueError(f"Tipo de evento desconhecido: {kind}")
+
+
+ENCODERS = {
+    JSON: encode_json,
+    COMPACT: encode_compact,
+}
+
+
+def encode(protocol, kind, data):
+    return ENCODERS[protocol](kind, data)
+
+
+def render(kind, data):
+    """Codifica o evento uma única vez para cada protocolo suportado."""
+    return {protocol: encode(protocol, kind, data) for protocol in PROTOCOLS}
+
+
+def event(kind, data, handler="chat_payload", **fields):
+    """
+    Monta um evento de group_send com os payloads pré-codificados.
+    'handler' é o método do ChatConsumer que recebe o evento; 'fields' são dados
+    extras que o handler precisa além do payload (ex.: ids para confirmação de leitura).
+    """
+    return {"type": handler, "payloads": render(kind, data), **fields}
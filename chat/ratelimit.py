@@ -0,0 +1,256 @@
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+"""
+    Limite de mensagens por token bucket (antes de gravar e distribuir a mensagem):
+       -> Três baldes: por conexão, por usuário (todas as abas/sockets) e por sala.
+          Cada um tem RATE fichas por segundo e capacidade BURST; uma mensagem gasta
+          uma ficha de cada balde que se aplica, e só é aceita se todos tiverem ficha
+          (uma mensagem rejeitada não gasta nada)
+       -> Mensagem rejeitada: o socket recebe um evento "rate_limited" com o escopo
+          que estourou e retry_after_ms; nada é gravado nem enviado para a sala
+       -> Frames de digitação têm um balde próprio por conexão (TYPING_RATE): acima
+          dele são descartados em silêncio, sem gastar as fichas das mensagens
+       -> O balde é reabastecido na hora da verificação (sem timers): a checagem é
+          aritmética em memória, no event loop, sem lock nem consulta
+       -> Entre workers: a cada SYNC_MS cada processo publica no grupo
+          "chat_ratelimit" quantas fichas gastou por usuário/sala desde a última vez,
+          e os outros descontam dos seus baldes. Com o broker local (chat/broker.py)
+          o limite vale para o host inteiro, com atraso de até SYNC_MS
+       -> O canal de escuta volta ao grupo a cada SYNC_MS (os grupos do channel
+          layer expiram) e a escuta sobrevive a erros do channel layer
+       -> Desligado por padrão (ENABLED False): ligar muda o comportamento dos
+          clientes (mensagens acima do limite são rejeitadas). O settings do projeto
+          liga com os valores abaixo. RATE None desliga um escopo
+"""
+
+DEFAULTS = {
+    "ENABLED": False,
+    "CONNECTION_RATE": 5,
+    "CONNECTION_BURST": 10,
+    "TYPING_RATE": 1,
+    "TYPING_BURST": 5,
+    "USER_RATE": 10,
+    "USER_BURST": 20,
+    "ROOM_RATE": 100,
+    "ROOM_BURST": 200,
+    "SYNC_MS": 500,
+}
+
+GROUP = "chat_ratelimit"
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_RATE_LIMIT", {}))
+    return config
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        tokens = self.tokens + (now - self.updated) * self.rate
+        self.tokens = tokens if tokens < self.burst else self.burst
+        self.updated = now
+        return self.tokens
+
+    def retry_after(self):
+        """Segundos até a próxima ficha."""
+        return (1 - self.tokens) / self.rate
+
+    def is_idle(self, now):
+        # Cheio de novo: equivale a um balde novo e pode ser descartado
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex
+        self.config = None
+        self.users = {}
+        self.rooms = {}
+        # Fichas gastas desde o último sync, por usuário e por sala
+        self.pending_users = Counter()
+        self.pending_rooms = Counter()
+        self.loop = None
+        self.tasks = []
+        self.stats = {
+            "allowed": 0,
+            "rejected_connection": 0,
+            "rejected_user": 0,
+            "rejected_room": 0,
+            "rejected_typing": 0,
+            "syncs_sent": 0,
+            "syncs_received": 0,
+            "listen_errors": 0,
+        }
+
+    def reload(self):
+        """Relê CHAT_RATE_LIMIT (uma vez por processo, ou depois de mudar os settings)."""
+        self.config = get_config()
+        self.users.clear()
+        self.rooms.clear()
+        return self.config
+
+    def connection_bucket(self, scope="CONNECTION"):
+        """
+        Balde de um socket novo (guardado no próprio consumer), ou None. 'scope'
+        "TYPING" dá o balde dos frames de digitação.
+        """
+        config = self.config or self.reload()
+        if not config["ENABLED"] or config[f"{scope}_RATE"] is None:
+            return None
+        return TokenBucket(config[f"{scope}_RATE"], config[f"{scope}_BURST"], time.monotonic())
+
+    def check_typing(self, bucket):
+        """True se o frame de digitação pode seguir; gasta uma ficha do balde do socket."""
+        if bucket is None:
+            return True
+        if bucket.refill(time.monotonic()) < 1:
+            self.stats["rejected_typing"] += 1
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def check(self, user_id, room_id=None, connection=None):
+        """
+        Gasta uma ficha de cada balde aplicável. Retorna None se a mensagem pode
+        seguir, ou (escopo, retry_after_ms) se algum balde está vazio.
+        """
+        config = self.config or self.reload()
+        if not config["ENABLED"]:
+            return None
+        now = time.monotonic()
+
+        if connection is not None and connection.refill(now) < 1:
+            return self.reject("connection", connection)
+        user = room = None
+        if config["USER_RATE"] is not None:
+            user = self.users.get(user_id)
+            if user is None:
+                user = self.users[user_id] = TokenBucket(
+                    config["USER_RATE"], config["USER_BURST"], now
+                )
+            elif user.refill(now) < 1:
+                return self.reject("user", user)
+        if room_id is not None and config["ROOM_RATE"] is not None:
+            room = self.rooms.get(room_id)
+            if room is None:
+                room = self.rooms[room_id] = TokenBucket(
+                    config["ROOM_RATE"], config["ROOM_BURST"], now
+                )
+            elif room.refill(now) < 1:
+                return self.reject("room", room)
+
+        # Só gasta depois de saber que todos os baldes têm ficha
+        if connection is not None:
+            connection.tokens -= 1
+        if user is not None:
+            user.tokens -= 1
+            self.pending_users[user_id] += 1
+        if room is not None:
+            room.tokens -= 1
+            self.pending_rooms[room_id] += 1
+        self.stats["allowed"] += 1
+        return None
+
+    def reject(self, scope, bucket):
+        self.stats[f"rejected_{scope}"] += 1
+        return scope, max(1, round(bucket.retry_after() * 1000))
+
+    # Sincronização entre workers
+
+    def snapshot(self):
+        users, self.pending_users = self.pending_users, Counter()
+        rooms, self.pending_rooms = self.pending_rooms, Counter()
+        return {
+            "type": "ratelimit.sync",
+            "worker": self.worker_id,
+            "users": list(users.items()),
+            "rooms": list(rooms.items()),
+        }
+
+    def receive_sync(self, message):
+        if message.get("worker") == self.worker_id:
+            return
+        config = self.config or self.reload()
+        now = time.monotonic()
+        self.stats["syncs_received"] += 1
+        for buckets, usage, rate, burst in (
+            (self.users, message["users"], config["USER_RATE"], config["USER_BURST"]),
+            (self.rooms, message["rooms"], config["ROOM_RATE"], config["ROOM_BURST"]),
+        ):
+            if rate is None:
+                continue
+            for key, spent in usage:
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = TokenBucket(rate, burst, now)
+                else:
+                    bucket.refill(now)
+                # Pode ficar negativo (no máximo um BURST): o excesso dos outros
+                # workers é pago antes das próximas mensagens deste
+                bucket.tokens = max(bucket.tokens - spent, -bucket.burst)
+
+    def sweep(self):
+        now = time.monotonic()
+        for buckets in (self.users, self.rooms):
+            for key in [key for key, bucket in buckets.items() if bucket.is_idle(now)]:
+                del buckets[key]
+
+    async def run_syncs(self, channel_layer, channel):
+        while True:
+            await asyncio.sleep((self.config or self.reload())["SYNC_MS"] / 1000)
+            try:
+                self.sweep()
+                # Renova a inscrição antes que o group_expiry do channel layer a descarte
+                await channel_layer.group_add(GROUP, channel)
+                if self.pending_users or self.pending_rooms:
+                    await channel_layer.group_send(GROUP, self.snapshot())
+                    self.stats["syncs_sent"] += 1
+            except Exception:
+                # Um sync perdido só deixa o limite mais frouxo por SYNC_MS
+                pass
+
+    async def listen(self, channel_layer, channel):
+        while True:
+            try:
+                message = await channel_layer.receive(channel)
+                if message.get("type") == "ratelimit.sync":
+                    self.receive_sync(message)
+            except Exception:
+                # Broker reconectando ou sync malformado: a escuta não pode parar
+                self.stats["listen_errors"] += 1
+                await asyncio.sleep((self.config or self.reload())["SYNC_MS"] / 1000)
+
+    async def ensure_started(self):
+        """Sobe as tarefas de sincronização no event loop atual (uma vez por loop)."""
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+        self.loop = loop
+        channel_layer = get_channel_layer()
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(GROUP, channel)
+        self.tasks = [
+            loop.create_task(self.run_syncs(channel_layer, channel)),
+            loop.create_task(self.listen(channel_layer, channel)),
+        ]
+
+    def get_stats(self):
+        return {**self.stats, "users": len(self.users), "rooms": len(self.rooms)}
+
+
+rate_limiter = RateLimiter()
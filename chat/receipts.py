@@ -0,0 +1,149 @@
+import asyncio
+import atexit
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from .conversations import decrement_unread
+from .database import db_write
+from .metrics import metrics
+from .models import Message
+
+"""
+    Confirmações de leitura (read receipts) agrupadas:
+       -> Cada entrega de mensagem direta registra o id lido em memória, sem tocar no banco
+       -> Entregas repetidas (várias abas do mesmo destinatário) viram um único registro
+       -> A cada FLUSH_MS os ids acumulados são gravados com um UPDATE ... WHERE id IN (...)
+          por par (leitor, remetente), que também decrementa o contador da Conversation
+       -> O eco para o próprio remetente nunca gera confirmação
+"""
+
+DEFAULTS = {
+    "FLUSH_MS": 50,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_READ_RECEIPTS", {}))
+    return config
+
+
+class ReceiptBuffer:
+    def __init__(self, flush_ms=50):
+        self.window = flush_ms / 1000
+        # (leitor, remetente) -> ({ids}, {client_keys})
+        self.pending = defaultdict(lambda: (set(), set()))
+        self._timer = None
+        self._lock = asyncio.Lock()
+        self.stats = {
+            "receipts": 0,
+            "flushes": 0,
+            "updates": 0,
+            "rows_marked": 0,
+        }
+
+    def add(self, reader_id, sender_id, message_id=None, client_key=None):
+        ids, keys = self.pending[(reader_id, sender_id)]
+        if message_id is not None:
+            ids.add(message_id)
+        elif client_key is not None:
+            keys.add(client_key)
+        self.stats["receipts"] += 1
+
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.window, self._schedule_flush
+            )
+
+    def _schedule_flush(self):
+        self._timer = None
+        asyncio.ensure_future(self._timed_flush())
+
+    async def _timed_flush(self):
+        try:
+            await self.flush()
+        except Exception:
+            # Falha no flush por tempo: reagenda para a próxima janela
+            if self._timer is None and self.pending:
+                self._timer = asyncio.get_running_loop().call_later(
+                    self.window, self._schedule_flush
+                )
+
+    async def flush(self):
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self.pending:
+                return 0
+
+            pending, self.pending = self.pending, defaultdict(lambda: (set(), set()))
+            try:
+                marked = await metrics.timed("write_receipts")(db_write(write_receipts))(pending)
+            except Exception:
+                # Devolve as confirmações para o buffer; o próximo flush tenta de novo
+                for pair, (ids, keys) in pending.items():
+                    self.pending[pair][0].update(ids)
+                    self.pending[pair][1].update(keys)
+                raise
+            self.stats["flushes"] += 1
+            self.stats["updates"] += len(pending)
+            self.stats["rows_marked"] += marked
+            return marked
+
+    def flush_sync(self):
+        """Flush sem event loop, usado no encerramento do processo."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self.pending = self.pending, defaultdict(lambda: (set(), set()))
+        if pending:
+            write_receipts(pending)
+
+    def get_stats(self):
+        return {**self.stats, "pending": len(self.pending)}
+
+
+def write_receipts(pending):
+    marked = 0
+    with transaction.atomic():
+        for (reader_id, sender_id), (ids, keys) in pending.items():
+            updated = Message.objects.filter(
+                Q(id__in=ids) | Q(client_key__in=keys),
+                user_id=sender_id,
+                user_to_id=reader_id,
+                is_read=False,
+            ).update(is_read=True)
+            if updated:
+                decrement_unread(reader_id, sender_id, updated)
+            marked += updated
+    return marked
+
+
+# Um buffer por event loop, como o MessageBatcher de chat/persistence.py
+_buffers = {}
+
+
+def get_receipts():
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = ReceiptBuffer(flush_ms=get_config()["FLUSH_MS"])
+        _buffers[loop] = buffer
+    return buffer
+
+
+def get_stats():
+    stats = {}
+    for buffer in _buffers.values():
+        for key, value in buffer.get_stats().items():
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+@atexit.register
+def flush_all():
+    for buffer in list(_buffers.values()):
+        buffer.flush_sync()
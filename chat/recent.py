@@ -0,0 +1,365 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+
+from django.conf import settings
+from .database import db_read
+from .models import Message
+from . import persistence, protocol, retention
+
+"""
+    Mensagens recentes por sala, em memória:
+       -> Cada sala guarda as últimas SIZE mensagens em ordem de id, com o username
+          desnormalizado (para o room_detail e a API de histórico) e os payloads
+          codificados para a retomada do socket (os do broadcast ao vivo; os das
+          mensagens vindas do banco são codificados na primeira retomada)
+       -> O buffer é carregado do banco na primeira vez que a sala é pedida (uma
+          consulta por sala, mesmo com mil clientes reconectando depois de um deploy)
+          e depois é alimentado pelos eventos room_message dos sockets da sala
+       -> Enquanto há sockets da sala neste worker o buffer está sempre em dia.
+          Sem sockets ele para de receber mensagens: o room_detail ainda o usa por
+          TTL segundos (a página conecta com last_message_id e o socket completa a
+          diferença) e depois ele é recarregado só com as mensagens novas
+       -> Retomada (ws/chat/room/<id>/?last_message_id=N): as mensagens com id > N
+          saem do buffer; se N é mais antigo que o buffer, de uma consulta por
+          (room_id, id) no índice da FK; com mais de MAX_REPLAY mensagens o cliente
+          é avisado para recarregar (MAX_REPLAY deve caber em CHAT_OUTBOUND["MAX_QUEUE"])
+       -> Uma sala com menos de SIZE mensagens só conta como inteira no buffer se não
+          tem mensagens arquivadas (chat/retention.py); senão as páginas que passam do
+          começo do buffer vão para o banco, que continua no arquivo
+       -> No modo de persistência em lote os ids só existem depois do flush, então
+          o histórico e a retomada sempre consultam o banco
+"""
+
+DEFAULTS = {
+    "SIZE": 200,
+    "MAX_REPLAY": 200,
+    "TTL": 30,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_RECENT_MESSAGES", {}))
+    return config
+
+
+def message_row(msg):
+    """Mensagem do banco no formato guardado no buffer."""
+    return {
+        "id": msg.id,
+        "room_id": msg.room_id,
+        "user_id": msg.user_id,
+        "username": msg.user.username,
+        "content": msg.content,
+        "timestamp": msg.timestamp,
+        "is_read": msg.is_read,
+        "client_key": msg.client_key,
+    }
+
+
+def event_row(data):
+    """Mensagem do evento room_message (serialize_message do consumer) no formato do buffer."""
+    return {
+        "id": data["id"],
+        "room_id": data["room_id"],
+        "user_id": data["user_id"],
+        "username": data["username"],
+        "content": data["content"],
+        "timestamp": datetime.fromtimestamp(data["timestamp_ms"] / 1000, tz=timezone.utc),
+        "is_read": data["is_read"],
+        "client_key": data["client_key"],
+    }
+
+
+def render_row(row):
+    """Payloads de uma mensagem do buffer, iguais aos do broadcast ao vivo."""
+    return protocol.render("room", {
+        **row,
+        "timestamp": row["timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
+        "timestamp_ms": int(row["timestamp"].timestamp() * 1000),
+    })
+
+
+def serialize_rows(rows):
+    """Mesmo formato de pagination.serialize_history, a partir das linhas do buffer."""
+    return [
+        {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "username": row["username"],
+            "content": row["content"],
+            "timestamp": row["timestamp"].isoformat(),
+            "is_read": row["is_read"],
+        }
+        for row in rows
+    ]
+
+
+ROW_FIELDS = (
+    "id", "room_id", "user_id", "username", "content", "timestamp", "is_read", "client_key"
+)
+
+
+def load_rows(room_id, after_id=None, limit=None):
+    """Linhas da sala em ordem de id: as 'limit' mais recentes ou as posteriores a after_id."""
+    # values_list com o username do JOIN: sem instanciar Message/User para cada linha
+    queryset = Message.objects.filter(room_id=room_id).values_list(
+        "id",
+        "room_id",
+        "user_id",
+        "user__username",
+        "content",
+        "timestamp",
+        "is_read",
+        "client_key",
+    )
+    if after_id is None:
+        values = list(queryset.order_by("-id")[:limit])
+        values.reverse()
+    else:
+        values = list(queryset.filter(id__gt=after_id).order_by("id")[:limit])
+    return [dict(zip(ROW_FIELDS, row)) for row in values]
+
+
+class RoomBuffer:
+    def __init__(self):
+        self.ids = []
+        self.rows = []
+        self.payloads = []
+        self.subscribers = 0
+        # Menor id a partir do qual o buffer tem todas as mensagens (None: nunca carregado)
+        self.covered_from = None
+        # True enquanto há sockets inscritos desde a última carga (recebe tudo ao vivo)
+        self.synced = False
+        self.expires_at = 0.0
+        self.warming = None
+
+    def is_usable(self, now):
+        return self.covered_from is not None and (self.synced or now < self.expires_at)
+
+
+class RecentMessages:
+    def __init__(self):
+        self.rooms = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "recorded": 0,
+            "warms": 0,
+            "history_hits": 0,
+            "history_misses": 0,
+            "resumes_from_buffer": 0,
+            "resumes_from_db": 0,
+            "replayed": 0,
+            "truncated": 0,
+        }
+
+    # Inscrição (connect/disconnect do consumer)
+
+    def attach(self, room_id):
+        with self.lock:
+            self.sweep()
+            buffer = self.rooms.get(room_id)
+            if buffer is None:
+                buffer = self.rooms[room_id] = RoomBuffer()
+            buffer.subscribers += 1
+
+    def detach(self, room_id):
+        with self.lock:
+            buffer = self.rooms.get(room_id)
+            if buffer is None:
+                return
+            buffer.subscribers -= 1
+            if buffer.subscribers <= 0:
+                # Sem sockets não chegam mais eventos: vale por TTL e depois é recarregado
+                buffer.subscribers = 0
+                buffer.synced = False
+                buffer.expires_at = time.monotonic() + get_config()["TTL"]
+
+    def sweep(self):
+        now = time.monotonic()
+        for room_id, buffer in list(self.rooms.items()):
+            if not buffer.subscribers and now >= buffer.expires_at and buffer.warming is None:
+                del self.rooms[room_id]
+
+    # Carga
+
+    async def ensure_warm(self, room_id):
+        """Põe o buffer da sala em dia uma vez; conexões simultâneas esperam a mesma carga."""
+        buffer = self.rooms.get(room_id)
+        if buffer is None or buffer.synced:
+            return
+        if buffer.warming is None:
+            buffer.warming = asyncio.ensure_future(db_read(self.warm)(room_id))
+        warming = buffer.warming
+        try:
+            await asyncio.shield(warming)
+        except Exception:
+            # Sem buffer a retomada cai para o banco; a próxima conexão tenta de novo
+            pass
+        finally:
+            if buffer.warming is warming:
+                buffer.warming = None
+
+    def warm(self, room_id):
+        """
+        Carrega a sala do banco (fora do event loop): as últimas SIZE mensagens na
+        primeira vez, depois só as posteriores à última do buffer.
+        """
+        size = get_config()["SIZE"]
+        with self.lock:
+            buffer = self.rooms.get(room_id)
+            if buffer is None:
+                buffer = self.rooms[room_id] = RoomBuffer()
+            last_id = buffer.ids[-1] if buffer.covered_from is not None and buffer.ids else None
+
+        archived = None
+        if last_id is None:
+            rows, complete = load_rows(room_id, limit=size), False
+            if len(rows) < size:
+                archived = retention.newest_archived_id(retention.room_scope(room_id))
+        else:
+            rows = load_rows(room_id, after_id=last_id, limit=size + 1)
+            complete = len(rows) <= size
+            if not complete:
+                rows = rows[-size:]
+
+        with self.lock:
+            if last_id is not None and not complete:
+                # Ficou para trás demais: começa de novo só com as mais recentes
+                buffer.ids, buffer.rows, buffer.payloads = [], [], []
+                buffer.covered_from = None
+            for row in rows:
+                # Os payloads só são codificados se alguma retomada precisar deles
+                self.insert(buffer, row, None)
+            if buffer.covered_from is None:
+                if len(rows) == size:
+                    buffer.covered_from = buffer.ids[0]
+                elif archived is None:
+                    # Menos que SIZE linhas e nada arquivado: o histórico inteiro da sala
+                    buffer.covered_from = 0
+                else:
+                    # As arquivadas são mais antigas que todas as de chat_message
+                    buffer.covered_from = buffer.ids[0] if buffer.ids else archived + 1
+            self.trim(buffer, size)
+            buffer.synced = buffer.subscribers > 0
+            buffer.expires_at = time.monotonic() + get_config()["TTL"]
+            self.stats["warms"] += 1
+        return buffer
+
+    # Alimentação (handler room_message)
+
+    def record(self, room_id, data, payloads):
+        if data is None or data["id"] is None:
+            return
+        with self.lock:
+            buffer = self.rooms.get(room_id)
+            if buffer is None:
+                return
+            # Cada socket da sala recebe o mesmo evento: só o primeiro grava
+            if self.insert(buffer, event_row(data), payloads):
+                self.stats["recorded"] += 1
+                self.trim(buffer, get_config()["SIZE"])
+
+    def insert(self, buffer, row, payloads):
+        message_id = row["id"]
+        if not buffer.ids or message_id > buffer.ids[-1]:
+            index = len(buffer.ids)
+        else:
+            # Fora de ordem (mensagens de workers diferentes): insere na posição certa
+            index = bisect_left(buffer.ids, message_id)
+            if index < len(buffer.ids) and buffer.ids[index] == message_id:
+                return False
+        buffer.ids.insert(index, message_id)
+        buffer.rows.insert(index, row)
+        buffer.payloads.insert(index, payloads)
+        return True
+
+    def trim(self, buffer, size):
+        excess = len(buffer.ids) - size
+        if excess > 0:
+            del buffer.ids[:excess]
+            del buffer.rows[:excess]
+            del buffer.payloads[:excess]
+            if buffer.covered_from is not None:
+                buffer.covered_from = buffer.ids[0]
+
+    # Histórico (room_detail e API)
+
+    def history(self, room_id, before=None, limit=50):
+        """
+        Página de linhas da sala em ordem cronológica (as mais recentes, ou as
+        anteriores à mensagem 'before'). Retorna None quando o buffer não cobre a
+        página; quem chama usa a consulta paginada normal.
+        """
+        if persistence.is_batched():
+            return None
+        now = time.monotonic()
+        with self.lock:
+            self.sweep()
+            buffer = self.rooms.get(room_id)
+            usable = buffer is not None and buffer.is_usable(now)
+        if not usable:
+            buffer = self.warm(room_id)
+
+        with self.lock:
+            if before is None:
+                end = len(buffer.ids)
+            else:
+                end = bisect_left(buffer.ids, before)
+                if end == len(buffer.ids) or buffer.ids[end] != before:
+                    self.stats["history_misses"] += 1
+                    return None
+            start = end - limit
+            # A página passa do início do buffer: só serve se ele tem a sala inteira
+            if start < 0 and buffer.covered_from != 0:
+                self.stats["history_misses"] += 1
+                return None
+            self.stats["history_hits"] += 1
+            return buffer.rows[max(0, start):end]
+
+    # Retomada
+
+    def since(self, room_id, last_id):
+        """Payloads com id > last_id direto do buffer, ou None se ele não cobre a lacuna."""
+        with self.lock:
+            buffer = self.rooms.get(room_id)
+            if buffer is None or not buffer.synced or last_id < buffer.covered_from:
+                return None
+            index = bisect_right(buffer.ids, last_id)
+            for i in range(index, len(buffer.ids)):
+                if buffer.payloads[i] is None:
+                    buffer.payloads[i] = render_row(buffer.rows[i])
+            rows = list(zip(buffer.ids[index:], buffer.payloads[index:]))
+            self.stats["resumes_from_buffer"] += 1
+            self.stats["replayed"] += len(rows)
+            return rows
+
+    def load_gap(self, room_id, last_id):
+        """
+        Lacuna mais antiga que o buffer, do banco: retorna ([(id, payloads)], completo).
+        Com mais de MAX_REPLAY mensagens não envia nada e 'completo' é False: o
+        cliente recarrega o histórico pela página/API.
+        """
+        max_replay = get_config()["MAX_REPLAY"]
+        rows = load_rows(room_id, after_id=last_id, limit=max_replay + 1)
+        with self.lock:
+            self.stats["resumes_from_db"] += 1
+            if len(rows) > max_replay:
+                self.stats["truncated"] += 1
+                return [], False
+            self.stats["replayed"] += len(rows)
+        return [(row["id"], render_row(row)) for row in rows], True
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "rooms": len(self.rooms),
+                "buffered": sum(len(buffer.ids) for buffer in self.rooms.values()),
+            }
+
+
+recent_messages = RecentMessages()
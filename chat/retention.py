@@ -0,0 +1,284 @@
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from .models import Conversation, Message, Room
+
+"""
+    Retenção e arquivo de mensagens:
+       -> Cada sala pode ter retention_days; sem valor vale CHAT_RETENTION["ROOM_DAYS"].
+          As mensagens diretas usam CHAT_RETENTION["DIRECT_DAYS"]. None: nunca arquiva
+       -> python manage.py archive_messages move as mensagens mais antigas que o prazo
+          para tabelas mensais (chat_message_archive_AAAAMM, mesmas colunas de
+          chat_message), em lotes de CHUNK linhas: cada lote é uma transação curta
+          (INSERT ... SELECT + DELETE) seguida de uma pausa de PAUSE_MS, então o chat
+          continua gravando enquanto o arquivo roda
+       -> A última mensagem de cada conversa fica em chat_message (o inbox aponta para ela)
+       -> O histórico (chat/pagination.py) continua nas tabelas de arquivo quando a
+          página passa da mensagem mais antiga de chat_message: as mensagens arquivadas
+          são sempre mais antigas que as que ficaram
+       -> Mensagens arquivadas saem do índice de busca e do admin
+       -> As cópias usam a lista explícita de colunas de Message; uma partição antiga
+          ganha (ALTER TABLE) as colunas que chat_message ganhou depois dela
+       -> A lista de partições fica em cache por PARTITIONS_TTL segundos; o processo
+          que cria uma partição limpa o próprio cache na hora, os outros a enxergam
+          depois do TTL
+"""
+
+DEFAULTS = {
+    "ROOM_DAYS": None,
+    "DIRECT_DAYS": None,
+    "CHUNK": 1000,
+    "PAUSE_MS": 50,
+    "PARTITIONS_TTL": 60,
+}
+
+ARCHIVE_PREFIX = "chat_message_archive_"
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_RETENTION", {}))
+    return config
+
+
+def partition_name(timestamp):
+    return f"{ARCHIVE_PREFIX}{timestamp:%Y%m}"
+
+
+# (lista de partições, válida até) ou None
+_partitions = None
+
+
+def list_partitions():
+    """Tabelas de arquivo existentes, da mais antiga para a mais nova."""
+    global _partitions
+    if _partitions is None or time.monotonic() >= _partitions[1]:
+        names = sorted(
+            name
+            for name in connection.introspection.table_names()
+            if name.startswith(ARCHIVE_PREFIX)
+        )
+        _partitions = (names, time.monotonic() + get_config()["PARTITIONS_TTL"])
+    return list(_partitions[0])
+
+
+def clear_partitions_cache():
+    global _partitions
+    _partitions = None
+
+
+def message_columns():
+    """Colunas de chat_message, já com aspas, na ordem do modelo."""
+    return ", ".join(
+        connection.ops.quote_name(field.column) for field in Message._meta.concrete_fields
+    )
+
+
+def ensure_partition(cursor, name):
+    columns = message_columns()
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {name} AS SELECT {columns} FROM chat_message WHERE 1 = 0"
+    )
+    # Partição criada antes de uma migração que acrescentou colunas a chat_message
+    existing = {
+        column.name for column in connection.introspection.get_table_description(cursor, name)
+    }
+    for field in Message._meta.concrete_fields:
+        if field.column not in existing:
+            cursor.execute(
+                f"ALTER TABLE {name} ADD COLUMN "
+                f"{connection.ops.quote_name(field.column)} {field.db_type(connection)}"
+            )
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {name}_id_idx ON {name} (id)")
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_room_idx ON {name} (room_id, timestamp, id)"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_direct_idx "
+        f"ON {name} (user_id, user_to_id, timestamp, id)"
+    )
+
+
+# Arquivamento
+
+
+class Archiver:
+    def __init__(self, chunk=None, pause_ms=None, dry_run=False, now=None):
+        config = get_config()
+        self.chunk = chunk or config["CHUNK"]
+        self.pause = (config["PAUSE_MS"] if pause_ms is None else pause_ms) / 1000
+        self.dry_run = dry_run
+        self.now = now or timezone.now()
+
+    def scopes(self, room_ids=None, direct=True):
+        """(nome, queryset das mensagens vencidas) de cada sala/DMs com prazo de retenção."""
+        config = get_config()
+        rooms = Room.objects.order_by("id")
+        if room_ids:
+            rooms = rooms.filter(id__in=room_ids)
+        for room in rooms:
+            days = room.retention_days if room.retention_days is not None else config["ROOM_DAYS"]
+            if days is not None:
+                cutoff = self.now - timedelta(days=days)
+                yield f"sala {room.name}", Message.objects.filter(room=room, timestamp__lt=cutoff)
+        if direct and not room_ids and config["DIRECT_DAYS"] is not None:
+            cutoff = self.now - timedelta(days=config["DIRECT_DAYS"])
+            last_messages = Conversation.objects.filter(last_message__isnull=False).values(
+                "last_message_id"
+            )
+            yield "mensagens diretas", Message.objects.filter(
+                room__isnull=True, timestamp__lt=cutoff
+            ).exclude(id__in=last_messages)
+
+    def archive(self, queryset, progress=None):
+        """Move as mensagens do queryset em lotes; retorna o total movido."""
+        if self.dry_run:
+            return queryset.count()
+        moved = 0
+        while True:
+            rows = list(
+                queryset.order_by("timestamp", "id").values_list("id", "timestamp")[: self.chunk]
+            )
+            if not rows:
+                return moved
+            moved += self.move(rows)
+            if progress:
+                progress(moved)
+            if len(rows) < self.chunk:
+                return moved
+            # Libera o lock de escrita para o chat entre um lote e outro
+            time.sleep(self.pause)
+
+    def move(self, rows):
+        partitions = defaultdict(list)
+        for message_id, timestamp in rows:
+            partitions[partition_name(timestamp)].append(message_id)
+
+        columns = message_columns()
+        created = set(partitions) - set(list_partitions())
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                for name, ids in partitions.items():
+                    ensure_partition(cursor, name)
+                    placeholders = ", ".join(["%s"] * len(ids))
+                    cursor.execute(
+                        f"INSERT INTO {name} ({columns}) SELECT {columns} FROM chat_message "
+                        f"WHERE id IN ({placeholders})",
+                        ids,
+                    )
+                ids = [message_id for message_id, _ in rows]
+                placeholders = ", ".join(["%s"] * len(ids))
+                cursor.execute(f"DELETE FROM chat_message WHERE id IN ({placeholders})", ids)
+                return cursor.rowcount
+        finally:
+            if created:
+                # Partição nova: a leitura do histórico deste processo passa a vê-la já
+                clear_partitions_cache()
+
+
+# Leitura (read-through do histórico)
+
+
+def room_scope(room_id):
+    return "room_id = %s", [room_id]
+
+
+def direct_scope(user_id, other_id):
+    return (
+        "((user_id = %s AND user_to_id = %s) OR (user_id = %s AND user_to_id = %s))",
+        [user_id, other_id, other_id, user_id],
+    )
+
+
+def find_cursor(scope, message_id):
+    """(timestamp, id) de uma mensagem arquivada do escopo, ou None."""
+    where, params = scope
+    for name in reversed(list_partitions()):
+        found = list(
+            Message.objects.raw(
+                f"SELECT * FROM {name} WHERE id = %s AND {where}", [message_id, *params]
+            )
+        )
+        if found:
+            return {"timestamp": found[0].timestamp, "id": found[0].id}
+    return None
+
+
+def newest_archived_id(scope):
+    """Maior id arquivado do escopo, ou None. Sem partições não faz consulta."""
+    where, params = scope
+    with connection.cursor() as cursor:
+        # As partições mais novas têm as mensagens mais novas
+        for name in reversed(list_partitions()):
+            cursor.execute(f"SELECT MAX(id) FROM {name} WHERE {where}", params)
+            (newest,) = cursor.fetchone()
+            if newest is not None:
+                return newest
+    return None
+
+
+def archived_page(scope, before=None, after=None, limit=50):
+    """
+    Mensagens arquivadas do escopo em ordem cronológica: as 'limit' anteriores ao
+    cursor 'before' ({"timestamp", "id"}; None: as mais recentes do arquivo) ou as
+    posteriores a 'after'.
+    """
+    if after is not None:
+        return attach_users(query_archived(scope, after, newer=True, limit=limit))
+    page = attach_users(query_archived(scope, before, newer=False, limit=limit))
+    page.reverse()
+    return page
+
+
+def archived_pages(scope, chunk=1000):
+    """Todas as mensagens arquivadas do escopo, da mais antiga para a mais nova, em páginas de 'chunk'."""
+    cursor = None
+    while True:
+        page = query_archived(scope, cursor, newer=True, limit=chunk)
+        if not page:
+            return
+        cursor = {"timestamp": page[-1].timestamp, "id": page[-1].id}
+        yield attach_users(page)
+
+
+def query_archived(scope, cursor, newer, limit):
+    """Até 'limit' mensagens depois (newer) ou antes do cursor (None: desde a ponta), na ordem da busca."""
+    where, params = scope
+    partitions = list_partitions()
+    if not newer:
+        partitions.reverse()
+    if cursor is not None:
+        edge = partition_name(cursor["timestamp"])
+        partitions = [name for name in partitions if (name >= edge if newer else name <= edge)]
+
+    page = []
+    for name in partitions:
+        sql = f"SELECT * FROM {name} WHERE {where}"
+        args = list(params)
+        if cursor is not None:
+            op = ">" if newer else "<"
+            timestamp = connection.ops.adapt_datetimefield_value(cursor["timestamp"])
+            sql += f" AND (timestamp {op} %s OR (timestamp = %s AND id {op} %s))"
+            args += [timestamp, timestamp, cursor["id"]]
+        order = "ASC" if newer else "DESC"
+        sql += f" ORDER BY timestamp {order}, id {order} LIMIT %s"
+        args.append(limit - len(page))
+        page += Message.objects.raw(sql, args)
+        if len(page) >= limit:
+            break
+    return page
+
+
+def attach_users(page):
+    # O raw não faz select_related: os autores vêm numa consulta só
+    # (o arquivo não tem FK: mensagens de usuários já excluídos são ignoradas)
+    users = User.objects.in_bulk({msg.user_id for msg in page})
+    page = [msg for msg in page if msg.user_id in users]
+    for msg in page:
+        msg.user = users[msg.user_id]
+    return page
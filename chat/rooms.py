@@ -0,0 +1,89 @@
+import threading
+import time
+
+from django.conf import settings
+from .database import db_read
+from .models import Room
+
+"""
+    Cache de salas do processo:
+       -> A tabela Room é pequena e quase não muda; ela é carregada inteira numa consulta
+       -> ChatConsumer, room_list e room_detail leem do cache em vez do banco
+       -> post_save / post_delete de Room limpam o cache do processo e avisam os
+          consumers conectados à sala (em qualquer worker) pelo channel layer
+       -> Nos outros workers o cache expira depois de TTL segundos
+"""
+
+DEFAULTS = {
+    "TTL": 30,
+}
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_ROOM_CACHE", {}))
+    return config
+
+
+class RoomCache:
+    def __init__(self):
+        self.rooms = None
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0}
+
+    def is_fresh(self):
+        return self.rooms is not None and time.monotonic() - self.loaded_at < get_config()["TTL"]
+
+    def load(self):
+        with self.lock:
+            if self.is_fresh():
+                return self.rooms
+            self.rooms = {room.id: room for room in Room.objects.all()}
+            self.loaded_at = time.monotonic()
+            self.stats["loads"] += 1
+            return self.rooms
+
+    def get(self, room_id):
+        """Sala pelo id (None se não existir). Carrega do banco se o cache expirou."""
+        if self.is_fresh():
+            self.stats["hits"] += 1
+            rooms = self.rooms
+        else:
+            self.stats["misses"] += 1
+            rooms = self.load()
+        try:
+            return rooms.get(int(room_id))
+        except (TypeError, ValueError):
+            return None
+
+    async def aget(self, room_id):
+        # Só faz o salto para a thread do banco quando é preciso recarregar
+        if self.is_fresh():
+            return self.get(room_id)
+        return await db_read(self.get)(room_id)
+
+    def get_active(self, room_id):
+        room = self.get(room_id)
+        return room if room is not None and room.is_active else None
+
+    def active_rooms(self):
+        if self.is_fresh():
+            self.stats["hits"] += 1
+            rooms = self.rooms
+        else:
+            self.stats["misses"] += 1
+            rooms = self.load()
+        active = [room for room in rooms.values() if room.is_active]
+        active.sort(key=lambda room: room.created_at, reverse=True)
+        return active
+
+    def invalidate(self):
+        self.rooms = None
+        self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        return {**self.stats, "rooms": len(self.rooms or {})}
+
+
+room_cache = RoomCache()
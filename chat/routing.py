@@ -7,4 +7,7 @@ websocket_urlpatterns = [
     
     # WebSocket para mensagens diretas (direct messages)
     re_path(r"ws/chat/direct/$", consumers.ChatConsumer.as_asgi()),
+
+    # Um socket por usuário: mensagens diretas e várias salas (subscribe/unsubscribe)
+    re_path(r"ws/chat/$", consumers.MultiplexConsumer.as_asgi()),
 ]
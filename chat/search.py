@@ -0,0 +1,228 @@
+import html
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from .models import Message
+from .pagination import InvalidCursor
+from .rooms import room_cache
+
+"""
+    Busca de mensagens por texto (SQLite FTS5):
+       -> chat_message_fts indexa Message.content; triggers no banco mantêm o índice
+          em dia a cada INSERT/UPDATE/DELETE (inclusive bulk_create e SQL direto)
+       -> A busca só enxerga salas ativas e as mensagens diretas do próprio usuário
+       -> sort=recent: mais novas primeiro, percorrendo o índice em ordem de rowid
+          (para na página, mesmo com termos muito comuns)
+       -> sort=rank: relevância (bm25) entre as RANK_WINDOW ocorrências mais recentes;
+          sem a janela um termo comum pontuaria milhões de linhas a cada consulta
+       -> A paginação é por cursor opaco ('next_cursor' da página anterior)
+       -> Trechos (snippets) vêm com os termos encontrados entre <mark></mark>,
+          com o resto do texto já escapado; são montados em Python só para a página
+          (a função snippet() do FTS5 reabre o índice a cada linha, caro com prefixos)
+       -> Em outros bancos (sem FTS5) cai para content__icontains
+       -> python manage.py rebuild_search_index reconstrói o índice
+"""
+
+FTS_TABLE = "chat_message_fts"
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_TERMS = 10
+RANK_WINDOW = 5000
+SNIPPET_WORDS = 12
+SORTS = ("rank", "recent")
+
+# Acentos (marcas combinantes) que sobram depois da decomposição NFKD
+COMBINING_RE = re.compile(r"[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
+
+def is_available():
+    return connection.vendor == "sqlite"
+
+
+def parse_terms(query):
+    return re.findall(r"\w+", query)[:MAX_TERMS]
+
+
+def build_match(query):
+    """
+    Converte o texto digitado numa expressão MATCH segura: cada palavra vira um
+    termo entre aspas (todas obrigatórias) e a última aceita prefixo.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return ""
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def encode_cursor(sort, row):
+    if sort == "rank":
+        return f"{row['score']!r}:{row['id']}"
+    return str(row["id"])
+
+
+def decode_cursor(sort, cursor):
+    try:
+        if sort == "rank":
+            score, message_id = cursor.split(":")
+            return float(score), int(message_id)
+        return None, int(cursor)
+    except ValueError:
+        raise InvalidCursor("Cursor inválido.")
+
+
+def scope_sql(user):
+    """Condição SQL (sobre o alias m) das mensagens visíveis para o usuário."""
+    room_ids = [room.id for room in room_cache.active_rooms()]
+    rooms = f"m.room_id IN ({', '.join(['%s'] * len(room_ids))})" if room_ids else "0"
+    return (
+        f"({rooms} OR (m.room_id IS NULL AND (m.user_id = %s OR m.user_to_id = %s)))",
+        [*room_ids, user.id, user.id],
+    )
+
+
+def fts_page(user, match, sort, cursor, limit):
+    """Ids (e score) de uma página de resultados, direto no índice FTS5."""
+    scope, params = scope_sql(user)
+    sql = (
+        f"SELECT m.id AS id, bm25({FTS_TABLE}) AS score "
+        f"FROM {FTS_TABLE} JOIN chat_message m ON m.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH %s AND {scope}"
+    )
+    params = [match, *params]
+
+    if sort == "rank":
+        sql = f"SELECT id, score FROM ({sql} ORDER BY {FTS_TABLE}.rowid DESC LIMIT %s)"
+        params.append(RANK_WINDOW)
+        if cursor:
+            score, message_id = decode_cursor(sort, cursor)
+            sql += " WHERE score > %s OR (score = %s AND id < %s)"
+            params += [score, score, message_id]
+        sql += " ORDER BY score, id DESC LIMIT %s"
+    else:
+        if cursor:
+            sql += f" AND {FTS_TABLE}.rowid < %s"
+            params.append(decode_cursor(sort, cursor)[1])
+        sql += f" ORDER BY {FTS_TABLE}.rowid DESC LIMIT %s"
+    params.append(limit)
+
+    with connection.cursor() as db:
+        db.execute(sql, params)
+        return [{"id": row[0], "score": row[1]} for row in db.fetchall()]
+
+
+def normalize(word):
+    # Mesmo critério do tokenizer (unicode61 remove_diacritics): sem acentos e sem caixa
+    if word.isascii():
+        return word.lower()
+    return COMBINING_RE.sub("", unicodedata.normalize("NFKD", word.casefold()))
+
+
+def snippet(content, query):
+    """Trecho de até SNIPPET_WORDS palavras em volta do primeiro termo encontrado."""
+    terms = [normalize(term) for term in parse_terms(query)]
+    if not terms:
+        return html.escape(content)
+    exact, prefix = set(terms[:-1]), terms[-1]
+
+    words = list(re.finditer(r"\w+", content))
+    hits = set()
+    for i, word in enumerate(words):
+        normalized = normalize(word.group())
+        if normalized in exact or normalized.startswith(prefix):
+            hits.add(i)
+    first = min(hits, default=0)
+    start = max(0, min(first - SNIPPET_WORDS // 4, len(words) - SNIPPET_WORDS))
+    window = words[start:start + SNIPPET_WORDS]
+    if not window:
+        return html.escape(content)
+
+    parts = ["…" if start > 0 else html.escape(content[:window[0].start()])]
+    for i, word in enumerate(window, start):
+        if i > start:
+            parts.append(html.escape(content[words[i - 1].end():word.start()]))
+        text = html.escape(word.group())
+        parts.append(f"<mark>{text}</mark>" if i in hits else text)
+    end = window[-1].end()
+    parts.append("…" if start + len(window) < len(words) else html.escape(content[end:]))
+    return "".join(parts)
+
+
+def visible_messages(user):
+    return Message.objects.filter(
+        Q(room__in=[room.id for room in room_cache.active_rooms()])
+        | Q(room__isnull=True, user=user)
+        | Q(room__isnull=True, user_to=user)
+    )
+
+
+def icontains_page(user, query, cursor, limit):
+    """Busca sem FTS5: LIKE '%...%' em todas as mensagens visíveis, mais novas primeiro."""
+    queryset = visible_messages(user).filter(content__icontains=query)
+    if cursor:
+        queryset = queryset.filter(id__lt=decode_cursor("recent", cursor)[1])
+    return [
+        {"id": message_id, "score": None}
+        for message_id in queryset.order_by("-id").values_list("id", flat=True)[:limit]
+    ]
+
+
+def search_messages(user, query, sort="rank", cursor=None, limit=DEFAULT_LIMIT):
+    """Retorna (resultados, next_cursor)."""
+    if sort not in SORTS:
+        raise InvalidCursor(f"Ordenação inválida: use {' ou '.join(SORTS)}.")
+    limit = max(1, min(limit, MAX_LIMIT))
+
+    if is_available():
+        match = build_match(query)
+        if not match:
+            return [], None
+        # Um a mais para saber se existe próxima página
+        rows = fts_page(user, match, sort, cursor, limit + 1)
+    else:
+        sort = "recent"
+        rows = icontains_page(user, query, cursor, limit + 1)
+
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    ids = [row["id"] for row in rows]
+    messages = Message.objects.select_related("user").in_bulk(ids)
+
+    results = []
+    for row in rows:
+        msg = messages.get(row["id"])
+        if msg is None:
+            continue
+        results.append({
+            "id": msg.id,
+            "room_id": msg.room_id,
+            "user_id": msg.user_id,
+            "user_to_id": msg.user_to_id,
+            "username": msg.user.username,
+            "content": msg.content,
+            "snippet": snippet(msg.content, query),
+            "timestamp": msg.timestamp.isoformat(),
+            "score": row["score"],
+        })
+
+    next_cursor = encode_cursor(sort, rows[-1]) if has_next else None
+    return results, next_cursor
+
+
+def match_ids(query):
+    """Subconsulta com os ids que casam com 'query' (para usar em id__in)."""
+    return RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [build_match(query)])
+
+
+def rebuild_index(optimize=False):
+    """Reconstrói o índice a partir de chat_message e retorna o número de mensagens indexadas."""
+    with connection.cursor() as db:
+        db.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+        if optimize:
+            db.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        db.execute("SELECT COUNT(*) FROM chat_message")
+        return db.fetchone()[0]
@@ -0,0 +1,249 @@
+import random
+import time
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.utils import timezone
+from .conversations import rebuild_conversations
+from .models import Message, Room
+
+"""
+    Geração de dados em massa (python manage.py seed):
+       -> Usuários, salas e mensagens criados em blocos com bulk_create
+       -> Modo --raw: INSERTs com executemany e pragmas do SQLite ajustados para carga
+       -> Distribuições configuráveis: salas "quentes" e pares de DM frequentes seguem
+          uma lei de potência (skew), e uma fração das DMs fica como não lida
+       -> Mesma semente = mesmos dados
+"""
+
+EXAMPLE_ROOMS = [
+    {
+        "name": "Sala Geral",
+        "description": "Conversa sobre assuntos gerais e diversos tópicos",
+    },
+    {
+        "name": "Tecnologia",
+        "description": "Discussões sobre programação, desenvolvimento e tecnologia",
+    },
+    {
+        "name": "Jogos",
+        "description": "Fale sobre seus jogos favoritos",
+    },
+]
+
+LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "MEMORY",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",
+}
+
+WORDS = (
+    "oi olá bom dia boa tarde noite alguém viu jogo ontem sala chat mensagem "
+    "projeto django python código teste amanhã hoje legal valeu obrigado sim não"
+).split()
+
+
+def power_law_weights(count, skew):
+    """Pesos acumulados 1/(i+1)^skew: skew 0 = uniforme, maior = mais concentrado."""
+    return list(accumulate(1 / (i + 1) ** skew for i in range(count)))
+
+
+class Seeder:
+    def __init__(
+        self,
+        seed=42,
+        chunk=50000,
+        raw=False,
+        days=30,
+        user_prefix="user_",
+        password=None,
+        stdout=None,
+    ):
+        self.random = random.Random(seed)
+        self.chunk = chunk
+        self.raw = raw
+        self.days = days
+        self.user_prefix = user_prefix
+        self.password = make_password(password) if password else "!"
+        self.stdout = stdout
+        self.report = {}
+        # Conteúdos pré-gerados: sortear um texto é bem mais barato que montar um por linha
+        self.contents = [
+            " ".join(self.random.choices(WORDS, k=self.random.randint(2, 12)))
+            for _ in range(4096)
+        ]
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def timed(self, name, rows, started):
+        elapsed = time.perf_counter() - started
+        self.report[name] = {
+            "rows": rows,
+            "seconds": round(elapsed, 3),
+            "rows_per_sec": round(rows / elapsed) if elapsed else rows,
+        }
+        self.log(f"{name}: {rows} linhas em {elapsed:.1f}s ({self.report[name]['rows_per_sec']}/s)")
+
+    def content(self):
+        return self.random.choice(self.contents)
+
+    # Usuários e salas
+
+    def seed_users(self, count):
+        started = time.perf_counter()
+        existing = User.objects.filter(username__startswith=self.user_prefix).count()
+        for start in range(existing, count, self.chunk):
+            User.objects.bulk_create(
+                [
+                    User(
+                        username=f"{self.user_prefix}{i}",
+                        first_name=f"Usuário {i}",
+                        password=self.password,
+                    )
+                    for i in range(start, min(start + self.chunk, count))
+                ],
+                batch_size=1000,
+            )
+        self.timed("users", max(0, count - existing), started)
+        return list(
+            User.objects.filter(username__startswith=self.user_prefix)
+            .order_by("id")
+            .values_list("id", flat=True)[:count]
+        )
+
+    def seed_rooms(self, count):
+        started = time.perf_counter()
+        rooms = []
+        for i in range(count):
+            data = EXAMPLE_ROOMS[i] if i < len(EXAMPLE_ROOMS) else {
+                "name": f"Sala {i + 1}",
+                "description": "",
+            }
+            room, _ = Room.objects.get_or_create(
+                name=data["name"],
+                defaults={"description": data["description"], "is_active": True},
+            )
+            rooms.append(room.id)
+        self.timed("rooms", count, started)
+        return rooms
+
+    # Mensagens
+
+    def seed_room_messages(self, count, room_ids, user_ids, hot_skew):
+        if not count or not room_ids or not user_ids:
+            return
+        weights = power_law_weights(len(room_ids), hot_skew)
+        self.insert_messages(
+            "room_messages",
+            count,
+            lambda: (
+                self.random.choices(room_ids, cum_weights=weights)[0],
+                self.random.choice(user_ids),
+                None,
+                False,
+            ),
+        )
+
+    def seed_direct_messages(self, count, user_ids, pairs, pair_skew, unread_ratio):
+        if not count or len(user_ids) < 2:
+            return
+        pool = []
+        while len(pool) < pairs:
+            sender, recipient = self.random.sample(user_ids, 2)
+            pool.append((sender, recipient))
+        weights = power_law_weights(len(pool), pair_skew)
+
+        def row():
+            sender, recipient = self.random.choices(pool, cum_weights=weights)[0]
+            if self.random.random() < 0.5:
+                sender, recipient = recipient, sender
+            return (None, sender, recipient, self.random.random() >= unread_ratio)
+
+        self.insert_messages("direct_messages", count, row)
+
+        started = time.perf_counter()
+        conversations = rebuild_conversations()
+        self.timed("conversations", conversations, started)
+
+    def insert_messages(self, name, count, make_row):
+        started = time.perf_counter()
+        # Timestamps crescentes, espalhados pela janela de 'days' dias até agora
+        start = timezone.now() - timedelta(days=self.days)
+        step = timedelta(days=self.days) / max(count, 1)
+
+        for offset in range(0, count, self.chunk):
+            rows = []
+            for i in range(offset, min(offset + self.chunk, count)):
+                room_id, user_id, user_to_id, is_read = make_row()
+                rows.append((room_id, user_id, user_to_id, self.content(), start + step * i, is_read))
+
+            if self.raw:
+                self.insert_raw(rows)
+            else:
+                self.insert_orm(rows)
+            self.log(f"  {name}: {min(offset + self.chunk, count)}/{count}")
+
+        self.timed(name, count, started)
+
+    def insert_orm(self, rows):
+        # Message.timestamp só tem default: os timestamps gerados são gravados como estão
+        with transaction.atomic():
+            Message.objects.bulk_create(
+                [
+                    Message(
+                        room_id=room_id,
+                        user_id=user_id,
+                        user_to_id=user_to_id,
+                        content=content,
+                        timestamp=timestamp,
+                        is_read=is_read,
+                    )
+                    for room_id, user_id, user_to_id, content, timestamp, is_read in rows
+                ],
+                batch_size=1000,
+            )
+
+    def insert_raw(self, rows):
+        # Direto no cursor do driver (placeholders "?"), sem o wrapper do Django;
+        # os timestamps vão no mesmo formato que o Django grava (UTC sem fuso)
+        offset = timezone.now().utcoffset() or timedelta(0)
+        with transaction.atomic():
+            connection.ensure_connection()
+            connection.connection.executemany(
+                "INSERT INTO chat_message "
+                "(room_id, user_id, user_to_id, content, timestamp, is_read) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        room_id,
+                        user_id,
+                        user_to_id,
+                        content,
+                        str((timestamp - offset).replace(tzinfo=None)),
+                        is_read,
+                    )
+                    for room_id, user_id, user_to_id, content, timestamp, is_read in rows
+                ],
+            )
+
+    def tune_sqlite(self):
+        """Aplica os pragmas de carga e retorna os valores anteriores."""
+        if connection.vendor != "sqlite":
+            return {}
+        previous = {}
+        with connection.cursor() as cursor:
+            for pragma, value in LOAD_PRAGMAS.items():
+                previous[pragma] = cursor.execute(f"PRAGMA {pragma}").fetchone()[0]
+                cursor.execute(f"PRAGMA {pragma} = {value}")
+        return previous
+
+    def restore_sqlite(self, previous):
+        with connection.cursor() as cursor:
+            for pragma, value in previous.items():
+                cursor.execute(f"PRAGMA {pragma} = {value}")
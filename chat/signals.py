@@ -0,0 +1,64 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import protocol
+from .auth import auth_cache
+from .directory import user_directory
+from .models import Room
+from .rooms import room_cache
+
+
+def notify_room_updated(room_id, is_active):
+    """Avisa os consumers conectados à sala, em qualquer worker."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        f"chat_room_{room_id}",
+        protocol.event(
+            "room_closed",
+            {"room_id": room_id},
+            handler="room_updated",
+            room_id=room_id,
+            is_active=is_active,
+        ),
+    )
+
+
+@receiver(post_save, sender=Room)
+def room_saved(sender, instance, **kwargs):
+    room_cache.invalidate()
+    transaction.on_commit(lambda: notify_room_updated(instance.id, instance.is_active))
+
+
+@receiver(post_delete, sender=Room)
+def room_deleted(sender, instance, **kwargs):
+    room_cache.invalidate()
+    room_id = instance.id
+    transaction.on_commit(lambda: notify_room_updated(room_id, False))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # Cadastro ou alteração entra no diretório de busca deste processo na hora
+    user_directory.update(instance)
+    # Senha, is_active... valem no próximo handshake (o login só grava last_login)
+    if kwargs.get("update_fields") != frozenset({"last_login"}):
+        auth_cache.discard_user(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    user_directory.discard(instance.id)
+    auth_cache.discard_user(instance.id)
+
+
+@receiver(user_logged_out)
+def user_logged_out_session(sender, request, user, **kwargs):
+    # channels.auth.logout envia request=None
+    if request is not None and request.session.session_key:
+        auth_cache.discard_session(request.session.session_key)
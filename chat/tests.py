@@ -0,0 +1,1523 @@
+import asyncio
+import functools
+import importlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer, channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.apps import apps as django_apps
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .auth import CachedAuthMiddlewareStack, auth_cache
+from .broker import Broker, encode_frame, serve
+from .consumers import ChatConsumer, MultiplexConsumer
+from .conversations import record_direct_messages
+from .directory import UserDirectory, user_directory
+from .layers import BrokerChannelLayer
+from .metrics import metrics
+from .models import Conversation, Message, Room
+from .outbound import OutboundQueue
+from .pagination import direct_history, direct_messages
+from .persistence import MessageBatcher, build_message
+from .recent import recent_messages
+from .presence import GROUP as PRESENCE_GROUP, Presence, presence
+from .ratelimit import GROUP as RATELIMIT_GROUP, RateLimiter, rate_limiter
+from .receipts import write_receipts
+from .rooms import room_cache
+from .seeding import Seeder
+from .routing import websocket_urlpatterns
+from .signals import notify_room_updated
+from .tracing import tracer
+from . import directory as directory_module, outbound, persistence, receipts, retention
+
+"""
+    Testes dos serviços do chat. Os de socket usam o InMemoryChannelLayer e o
+    WebsocketCommunicator do Channels; TransactionTestCase porque as gravações
+    saem do event loop (database_sync_to_async) e o flush em lote depende do commit.
+"""
+
+BATCHED = {"MODE": "batched", "BATCH_SIZE": 200, "BATCH_WINDOW_MS": 20, "MAX_PENDING": 10000}
+
+
+async def connect(user, room_id=None):
+    path = f"/ws/chat/room/{room_id}/" if room_id else "/ws/chat/direct/"
+    communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), path)
+    communicator.scope["user"] = user
+    communicator.scope["url_route"] = {"kwargs": {"room_id": str(room_id)} if room_id else {}}
+    connected, _ = await communicator.connect()
+    assert connected
+    return communicator
+
+
+async def receive_type(communicator, kind, timeout=2):
+    """Próximo frame JSON do tipo 'kind' (pula presença, digitação...)."""
+    while True:
+        data = json.loads(await communicator.receive_from(timeout=timeout))
+        if data.get("type") == kind or (kind == "error" and "error" in data):
+            return data
+
+
+class MessageBatcherTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+
+    def room_message(self, key):
+        return build_message(
+            self.user, f"mensagem {key}", f"{self.user.id}:{key}", room_id=self.room.id
+        )
+
+    async def count(self):
+        return await Message.objects.filter(room=self.room).acount()
+
+    async def test_flush_on_window(self):
+        batcher = MessageBatcher(batch_size=100, window_ms=10)
+        await batcher.enqueue(self.room_message("a"))
+        await batcher.enqueue(self.room_message("b"))
+        self.assertEqual(await self.count(), 0)
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(await self.count(), 2)
+        self.assertEqual(batcher.stats["flushes"], 1)
+        self.assertEqual(len(batcher.pending), 0)
+
+    async def test_flush_on_size(self):
+        batcher = MessageBatcher(batch_size=3, window_ms=60000)
+        for key in ("a", "b"):
+            await batcher.enqueue(self.room_message(key))
+        self.assertEqual(await self.count(), 0)
+
+        # A terceira mensagem completa o lote: o enqueue só volta depois do flush
+        await batcher.enqueue(self.room_message("c"))
+        self.assertEqual(await self.count(), 3)
+        self.assertIsNone(batcher._timer)
+
+    async def test_flush_keeps_the_broadcast_timestamp(self):
+        batcher = MessageBatcher(batch_size=100, window_ms=60000)
+        message = self.room_message("a")
+        broadcast = message.timestamp
+        await batcher.enqueue(message)
+        await asyncio.sleep(0.05)
+        await batcher.flush()
+        saved = await Message.objects.aget(client_key=message.client_key)
+        self.assertEqual(saved.timestamp, broadcast)
+
+    async def test_duplicate_client_key_is_written_once(self):
+        batcher = MessageBatcher(batch_size=100, window_ms=60000)
+        first = await batcher.enqueue(self.room_message("a"))
+        second = await batcher.enqueue(self.room_message("a"))
+        self.assertIs(first, second)
+        await batcher.flush()
+        self.assertEqual(await self.count(), 1)
+
+    @override_settings(CHAT_PERSISTENCE={**BATCHED, "BATCH_WINDOW_MS": 60000})
+    def test_atexit_flushes_pending_window(self):
+        # O loop termina no meio da janela, como um worker encerrado
+        loop = asyncio.new_event_loop()
+
+        async def enqueue():
+            await persistence.get_batcher().enqueue(self.room_message("a"))
+
+        try:
+            loop.run_until_complete(enqueue())
+            self.assertFalse(Message.objects.exists())
+            persistence.flush_all()
+        finally:
+            persistence._batchers.pop(loop, None)
+            loop.close()
+        self.assertEqual(Message.objects.filter(room=self.room).count(), 1)
+
+    async def test_dropped_row_is_reported(self):
+        batcher = MessageBatcher(batch_size=100, window_ms=60000)
+        dropped = []
+
+        async def on_dropped(message):
+            dropped.append(message.client_key)
+
+        # Destinatário inexistente na hora do flush (ex.: apagado depois do envio)
+        orphan = build_message(self.user, "oi", f"{self.user.id}:orfa", user_to_id=99999)
+        await batcher.enqueue(orphan, on_dropped)
+        await batcher.enqueue(self.room_message("a"), on_dropped)
+
+        self.assertEqual(await batcher.flush(), 1)
+        self.assertEqual(dropped, [orphan.client_key])
+        self.assertEqual(batcher.stats["dropped"], 1)
+        self.assertFalse(await Message.objects.filter(client_key=orphan.client_key).aexists())
+        self.assertEqual(await self.count(), 1)
+        self.assertEqual(batcher.on_dropped, {})
+
+
+@override_settings(CHAT_PERSISTENCE=BATCHED)
+class BatchedConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+
+    async def test_direct_message_to_missing_user_is_rejected(self):
+        socket = await connect(self.user)
+        await socket.send_to(
+            text_data=json.dumps({"type": "direct", "message": "oi", "user_to_id": 99999})
+        )
+        error = await receive_type(socket, "error")
+        self.assertEqual(error["error"], "User matching query does not exist.")
+        await persistence.get_batcher().flush()
+        self.assertFalse(await Message.objects.aexists())
+        await socket.disconnect()
+
+    async def test_saved_event_carries_ids(self):
+        socket = await connect(self.user, self.room.id)
+        await socket.send_to(text_data=json.dumps({"message": "oi", "client_key": "k1"}))
+        message = await receive_type(socket, "room")
+        self.assertIsNone(message["message_id"])
+
+        saved = await receive_type(socket, "saved")
+        stored = await Message.objects.aget(client_key=message["client_key"])
+        self.assertEqual(saved["room_id"], self.room.id)
+        self.assertEqual(saved["ids"], {message["client_key"]: stored.id})
+        await socket.disconnect()
+
+
+class Transport:
+    """Buffer de escrita de mentira: 'size' bytes pendentes; os frames escritos em 'frames'."""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.frames = []
+        self.evicted = False
+
+    async def write(self, text):
+        self.frames.append(text)
+
+    async def evict(self):
+        self.evicted = True
+
+    def queue(self):
+        return OutboundQueue(self.write, self.evict, lambda: self.size)
+
+
+OUTBOUND = {
+    "MAX_QUEUE": 3,
+    "POLICY": "drop_oldest",
+    "SEND_TIMEOUT": 30,
+    "CLOSE_CODE": 4008,
+    "HIGH_WATER": 1000,
+    "POLL_MS": 1,
+}
+
+
+@override_settings(CHAT_OUTBOUND=OUTBOUND)
+class OutboundQueueTests(TransactionTestCase):
+    async def test_writes_directly_while_transport_drains(self):
+        transport = Transport()
+        queue = transport.queue()
+        await queue.put("a")
+        await queue.put("b")
+        self.assertEqual(transport.frames, ["a", "b"])
+        self.assertIsNone(queue.task)
+        self.assertEqual(len(queue), 0)
+
+    async def test_congested_transport_queues_until_drained(self):
+        transport = Transport(size=5000)
+        queue = transport.queue()
+        await queue.put("a")
+        await queue.put("b")
+        self.assertEqual(transport.frames, [])
+        self.assertIsNotNone(queue.task)
+
+        transport.size = 0
+        await queue.flush(timeout=1)
+        self.assertEqual(transport.frames, ["a", "b"])
+        self.assertIsNone(queue.task)
+        # Fila vazia de novo: volta ao caminho direto, na ordem
+        await queue.put("c")
+        self.assertEqual(transport.frames, ["a", "b", "c"])
+
+    async def test_drop_oldest_keeps_queue_bounded(self):
+        transport = Transport(size=5000)
+        queue = transport.queue()
+        for text in "abcde":
+            await queue.put(text)
+        self.assertEqual([frame[1] for frame in queue.frames], ["c", "d", "e"])
+        queue.close()
+
+    @override_settings(CHAT_OUTBOUND={**OUTBOUND, "POLICY": "coalesce"})
+    async def test_coalesce_replaces_state_events(self):
+        transport = Transport(size=5000)
+        queue = transport.queue()
+        await queue.put("p1", key="presence")
+        await queue.put("m1")
+        await queue.put("m2")
+        await queue.put("p2", key="presence")
+        self.assertEqual([frame[1] for frame in queue.frames], ["m1", "m2", "p2"])
+        queue.close()
+
+    @override_settings(CHAT_OUTBOUND={**OUTBOUND, "POLICY": "disconnect"})
+    async def test_disconnect_policy_evicts(self):
+        transport = Transport(size=5000)
+        queue = transport.queue()
+        for text in "abcd":
+            await queue.put(text)
+        await asyncio.sleep(0)
+        self.assertTrue(queue.closed)
+        self.assertTrue(transport.evicted)
+
+    @override_settings(CHAT_OUTBOUND={**OUTBOUND, "SEND_TIMEOUT": 0.05})
+    async def test_transport_that_never_drains_is_evicted(self):
+        transport = Transport(size=5000)
+        queue = transport.queue()
+        await queue.put("a")
+        await asyncio.sleep(0.2)
+        self.assertTrue(queue.closed)
+        self.assertTrue(transport.evicted)
+        self.assertEqual(transport.frames, [])
+
+
+    @override_settings(CHAT_OUTBOUND={**OUTBOUND, "SEND_TIMEOUT": 0.05})
+    async def test_without_probe_blocked_send_is_bounded_and_evicted(self):
+        # Sem scope["write_buffer"]: todo frame passa pela fila e o send pode esperar
+        transport = Transport()
+        blocked = asyncio.Event()
+
+        async def stuck_write(text):
+            transport.frames.append(text)
+            await blocked.wait()
+
+        queue = OutboundQueue(stuck_write, transport.evict)
+        dropped = outbound.get_stats()["dropped"]
+        for text in "abcde":
+            await queue.put(text)
+        self.assertEqual([frame[1] for frame in queue.frames], ["c", "d", "e"])
+        self.assertEqual(outbound.get_stats()["dropped"] - dropped, 2)
+
+        await asyncio.sleep(0.2)
+        self.assertEqual(transport.frames, ["c"])
+        self.assertTrue(queue.closed)
+        self.assertTrue(transport.evicted)
+
+    def test_probe_reads_twisted_buffer_only_when_attributes_match(self):
+        class Protocol:
+            def __init__(self, transport):
+                self.transport = transport
+
+        class TwistedTransport:
+            dataBuffer = b"x" * 100
+            offset = 40
+            _tempDataLen = 10
+
+        class NewerTwistedTransport:
+            dataBuffer = b"x" * 100
+            offset = 40
+
+        class ChangedTwistedTransport(TwistedTransport):
+            _tempDataLen = None
+
+        def handle_reply(protocol, message):
+            pass
+
+        probe = outbound.write_buffer_probe(
+            functools.partial(handle_reply, Protocol(TwistedTransport()))
+        )
+        self.assertEqual(probe(), 70)
+        for transport in (NewerTwistedTransport(), ChangedTwistedTransport(), object()):
+            send = functools.partial(handle_reply, Protocol(transport))
+            self.assertIsNone(outbound.write_buffer_probe(send))
+
+
+@override_settings(CHAT_OUTBOUND={**OUTBOUND, "MAX_QUEUE": 5, "POLICY": "disconnect"})
+class SlowReaderTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+
+    async def connect_member(self, buffered):
+        communicator = WebsocketCommunicator(
+            ChatConsumer.as_asgi(), f"/ws/chat/room/{self.room.id}/"
+        )
+        communicator.scope["user"] = self.user
+        communicator.scope["url_route"] = {"kwargs": {"room_id": str(self.room.id)}}
+        communicator.scope["write_buffer"] = buffered
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def test_stalled_reader_does_not_delay_other_members(self):
+        healthy = [await self.connect_member(lambda: 0) for _ in range(3)]
+        # Cliente que parou de ler: o buffer do transporte nunca escoa
+        stalled = await self.connect_member(lambda: 10**9)
+
+        latencies = []
+        for i in range(10):
+            started = time.perf_counter()
+            await healthy[0].send_to(text_data=json.dumps({"message": f"m{i}"}))
+            for socket in healthy:
+                message = await receive_type(socket, "room")
+                self.assertEqual(message["message"], f"m{i}")
+            latencies.append(time.perf_counter() - started)
+
+        # Com a fila cheia o leitor parado é desconectado; os outros seguem recebendo
+        closed = await stalled.receive_output(timeout=1)
+        self.assertEqual(closed, {"type": "websocket.close", "code": 4008})
+        self.assertLess(max(latencies), 0.5)
+        for socket in healthy:
+            await socket.disconnect()
+
+
+class FlakyLayer:
+    """Channel layer cujo receive falha uma vez (broker caindo) antes de entregar 'messages'."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.failed = False
+
+    async def receive(self, channel):
+        if not self.failed:
+            self.failed = True
+            raise ConnectionError("broker fora do ar")
+        if self.messages:
+            return self.messages.pop(0)
+        await asyncio.Event().wait()
+
+
+def heartbeat(worker, users):
+    return {"type": "presence.heartbeat", "worker": worker, "rooms": [], "users": users}
+
+
+@override_settings(CHAT_PRESENCE={"HEARTBEAT": 0.05})
+class PresenceTests(TransactionTestCase):
+    async def test_heartbeat_renews_group_membership(self):
+        layer = InMemoryChannelLayer(group_expiry=1)
+        presence = Presence()
+        channel = await layer.new_channel()
+        await layer.group_add(PRESENCE_GROUP, channel)
+        # Inscrição mais velha que o group_expiry: o próximo group_send a descartaria
+        layer.groups[PRESENCE_GROUP][channel] = time.time() - 10
+        task = asyncio.create_task(presence.run_heartbeats(layer, channel))
+        try:
+            await asyncio.sleep(0.1)
+            await layer.group_send(PRESENCE_GROUP, heartbeat("outro", [7]))
+            while True:
+                message = await asyncio.wait_for(layer.receive(channel), 1)
+                if message["worker"] == "outro":
+                    break
+        finally:
+            task.cancel()
+
+    async def test_listen_survives_layer_errors(self):
+        presence = Presence()
+        layer = FlakyLayer([heartbeat("outro", [7])])
+        task = asyncio.create_task(presence.listen(layer, "canal"))
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            task.cancel()
+        self.assertEqual(presence.stats["listen_errors"], 1)
+        self.assertEqual(presence.is_online([7]), {7: True})
+
+
+@override_settings(CHAT_RATE_LIMIT={"ENABLED": True, "TYPING_RATE": 1, "TYPING_BURST": 2})
+class TypingTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+        rate_limiter.reload()
+
+    def tearDown(self):
+        # Relê CHAT_RATE_LIMIT depois que o override sai
+        rate_limiter.config = None
+
+    async def test_typing_to_missing_user_is_rejected(self):
+        socket = await connect(self.user)
+        await socket.send_to(text_data=json.dumps({"type": "typing", "user_to_id": 99999}))
+        error = await receive_type(socket, "error")
+        self.assertEqual(error["error"], "User matching query does not exist.")
+        self.assertNotIn(99999, presence.direct_typing)
+        await socket.disconnect()
+
+    async def test_typing_frames_use_connection_bucket(self):
+        socket = await connect(self.user, self.room.id)
+        rejected = rate_limiter.stats["rejected_typing"]
+        for _ in range(5):
+            await socket.send_to(text_data=json.dumps({"type": "typing"}))
+        # A mensagem sai do mesmo socket depois dos frames de digitação
+        await socket.send_to(text_data=json.dumps({"message": "oi"}))
+        await receive_type(socket, "room")
+        self.assertEqual(rate_limiter.stats["rejected_typing"] - rejected, 3)
+        await socket.disconnect()
+
+
+@override_settings(CHAT_RATE_LIMIT={"ENABLED": True, "SYNC_MS": 20})
+class RateLimiterSyncTests(TransactionTestCase):
+    async def test_sync_renews_group_membership(self):
+        layer = InMemoryChannelLayer(group_expiry=1)
+        limiter = RateLimiter()
+        channel = await layer.new_channel()
+        await layer.group_add(RATELIMIT_GROUP, channel)
+        layer.groups[RATELIMIT_GROUP][channel] = time.time() - 10
+        task = asyncio.create_task(limiter.run_syncs(layer, channel))
+        try:
+            await asyncio.sleep(0.1)
+            sync = {"type": "ratelimit.sync", "worker": "outro", "users": [], "rooms": []}
+            await layer.group_send(RATELIMIT_GROUP, sync)
+            message = await asyncio.wait_for(layer.receive(channel), 1)
+            self.assertEqual(message["worker"], "outro")
+        finally:
+            task.cancel()
+
+    async def test_listen_survives_layer_errors(self):
+        limiter = RateLimiter()
+        sync = {"type": "ratelimit.sync", "worker": "outro", "users": [[7, 3]], "rooms": []}
+        task = asyncio.create_task(limiter.listen(FlakyLayer([sync]), "canal"))
+        try:
+            await asyncio.sleep(0.2)
+        finally:
+            task.cancel()
+        self.assertEqual(limiter.stats["listen_errors"], 1)
+        self.assertEqual(limiter.stats["syncs_received"], 1)
+
+    @override_settings(CHAT_RATE_LIMIT={})
+    def test_disabled_by_default(self):
+        limiter = RateLimiter()
+        self.assertIsNone(limiter.connection_bucket())
+        self.assertTrue(all(limiter.check(1, 1) is None for _ in range(1000)))
+
+
+class FakeWriter:
+    """StreamWriter de mentira; 'buffered' é o tamanho do buffer de saída do transporte."""
+
+    def __init__(self, buffered=0):
+        self.transport = self
+        self.buffered = buffered
+        self.data = []
+        self.closed = False
+
+    def write(self, data):
+        self.data.append(data)
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+    async def drain(self):
+        pass
+
+    def get_write_buffer_size(self):
+        return self.buffered
+
+
+def client_stream(*frames):
+    reader = asyncio.StreamReader()
+    for frame in frames:
+        reader.feed_data(encode_frame(frame))
+    return reader
+
+
+class BrokerTests(TransactionTestCase):
+    async def test_group_send_between_layers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "broker.sock")
+            server = asyncio.create_task(serve(path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            first, second = BrokerChannelLayer(path=path), BrokerChannelLayer(path=path)
+            try:
+                local = await first.new_channel()
+                remote = await second.new_channel()
+                await first.group_add("sala", local)
+                await second.group_add("sala", remote)
+
+                await first.group_send("sala", {"type": "chat.message", "text": "oi"})
+                for layer, channel in ((first, local), (second, remote)):
+                    message = await asyncio.wait_for(layer.receive(channel), 1)
+                    self.assertEqual(message["text"], "oi")
+            finally:
+                await first.close()
+                await second.close()
+                # Deixa o broker tratar o fim das conexões antes de parar
+                await asyncio.sleep(0.05)
+                server.cancel()
+                await asyncio.gather(server, return_exceptions=True)
+
+    async def test_consumers_on_two_workers_exchange_room_and_direct_messages(self):
+        ana = await database_sync_to_async(User.objects.create)(username="ana")
+        bia = await database_sync_to_async(User.objects.create)(username="bia")
+        room = await database_sync_to_async(Room.objects.create)(name="geral")
+
+        def worker_socket(alias, user, room_id=None):
+            # Um ChatConsumer por "worker": cada alias é um BrokerChannelLayer próprio
+            consumer = type(
+                f"ChatConsumer_{alias}", (ChatConsumer,), {"channel_layer_alias": alias}
+            )
+            path = f"/ws/chat/room/{room_id}/" if room_id else "/ws/chat/direct/"
+            communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+            communicator.scope["user"] = user
+            communicator.scope["url_route"] = {
+                "kwargs": {"room_id": str(room_id)} if room_id else {}
+            }
+            return communicator
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "broker.sock")
+            server = asyncio.create_task(serve(path))
+            while not os.path.exists(path):
+                await asyncio.sleep(0.01)
+            broker_layer = {"BACKEND": "chat.layers.BrokerChannelLayer", "CONFIG": {"path": path}}
+            with override_settings(CHANNEL_LAYERS={
+                "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+                "worker1": broker_layer,
+                "worker2": broker_layer,
+            }):
+                sockets = [
+                    worker_socket("worker1", ana, room.id),
+                    worker_socket("worker2", bia, room.id),
+                    worker_socket("worker1", ana),
+                    worker_socket("worker2", bia),
+                ]
+                try:
+                    for socket in sockets:
+                        connected, _ = await socket.connect()
+                        self.assertTrue(connected)
+                    ana_room, bia_room, ana_direct, bia_direct = sockets
+
+                    await ana_room.send_to(text_data=json.dumps({"message": "oi, sala"}))
+                    message = await receive_type(bia_room, "room")
+                    self.assertEqual(message["message"], "oi, sala")
+
+                    await ana_direct.send_to(text_data=json.dumps(
+                        {"type": "direct", "message": "oi, bia", "user_to_id": bia.id}
+                    ))
+                    message = await receive_type(bia_direct, "direct")
+                    self.assertEqual(message["message"], "oi, bia")
+                    self.assertEqual(message["user_id"], ana.id)
+                finally:
+                    for socket in sockets:
+                        await socket.disconnect()
+                    for alias in ("worker1", "worker2"):
+                        await channel_layers[alias].close()
+                    await asyncio.sleep(0.05)
+                    server.cancel()
+                    await asyncio.gather(server, return_exceptions=True)
+
+    async def test_clients_rejoin_groups_after_broker_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "broker.sock")
+
+            async def start_broker():
+                if os.path.exists(path):
+                    os.unlink(path)
+                process = await asyncio.create_subprocess_exec(
+                    sys.executable, "manage.py", "chat_broker", "--path", path,
+                    stdout=asyncio.subprocess.DEVNULL,
+                )
+                while not os.path.exists(path):
+                    await asyncio.sleep(0.02)
+                return process
+
+            async def wait_for(condition):
+                for _ in range(500):
+                    if condition():
+                        return
+                    await asyncio.sleep(0.02)
+                self.fail("Tempo esgotado")
+
+            process = await start_broker()
+            layers = [BrokerChannelLayer(path=path) for _ in range(30)]
+            try:
+                channels = [await layer.new_channel() for layer in layers]
+                for layer, channel in zip(layers, channels):
+                    await layer.group_add("sala", channel)
+                connections = [layer.connection() for layer in layers]
+
+                process.kill()
+                await process.wait()
+                await wait_for(lambda: all(conn.writer.is_closing() for conn in connections))
+
+                process = await start_broker()
+                # Ninguém chama o layer: cada conexão volta sozinha
+                await wait_for(lambda: all(
+                    conn.reconnect_task.done() and not conn.writer.is_closing()
+                    for conn in connections
+                ))
+                for layer, channel in zip(layers, channels):
+                    # Ida e volta confirmada: os group_add da reconexão já foram processados
+                    await layer.group_add("sincronia", channel)
+
+                await layers[0].group_send("sala", {"type": "chat.message", "text": "voltei"})
+                for layer, channel in zip(layers, channels):
+                    message = await asyncio.wait_for(layer.receive(channel), 2)
+                    self.assertEqual(message["text"], "voltei")
+            finally:
+                for layer in layers:
+                    await layer.close()
+                process.kill()
+                await process.wait()
+
+    async def test_stale_connection_keeps_reconnected_client(self):
+        broker = Broker()
+        old_reader = client_stream({"op": "hello", "client": "w1"})
+        old_writer = FakeWriter()
+        old = asyncio.create_task(broker.handle_client(old_reader, old_writer))
+        await asyncio.sleep(0)
+
+        # O worker reconecta antes de o broker perceber que a conexão antiga caiu
+        new_writer = FakeWriter()
+        new = asyncio.create_task(broker.handle_client(client_stream(
+            {"op": "hello", "client": "w1"},
+            {"op": "group_add", "group": "sala", "channel": "specific.w1!a"},
+        ), new_writer))
+        await asyncio.sleep(0)
+        old_reader.feed_eof()
+        await old
+
+        self.assertIs(broker.clients["w1"], new_writer)
+        self.assertIn("specific.w1!a", broker.groups["sala"])
+        new.cancel()
+
+    async def test_delivery_to_backed_up_worker_is_dropped(self):
+        broker = Broker(max_buffer=1000)
+        writer = FakeWriter(buffered=5000)
+        task = asyncio.create_task(broker.handle_client(client_stream(
+            {"op": "hello", "client": "w1"},
+            {"op": "group_add", "group": "sala", "channel": "specific.w1!a"},
+        ), writer))
+        await asyncio.sleep(0)
+        broker.group_send("sala", {"type": "chat.message"})
+        self.assertEqual(broker.stats["dropped"], 1)
+        self.assertEqual(writer.data, [])
+        task.cancel()
+
+
+class MessageAdminSearchTests(TransactionTestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser("admin", password="x")
+        room = Room.objects.create(name="geral")
+        joao = User.objects.create(username="joaosilva", first_name="João")
+        ana = User.objects.create(username="ana")
+        self.by_author = Message.objects.create(user=joao, room=room, content="bom dia")
+        self.by_content = Message.objects.create(user=ana, room=room, content="oi joaosilva")
+        Message.objects.create(user=ana, room=room, content="nada a ver")
+        self.client.force_login(self.admin_user)
+
+    def test_search_matches_author_and_content(self):
+        response = self.client.get("/admin/chat/message/", {"q": "joaosilva"})
+        found = {message.id for message in response.context["cl"].result_list}
+        self.assertEqual(found, {self.by_author.id, self.by_content.id})
+
+    def test_search_does_not_change_search_fields(self):
+        model_admin = admin.site._registry[Message]
+        self.client.get("/admin/chat/message/", {"q": "joaosilva"})
+        self.assertEqual(
+            model_admin.search_fields, ("user__username", "user__first_name", "content")
+        )
+
+
+class MessageSearchTests(TransactionTestCase):
+    def setUp(self):
+        self.ana = User.objects.create(username="ana")
+        self.bia = User.objects.create(username="bia")
+        self.caio = User.objects.create(username="caio")
+        self.room = Room.objects.create(name="geral")
+        self.closed = Room.objects.create(name="fechada", is_active=False)
+        self.client.force_login(self.ana)
+
+    def search(self, q, **params):
+        response = self.client.get("/api/messages/search/", {"q": q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, data):
+        return [result["id"] for result in data["results"]]
+
+    def test_results_are_scoped_to_what_the_user_can_read(self):
+        in_room = Message.objects.create(user=self.bia, room=self.room, content="abacaxi na sala")
+        Message.objects.create(user=self.bia, room=self.closed, content="abacaxi escondido")
+        to_me = Message.objects.create(user=self.bia, user_to=self.ana, content="abacaxi pra ana")
+        from_me = Message.objects.create(user=self.ana, user_to=self.caio, content="abacaxi meu")
+        Message.objects.create(user=self.bia, user_to=self.caio, content="abacaxi dos outros")
+
+        for sort in ("rank", "recent"):
+            self.assertEqual(
+                set(self.ids(self.search("abacaxi", sort=sort))),
+                {in_room.id, to_me.id, from_me.id},
+            )
+
+    def test_cursor_continues_without_repeats(self):
+        expected = [
+            Message.objects.create(user=self.bia, room=self.room, content=f"banana {i}").id
+            for i in range(5)
+        ]
+        for sort in ("rank", "recent"):
+            seen, cursor = [], None
+            while True:
+                params = {"sort": sort, "limit": 2}
+                if cursor:
+                    params["cursor"] = cursor
+                data = self.search("banana", **params)
+                seen += self.ids(data)
+                cursor = data["next_cursor"]
+                if cursor is None:
+                    break
+            self.assertEqual(sorted(seen), expected)
+            if sort == "recent":
+                self.assertEqual(seen, expected[::-1])
+
+    def test_rank_only_scores_the_newest_window(self):
+        ids = [
+            Message.objects.create(user=self.bia, room=self.room, content=f"caju {i}").id
+            for i in range(5)
+        ]
+        with mock.patch("chat.search.RANK_WINDOW", 3):
+            self.assertEqual(set(self.ids(self.search("caju", sort="rank"))), set(ids[-3:]))
+            # sort=recent não tem janela
+            self.assertEqual(self.ids(self.search("caju", sort="recent")), ids[::-1])
+
+    def test_index_follows_updates_and_deletes(self):
+        msg = Message.objects.create(user=self.bia, room=self.room, content="goiaba madura")
+        self.assertEqual(self.ids(self.search("goiaba")), [msg.id])
+
+        msg.content = "pitanga madura"
+        msg.save()
+        self.assertEqual(self.ids(self.search("goiaba")), [])
+        self.assertEqual(self.ids(self.search("pitanga")), [msg.id])
+
+        Message.objects.filter(id=msg.id).delete()
+        self.assertEqual(self.ids(self.search("pitanga")), [])
+        self.assertEqual(self.ids(self.search("madura")), [])
+
+
+class RetentionTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral", retention_days=30)
+        Message.objects.create(user=self.user, room=self.room, content="antiga", client_key="k1")
+        self.old = timezone.now() - timedelta(days=90)
+        Message.objects.update(timestamp=self.old)
+        self.partition = retention.partition_name(self.old)
+        retention.clear_partitions_cache()
+
+    def tearDown(self):
+        with connection.cursor() as cursor:
+            for name in retention.list_partitions():
+                cursor.execute(f"DROP TABLE {name}")
+        retention.clear_partitions_cache()
+
+    def archive(self):
+        archiver = retention.Archiver(pause_ms=0)
+        return sum(archiver.archive(queryset) for _, queryset in archiver.scopes())
+
+    def test_archive_copies_columns_by_name(self):
+        # Partição de outra versão: colunas em outra ordem e sem client_key
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE {self.partition} AS SELECT content, timestamp, is_read, "
+                "user_to_id, user_id, room_id, id FROM chat_message WHERE 1 = 0"
+            )
+        retention.clear_partitions_cache()
+
+        self.assertEqual(self.archive(), 1)
+        page = retention.archived_page(retention.room_scope(self.room.id))
+        self.assertEqual([(msg.content, msg.client_key) for msg in page], [("antiga", "k1")])
+        self.assertFalse(Message.objects.exists())
+
+    def test_room_buffer_does_not_hide_archived_history(self):
+        Message.objects.all().delete()
+        for i in range(10):
+            old = Message.objects.create(user=self.user, room=self.room, content=f"old{i}")
+            Message.objects.filter(id=old.id).update(timestamp=self.old + timedelta(minutes=i))
+        new = [
+            Message.objects.create(user=self.user, room=self.room, content=f"new{i}")
+            for i in range(10)
+        ]
+        self.assertEqual(self.archive(), 10)
+        recent_messages.rooms.pop(self.room.id, None)
+
+        # Sala com menos mensagens vivas que o buffer: a página antes de new3 continua no arquivo
+        self.client.force_login(self.user)
+        response = self.client.get(
+            f"/api/messages/room/{self.room.id}/", {"before": new[3].id, "limit": 10}
+        )
+        self.assertEqual(
+            [row["content"] for row in response.json()],
+            [f"old{i}" for i in range(3, 10)] + ["new0", "new1", "new2"],
+        )
+        recent_messages.rooms.pop(self.room.id, None)
+
+    def test_partition_list_is_cached_until_archive_creates_one(self):
+        self.assertEqual(retention.list_partitions(), [])
+        with self.assertNumQueries(0):
+            retention.list_partitions()
+
+        self.archive()
+        self.assertEqual(retention.list_partitions(), [self.partition])
+
+
+class RoomUpdatedTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+
+    def deactivate(self):
+        self.room.is_active = False
+        self.room.save()
+
+    async def test_deactivated_room_closes_connected_sockets(self):
+        socket = await connect(self.user, self.room.id)
+        self.assertTrue(room_cache.get(self.room.id).is_active)
+
+        await database_sync_to_async(self.deactivate)()
+        closed = await receive_type(socket, "room_closed")
+        self.assertEqual(closed["room_id"], self.room.id)
+        self.assertEqual((await socket.receive_output(timeout=1))["type"], "websocket.close")
+
+        # O cache foi descartado: a sala já aparece desativada e novas conexões são recusadas
+        self.assertFalse((await room_cache.aget(self.room.id)).is_active)
+        retry = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/chat/room/{self.room.id}/")
+        retry.scope["user"] = self.user
+        retry.scope["url_route"] = {"kwargs": {"room_id": str(self.room.id)}}
+        connected, _ = await retry.connect()
+        self.assertFalse(connected)
+
+
+class RoomDetailTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+        for i in range(5):
+            Message.objects.create(room=self.room, user=self.user, content=f"msg{i}")
+        self.client.force_login(self.user)
+        session = self.client.session
+        session["room_id"] = self.room.id
+        session.save()
+        self.url = f"/room/{self.room.id}/"
+        room_cache.invalidate()
+        recent_messages.rooms.pop(self.room.id, None)
+        retention.clear_partitions_cache()
+
+    def tearDown(self):
+        recent_messages.rooms.pop(self.room.id, None)
+
+    def test_cold_and_warm_render_queries(self):
+        # Frio: sessão, usuário, carga das salas, últimas mensagens da sala e, como
+        # ela tem menos de SIZE linhas, a lista das partições de arquivo (vazia)
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [row["content"] for row in response.context["messages"]],
+            [f"msg{i}" for i in range(5)],
+        )
+        # Quente: só sessão e usuário; sala e mensagens vêm da memória
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.context["messages"]), 5)
+
+    async def test_room_updated_event_invalidates_room_cache(self):
+        socket = await connect(self.user, self.room.id)
+        self.assertEqual(room_cache.get(self.room.id).name, "geral")
+        # update() não dispara post_save: como uma alteração feita em outro worker
+        await database_sync_to_async(
+            lambda: Room.objects.filter(id=self.room.id).update(name="nova")
+        )()
+        self.assertEqual(room_cache.get(self.room.id).name, "geral")
+
+        invalidations = room_cache.stats["invalidations"]
+        await database_sync_to_async(notify_room_updated)(self.room.id, True)
+        for _ in range(100):
+            if room_cache.stats["invalidations"] > invalidations:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNone(room_cache.rooms)
+        self.assertEqual((await room_cache.aget(self.room.id)).name, "nova")
+        await socket.disconnect()
+
+
+class RecentMessagesMemoryTests(TransactionTestCase):
+    ROOMS = range(1000, 1050)
+
+    def tearDown(self):
+        for room_id in self.ROOMS:
+            recent_messages.rooms.pop(room_id, None)
+
+    @override_settings(CHAT_RECENT_MESSAGES={"SIZE": 20, "TTL": 0})
+    def test_buffers_stay_bounded_and_idle_rooms_are_evicted(self):
+        for room_id in self.ROOMS:
+            recent_messages.attach(room_id)
+        message_id = 0
+        for _ in range(500):
+            for room_id in self.ROOMS:
+                message_id += 1
+                recent_messages.record(room_id, {
+                    "id": message_id,
+                    "room_id": room_id,
+                    "user_id": 1,
+                    "username": "ana",
+                    "content": "x" * 100,
+                    "timestamp_ms": message_id,
+                    "is_read": False,
+                    "client_key": None,
+                }, None)
+
+        for room_id in self.ROOMS:
+            buffer = recent_messages.rooms[room_id]
+            self.assertEqual(len(buffer.ids), 20)
+            self.assertEqual(len(buffer.rows), 20)
+            self.assertEqual(len(buffer.payloads), 20)
+            self.assertEqual(buffer.ids[-1], message_id - self.ROOMS[-1] + room_id)
+
+        # Sem sockets e com o TTL vencido, a próxima inscrição varre as salas ociosas
+        for room_id in self.ROOMS[1:]:
+            recent_messages.detach(room_id)
+        recent_messages.attach(self.ROOMS[0])
+        self.assertEqual([room for room in recent_messages.rooms if room in self.ROOMS], [1000])
+        # Eventos de salas sem buffer não recriam o buffer
+        recent_messages.record(1001, {"id": message_id + 1}, None)
+        self.assertNotIn(1001, recent_messages.rooms)
+
+
+class HotPathInstrumentationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="ana")
+        self.room = Room.objects.create(name="geral")
+
+    def tearDown(self):
+        recent_messages.rooms.pop(self.room.id, None)
+        metrics.clear()
+
+    @override_settings(CHAT_TRACING={"SAMPLE_RATE": 0, "FILE": None, "FLUSH_MS": 1000})
+    async def test_unsampled_send_path_makes_no_tracing_calls(self):
+        socket = await connect(self.user, self.room.id)
+        with (
+            mock.patch("chat.tracing.Trace") as trace,
+            mock.patch.object(tracer, "record") as record,
+            mock.patch.object(tracer, "delivered") as delivered,
+            mock.patch.object(tracer, "schedule_flush") as schedule_flush,
+            mock.patch("chat.tracing.random.random") as random,
+        ):
+            await socket.send_to(text_data=json.dumps({"message": "oi"}))
+            await receive_type(socket, "room")
+        await socket.disconnect()
+        for call in (trace, record, delivered, schedule_flush, random):
+            call.assert_not_called()
+
+    @override_settings(CHAT_METRICS={"ENABLED": True})
+    async def test_send_path_metrics_are_plain_increments(self):
+        socket = await connect(self.user, self.room.id)
+        with mock.patch("chat.metrics.service_stats") as service_stats:
+            await socket.send_to(text_data=json.dumps({"message": "oi"}))
+            await receive_type(socket, "room")
+        await socket.disconnect()
+        # Os get_stats() dos serviços (alguns consultam o banco) só rodam na coleta
+        service_stats.assert_not_called()
+        self.assertEqual(metrics.received.values[("room",)], 1)
+        self.assertGreaterEqual(metrics.frames_sent.values[()], 1)
+
+    @override_settings(CHAT_METRICS={"ENABLED": True})
+    def test_hot_path_metrics_take_no_locks_or_queries(self):
+        # Sem banco nem locks: cada ponto de medida só soma em dicionários do processo
+        lock_types = (type(threading.Lock()), type(threading.RLock()))
+        for obj in (metrics, *metrics.metrics):
+            self.assertFalse(any(isinstance(value, lock_types) for value in vars(obj).values()))
+        with self.assertNumQueries(0):
+            for _ in range(1000):
+                metrics.message_received("room")
+                metrics.group_sent("room", f"chat_room_{self.room.id}")
+                metrics.frame_sent()
+        self.assertEqual(metrics.received.values[("room",)], 1000)
+
+
+class ConversationUpkeepTests(TransactionTestCase):
+    FIELDS = ("user_a", "user_b", "last_message", "last_timestamp", "unread_a", "unread_b")
+
+    def setUp(self):
+        self.ana = User.objects.create(username="ana")
+        self.bia = User.objects.create(username="bia")
+        self.caio = User.objects.create(username="caio")
+
+    def send_direct(self, *messages):
+        """Envia (remetente, destinatário, texto) pelos sockets de mensagens diretas."""
+
+        async def exchange():
+            sockets = {}
+            try:
+                for sender, recipient, text in messages:
+                    if sender.id not in sockets:
+                        sockets[sender.id] = await connect(sender)
+                    socket = sockets[sender.id]
+                    await socket.send_to(text_data=json.dumps(
+                        {"type": "direct", "message": text, "user_to_id": recipient.id}
+                    ))
+                    # O eco do próprio remetente sai depois da gravação
+                    await receive_type(socket, "direct")
+            finally:
+                for socket in sockets.values():
+                    await socket.disconnect()
+
+        async_to_sync(exchange)()
+
+    def rows(self):
+        return list(Conversation.objects.order_by("user_a", "user_b").values_list(*self.FIELDS))
+
+    def test_direct_messages_create_and_update_the_conversation(self):
+        self.send_direct((self.bia, self.ana, "oi"))
+        conversation = Conversation.objects.get()
+        first = Message.objects.get(content="oi")
+        self.assertEqual(
+            (conversation.user_a_id, conversation.user_b_id), (self.ana.id, self.bia.id)
+        )
+        self.assertEqual(conversation.last_message_id, first.id)
+        self.assertEqual((conversation.unread_a, conversation.unread_b), (1, 0))
+
+        # Em chamadas separadas: com o socket do destinatário aberto a mensagem já chega lida
+        self.send_direct((self.bia, self.ana, "tudo bem?"))
+        self.send_direct((self.ana, self.bia, "tudo"))
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_id, Message.objects.get(content="tudo").id)
+        self.assertEqual((conversation.unread_a, conversation.unread_b), (2, 1))
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_reading_clears_unread_count(self):
+        self.send_direct((self.bia, self.ana, "oi"), (self.bia, self.ana, "oi de novo"))
+        self.client.force_login(self.ana)
+        response = self.client.get(f"/api/messages/direct/{self.bia.id}/")
+        self.assertEqual(response.status_code, 200)
+        conversation = Conversation.objects.get()
+        self.assertEqual((conversation.unread_a, conversation.unread_b), (0, 0))
+        self.assertFalse(Message.objects.filter(is_read=False).exists())
+
+    def test_backfill_matches_live_upkeep(self):
+        self.send_direct(
+            (self.ana, self.bia, "1"),
+            (self.bia, self.ana, "2"),
+            (self.caio, self.ana, "3"),
+            (self.bia, self.caio, "4"),
+            (self.ana, self.bia, "5"),
+        )
+        self.client.force_login(self.bia)
+        self.client.get(f"/api/messages/direct/{self.ana.id}/")
+        live = self.rows()
+        self.assertEqual(len(live), 3)
+
+        Conversation.objects.all().delete()
+        backfill = importlib.import_module("chat.migrations.0009_backfill_conversations")
+        backfill.backfill_conversations(django_apps, None)
+        self.assertEqual(self.rows(), live)
+
+
+class ReceiptBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.ana = User.objects.create(username="ana")
+        self.bia = User.objects.create(username="bia")
+        self.messages = [
+            Message.objects.create(
+                user=self.bia, user_to=self.ana, content=f"m{i}", client_key=f"k{i}"
+            )
+            for i in range(4)
+        ]
+        record_direct_messages(self.messages)
+        self.updates = []
+
+    def capture(self, pending):
+        # Roda na thread do banco: captura as consultas da conexão daquela thread
+        with CaptureQueriesContext(connection) as queries:
+            marked = write_receipts(pending)
+        self.updates.extend(
+            query["sql"] for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "chat_message"')
+        )
+        return marked
+
+    def unread(self):
+        return Conversation.objects.get().unread_a
+
+    async def test_reads_of_one_pair_in_a_window_become_one_update(self):
+        buffer = receipts.ReceiptBuffer(flush_ms=60000)
+        first, second, third, _ = self.messages
+        # Duas abas da ana recebem as mesmas mensagens; uma confirmação só pela client_key
+        buffer.add(self.ana.id, self.bia.id, message_id=first.id)
+        buffer.add(self.ana.id, self.bia.id, message_id=second.id)
+        buffer.add(self.ana.id, self.bia.id, message_id=first.id)
+        buffer.add(self.ana.id, self.bia.id, message_id=second.id)
+        buffer.add(self.ana.id, self.bia.id, client_key=third.client_key)
+        self.assertEqual(await database_sync_to_async(self.unread)(), 4)
+
+        with mock.patch("chat.receipts.write_receipts", self.capture):
+            self.assertEqual(await buffer.flush(), 3)
+        self.assertEqual(len(self.updates), 1)
+        self.assertIn(' IN (', self.updates[0])
+        self.assertEqual(buffer.stats["updates"], 1)
+        self.assertEqual(await database_sync_to_async(self.unread)(), 1)
+        read = await database_sync_to_async(
+            lambda: set(Message.objects.filter(is_read=True).values_list("id", flat=True))
+        )()
+        self.assertEqual(read, {first.id, second.id, third.id})
+
+    async def test_shutdown_flush_persists_pending_receipts(self):
+        with override_settings(CHAT_READ_RECEIPTS={"FLUSH_MS": 60000}):
+            buffer = receipts.get_receipts()
+        try:
+            for msg in self.messages:
+                buffer.add(self.ana.id, self.bia.id, message_id=msg.id)
+            # O que o atexit chama: sem event loop, direto no banco
+            await database_sync_to_async(receipts.flush_all)()
+        finally:
+            receipts._buffers.pop(asyncio.get_running_loop(), None)
+        self.assertEqual(buffer.get_stats()["pending"], 0)
+        self.assertEqual(await database_sync_to_async(self.unread)(), 0)
+        self.assertFalse(
+            await database_sync_to_async(Message.objects.filter(is_read=False).exists)()
+        )
+
+
+class MultiplexConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.ana = User.objects.create(username="ana")
+        self.bia = User.objects.create(username="bia")
+        self.geral = Room.objects.create(name="geral")
+        self.random = Room.objects.create(name="random")
+        self.closed = Room.objects.create(name="fechada", is_active=False)
+
+    def tearDown(self):
+        for room in (self.geral, self.random):
+            recent_messages.rooms.pop(room.id, None)
+
+    async def multiplex(self, user):
+        communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def subscribe(self, socket, room_id):
+        await socket.send_to(text_data=json.dumps({"type": "subscribe", "room_id": room_id}))
+        return await receive_type(socket, "subscribed")
+
+    async def test_two_rooms_on_one_socket_then_leave_one(self):
+        socket = await self.multiplex(self.ana)
+        for room in (self.geral, self.random):
+            self.assertEqual((await self.subscribe(socket, room.id))["room_id"], room.id)
+        bia_geral = await connect(self.bia, self.geral.id)
+        bia_random = await connect(self.bia, self.random.id)
+
+        await bia_geral.send_to(text_data=json.dumps({"message": "na geral"}))
+        message = await receive_type(socket, "room")
+        self.assertEqual((message["room_id"], message["message"]), (self.geral.id, "na geral"))
+        await bia_random.send_to(text_data=json.dumps({"message": "no random"}))
+        message = await receive_type(socket, "room")
+        self.assertEqual((message["room_id"], message["message"]), (self.random.id, "no random"))
+        await receive_type(bia_random, "room")  # o eco da própria bia
+
+        # O envio pelo socket multiplexado vai para a sala indicada no frame
+        await socket.send_to(text_data=json.dumps(
+            {"type": "room", "room_id": self.random.id, "message": "oi random"}
+        ))
+        self.assertEqual((await receive_type(bia_random, "room"))["message"], "oi random")
+
+        await socket.send_to(text_data=json.dumps(
+            {"type": "unsubscribe", "room_id": self.geral.id}
+        ))
+        self.assertEqual((await receive_type(socket, "unsubscribed"))["room_id"], self.geral.id)
+        await bia_geral.send_to(text_data=json.dumps({"message": "ninguém ouve"}))
+        await bia_random.send_to(text_data=json.dumps({"message": "ainda no random"}))
+        # A próxima mensagem de sala que chega é a do random: a da geral não vem mais
+        message = await receive_type(socket, "room")
+        self.assertEqual(
+            (message["room_id"], message["message"]), (self.random.id, "ainda no random")
+        )
+
+        for communicator in (socket, bia_geral, bia_random):
+            await communicator.disconnect()
+
+    async def test_inaccessible_rooms_are_rejected(self):
+        socket = await self.multiplex(self.ana)
+        for room_id in (self.closed.id, 999999):
+            await socket.send_to(text_data=json.dumps({"type": "subscribe", "room_id": room_id}))
+            self.assertIn("error", await receive_type(socket, "error"))
+        # Sem inscrição, o socket também não envia para a sala
+        await self.subscribe(socket, self.geral.id)
+        await socket.send_to(text_data=json.dumps(
+            {"type": "room", "room_id": self.random.id, "message": "intrusa"}
+        ))
+        self.assertIn("error", await receive_type(socket, "error"))
+        self.assertFalse(
+            await database_sync_to_async(Message.objects.filter(content="intrusa").exists)()
+        )
+        await socket.disconnect()
+
+
+class AuthCacheInvalidationTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ana", password="senha-antiga")
+        self.client.force_login(self.user)
+        self.session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.cookie = f"{settings.SESSION_COOKIE_NAME}={self.session_key}"
+        auth_cache.clear()
+
+    def tearDown(self):
+        auth_cache.clear()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            CachedAuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+            "/ws/chat/direct/",
+            headers=[(b"cookie", self.cookie.encode())],
+        )
+        connected, _ = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected
+
+    async def assert_cached(self):
+        self.assertTrue(await self.connect())
+        hits = auth_cache.stats["hits"]
+        self.assertTrue(await self.connect())
+        self.assertEqual(auth_cache.stats["hits"], hits + 1)
+
+    async def test_deactivating_the_user_rejects_the_next_connect(self):
+        await self.assert_cached()
+
+        def deactivate():
+            self.user.is_active = False
+            self.user.save()
+
+        await database_sync_to_async(deactivate)()
+        self.assertFalse(await self.connect())
+
+    async def test_changing_the_password_rejects_the_next_connect(self):
+        await self.assert_cached()
+
+        def change_password():
+            self.user.set_password("senha-nova")
+            self.user.save()
+
+        await database_sync_to_async(change_password)()
+        self.assertFalse(await self.connect())
+
+    async def test_logout_rejects_the_next_connect(self):
+        await self.assert_cached()
+        await database_sync_to_async(self.client.logout)()
+        self.assertNotIn(self.session_key, auth_cache.sessions)
+        self.assertFalse(await self.connect())
+
+
+class SeederTests(TransactionTestCase):
+    def test_orm_and_raw_loads_keep_the_generated_timestamps(self):
+        seeder = Seeder(chunk=10, days=10)
+        user_ids = seeder.seed_users(3)
+        room_ids = seeder.seed_rooms(1)
+        field = Message._meta.get_field("timestamp")
+        for raw in (False, True):
+            seeder.raw = raw
+            Message.objects.all().delete()
+            seeder.seed_room_messages(25, room_ids, user_ids, hot_skew=0)
+            timestamps = list(Message.objects.order_by("id").values_list("timestamp", flat=True))
+            self.assertEqual(len(timestamps), 25)
+            # Espalhados pelos 10 dias, em ordem, e não todos no instante da carga
+            self.assertLess(timestamps[0], timezone.now() - timedelta(days=9))
+            self.assertEqual(timestamps, sorted(timestamps))
+        self.assertFalse(field.auto_now_add)
+
+
+class UserDirectoryTests(TransactionTestCase):
+    def setUp(self):
+        self.requester = User.objects.create(username="eu")
+        self.word = User.objects.create(username="joao_ana")
+        self.prefix = User.objects.create(username="anabela")
+        self.first_name = User.objects.create(username="xpto", first_name="Ana")
+        self.exact = User.objects.create(username="ana")
+        self.substring = User.objects.create(username="mariana")
+
+    def tearDown(self):
+        # O diretório do processo viu os usuários deste teste: começa de novo no próximo
+        user_directory.__init__()
+
+    def ids(self, results):
+        return [user["id"] for user in results]
+
+    def test_ranking_order(self):
+        directory = UserDirectory()
+        directory.build()
+        self.assertEqual(
+            self.ids(directory.lookup("ana", exclude=self.requester.id)),
+            [self.exact.id, self.first_name.id, self.prefix.id, self.word.id],
+        )
+
+    def test_substring_completes_index_results(self):
+        joao = User.objects.create(username="joaosilva")
+        # Tem os trigramas "sil", "ilv" e "lva", mas não o texto "silva"
+        User.objects.create(username="silvia_lva")
+        directory = UserDirectory()
+        directory.build()
+        with self.assertNumQueries(0):
+            # "silva" não é prefixo de nenhuma palavra: vem só dos trigramas
+            self.assertEqual(self.ids(directory.search(self.requester.id, "silva")), [joao.id])
+            # Os do índice primeiro, na ordem do ranking; depois o que só os trigramas acham
+            self.assertEqual(
+                self.ids(directory.search(self.requester.id, "ana")),
+                [
+                    self.exact.id,
+                    self.first_name.id,
+                    self.prefix.id,
+                    self.word.id,
+                    self.substring.id,
+                ],
+            )
+        self.assertEqual(directory.stats["substring_searches"], 2)
+
+    def test_substring_skips_renamed_and_removed_users(self):
+        directory = UserDirectory()
+        directory.build()
+        self.substring.username = "marina"
+        directory.update(self.substring)
+        self.assertEqual(directory.substring("riana"), [])
+        self.assertEqual(self.ids(directory.substring("arina")), [self.substring.id])
+
+        directory.discard(self.substring.id)
+        self.assertEqual(directory.substring("arina"), [])
+
+    def test_ranking_scans_at_most_scan_limit_keys(self):
+        # Chaves longas que vêm antes, em ordem alfabética, de um username mais curto
+        User.objects.bulk_create(
+            [User(username=f"ana{i:04d}") for i in range(directory_module.SCAN_LIMIT)]
+        )
+        short = User.objects.create(username="anaz")
+        directory = UserDirectory()
+        directory.build()
+        results = self.ids(directory.lookup("ana", exclude=self.requester.id))
+        # O igual ao texto nunca fica de fora do corte; "anaz" fica
+        self.assertEqual(results[0], self.exact.id)
+        self.assertNotIn(short.id, results)
+        self.assertIn(short.id, self.ids(directory.lookup("anaz")))
+
+    def test_user_created_in_process_is_searchable(self):
+        user_directory.build()
+        created = User.objects.create(username="novato")
+        self.assertEqual(self.ids(user_directory.lookup("nova")), [created.id])
+
+    def test_refresh_picks_up_users_from_other_workers(self):
+        directory = UserDirectory()
+        directory.build()
+        # bulk_create não dispara post_save, como um cadastro feito em outro worker
+        User.objects.bulk_create([User(username="remoto")])
+        self.assertEqual(directory.lookup("remoto"), [])
+
+        directory.refresh(ttl=0)
+        remote = User.objects.get(username="remoto")
+        self.assertEqual(self.ids(directory.lookup("remoto")), [remote.id])
+
+
+class DirectHistoryTests(TransactionTestCase):
+    def setUp(self):
+        self.ana = User.objects.create(username="ana")
+        self.bia = User.objects.create(username="bia")
+        other = User.objects.create(username="caio")
+        self.messages = []
+        for i in range(6):
+            sender, recipient = (self.ana, self.bia) if i % 2 else (self.bia, self.ana)
+            self.messages.append(
+                Message.objects.create(user=sender, user_to=recipient, content=f"dm{i}")
+            )
+            Message.objects.create(user=self.ana, user_to=other, content=f"outra{i}")
+
+    def test_pages_both_directions_of_the_conversation(self):
+        page = direct_history(self.ana, self.bia, before=self.messages[4].id, limit=3)
+        self.assertEqual([msg.content for msg in page], ["dm1", "dm2", "dm3"])
+        page = direct_history(self.bia, self.ana, after=self.messages[3].id, limit=10)
+        self.assertEqual([msg.content for msg in page], ["dm4", "dm5"])
+
+    def test_page_is_a_range_scan_without_sort(self):
+        cursor = self.messages[4]
+        queryset = (
+            direct_messages(self.ana, self.bia)
+            .filter(timestamp__lte=cursor.timestamp)
+            .filter(Q(timestamp__lt=cursor.timestamp) | Q(id__lt=cursor.id))
+            .order_by("-timestamp", "-id")
+        )
+        plan = queryset.explain()
+        self.assertIn("message_conversation_idx", plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+        self.assertNotIn("MULTI-INDEX OR", plan)
+
+
+@override_settings(CHAT_DB={"MODE": "executor", "WORKERS": 2})
+class DatabaseExecutorTests(TransactionTestCase):
+    def setUp(self):
+        self.ana = User.objects.create(username="ana")
+        self.bia = User.objects.create(username="bia")
+        self.room = Room.objects.create(name="geral")
+        self.threads = {}
+
+    def on_thread(self, name, func):
+        """Envolve func registrando em qual thread ela rodou."""
+
+        def wrapper(*args, **kwargs):
+            self.threads[name] = threading.current_thread().name
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    async def test_direct_message_save_runs_on_the_writer_thread(self):
+        record = self.on_thread("dm", record_direct_messages)
+        with mock.patch("chat.consumers.record_direct_messages", record):
+            socket = await connect(self.bia)
+            try:
+                await socket.send_to(text_data=json.dumps(
+                    {"type": "direct", "message": "oi", "user_to_id": self.ana.id}
+                ))
+                await receive_type(socket, "direct")
+            finally:
+                await socket.disconnect()
+        self.assertTrue(self.threads["dm"].startswith("chat-db-writer"))
+        self.assertTrue(await database_sync_to_async(Conversation.objects.exists)())
+
+    async def test_receipts_flush_on_the_writer_thread(self):
+        msg = await database_sync_to_async(Message.objects.create)(
+            user=self.bia, user_to=self.ana, content="oi", client_key="k"
+        )
+        buffer = receipts.ReceiptBuffer(flush_ms=60000)
+        buffer.add(self.ana.id, self.bia.id, message_id=msg.id)
+        with mock.patch("chat.receipts.write_receipts", self.on_thread("read", write_receipts)):
+            self.assertEqual(await buffer.flush(), 1)
+        self.assertTrue(self.threads["read"].startswith("chat-db-writer"))
+
+    async def test_resume_gap_is_read_on_the_reader_pool(self):
+        first = await database_sync_to_async(Message.objects.create)(
+            room=self.room, user=self.bia, content="antes"
+        )
+        await database_sync_to_async(Message.objects.create)(
+            room=self.room, user=self.bia, content="depois"
+        )
+        load_gap = self.on_thread("gap", recent_messages.load_gap)
+        # Buffer sem a lacuna: a retomada vai ao banco
+        with mock.patch.object(recent_messages, "since", return_value=None), \
+                mock.patch.object(recent_messages, "load_gap", load_gap):
+            socket = WebsocketCommunicator(
+                ChatConsumer.as_asgi(),
+                f"/ws/chat/room/{self.room.id}/?last_message_id={first.id}",
+            )
+            socket.scope["user"] = self.ana
+            socket.scope["url_route"] = {"kwargs": {"room_id": str(self.room.id)}}
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            try:
+                resume = await receive_type(socket, "resume")
+            finally:
+                await socket.disconnect()
+        self.assertEqual(resume["replayed"], 1)
+        self.assertTrue(self.threads["gap"].startswith("chat-db-reader"))
@@ -0,0 +1,183 @@
+import atexit
+import json
+import os
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from .metrics import Histogram
+
+"""
+    Rastreamento da latência de mensagens amostradas, do receive à escrita no socket:
+       -> Uma fração SAMPLE_RATE das mensagens recebidas vira um trace; as outras só
+          pagam um random()
+       -> Etapas no worker do remetente: "parse" (json.loads, validação e limite de
+          mensagens), "save" (save_* com o salto para a thread do banco) e "group_send"
+          (codificação do evento e group_send).
+          Frames rejeitados e de digitação/inscrição não geram etapas
+       -> O contexto (id e horários de relógio) viaja no evento do channel layer, então
+          o worker de cada destinatário, mesmo outro processo, mede "delivery" (do
+          group_send até o handler room_message/direct_message), "send" (fila de
+          saída e escrita no socket) e "total" (do receive à escrita)
+       -> Cada etapa alimenta o histograma chat_trace_stage_seconds (em /metrics) e,
+          com FILE, uma linha JSON por etapa é anexada ao arquivo (gravado em lotes a
+          cada FLUSH_MS; vários workers podem usar o mesmo arquivo)
+       -> Entre processos as etapas usam time.time(): relógios de hosts diferentes
+          precisam estar sincronizados
+    `python manage.py trace_report <arquivo>` resume o arquivo por etapa.
+"""
+
+DEFAULTS = {
+    "SAMPLE_RATE": 0.0,
+    "FILE": None,
+    "FLUSH_MS": 1000,
+}
+
+STAGES = ("parse", "save", "group_send", "delivery", "send", "total")
+
+# Segundos, começando abaixo do custo de um json.loads
+TRACE_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+    0.5, 1, 2.5,
+)
+
+
+def get_config():
+    config = dict(DEFAULTS)
+    config.update(getattr(settings, "CHAT_TRACING", {}))
+    return config
+
+
+class Trace:
+    """Etapas de uma mensagem no worker do remetente."""
+
+    __slots__ = ("id", "kind", "room_id", "started", "clock", "last")
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.room_id = None
+        self.started = time.time()
+        self.clock = self.last = time.perf_counter()
+
+    def mark(self, stage):
+        """Fecha a etapa que começou na marca anterior."""
+        now = time.perf_counter()
+        tracer.record(self, stage, self.started + (self.last - self.clock), now - self.last)
+        self.last = now
+
+    def context(self):
+        """O que vai no evento do channel layer para os workers dos destinatários."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "room_id": self.room_id,
+            "started": self.started,
+            "sent_at": self.started + (time.perf_counter() - self.clock),
+        }
+
+
+class Tracer:
+    def __init__(self):
+        self.rate = 0.0
+        self.path = None
+        self.flush_ms = DEFAULTS["FLUSH_MS"]
+        self.lines = []
+        self.lock = threading.Lock()
+        self.timer = None
+        self.stages = Histogram(
+            "chat_trace_stage_seconds",
+            "Latência por etapa das mensagens amostradas.",
+            TRACE_BUCKETS,
+            ("stage",),
+        )
+        self.stats = {"sampled": 0, "delivered": 0, "spans": 0, "lines_written": 0}
+        self.reload()
+
+    def reload(self):
+        """Relê CHAT_TRACING (na importação e quando os settings mudam)."""
+        self.flush()
+        config = get_config()
+        self.rate = config["SAMPLE_RATE"]
+        self.path = config["FILE"]
+        self.flush_ms = config["FLUSH_MS"]
+        return config
+
+    def start(self, kind):
+        """Começa um trace para a mensagem recebida, se ela cair na amostra."""
+        if not self.rate or random.random() >= self.rate:
+            return None
+        self.stats["sampled"] += 1
+        return Trace(kind)
+
+    def delivered(self, context, handled_at):
+        """Etapas do lado do destinatário, com o frame já escrito (o contexto veio no evento)."""
+        written_at = time.time()
+        self.stats["delivered"] += 1
+        self.record(context, "delivery", context["sent_at"], handled_at - context["sent_at"])
+        self.record(context, "send", handled_at, written_at - handled_at)
+        self.record(context, "total", context["started"], written_at - context["started"])
+
+    def record(self, trace, stage, started, seconds):
+        self.stats["spans"] += 1
+        # Relógios de processos diferentes podem dar alguns µs negativos
+        self.stages.observe(max(seconds, 0.0), stage)
+        if self.path:
+            if isinstance(trace, dict):
+                trace_id, kind, room_id = trace["id"], trace["kind"], trace["room_id"]
+            else:
+                trace_id, kind, room_id = trace.id, trace.kind, trace.room_id
+            line = json.dumps(
+                {
+                    "trace": trace_id,
+                    "stage": stage,
+                    "kind": kind,
+                    "room_id": room_id,
+                    "start": round(started, 6),
+                    "ms": round(seconds * 1000, 3),
+                    "pid": os.getpid(),
+                },
+                separators=(",", ":"),
+            )
+            with self.lock:
+                self.lines.append(line)
+            self.schedule_flush()
+
+    def schedule_flush(self):
+        if self.timer is not None:
+            return
+        timer = threading.Timer(self.flush_ms / 1000, self.flush)
+        timer.daemon = True
+        self.timer = timer
+        timer.start()
+
+    def flush(self):
+        with self.lock:
+            lines, self.lines = self.lines, []
+            self.timer = None
+        if not lines or not self.path:
+            return
+        # Um único write com O_APPEND: as linhas de workers diferentes não se misturam
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, ("\n".join(lines) + "\n").encode())
+        finally:
+            os.close(fd)
+        self.stats["lines_written"] += len(lines)
+
+    def get_stats(self):
+        return {**self.stats, "pending_lines": len(self.lines)}
+
+
+tracer = Tracer()
+atexit.register(tracer.flush)
+
+
+@receiver(setting_changed)
+def reload_tracing(setting, **kwargs):
+    if setting == "CHAT_TRACING":
+        tracer.reload()
@@ -18,5 +18,22 @@ urlpatterns = [
     # APIs
     path("api/search-users/", views.search_users, name="search_users"),
     path("api/conversations/", views.get_conversations, name="get_conversations"),
+    path("api/messages/search/", views.search_messages, name="search_messages"),
+    path("api/messages/room/<int:room_id>/", views.get_room_messages, name="get_room_messages"),
     path("api/messages/direct/<int:user_id>/", views.get_direct_messages, name="get_direct_messages"),
+    path(
+        "api/messages/room/<int:room_id>/export/",
+        views.export_room_messages,
+        name="export_room_messages",
+    ),
+    path(
+        "api/messages/direct/<int:user_id>/export/",
+        views.export_direct_messages,
+        name="export_direct_messages",
+    ),
+    path("api/presence/rooms/", views.get_rooms_presence, name="get_rooms_presence"),
+    path("api/presence/room/<int:room_id>/", views.get_room_presence, name="get_room_presence"),
+    path("api/presence/users/", views.get_users_presence, name="get_users_presence"),
+    # Métricas (sem barra no fim: caminho padrão do Prometheus)
+    path("metrics", views.metrics_view, name="metrics"),
 ]
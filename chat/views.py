@@ -2,11 +2,26 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
 from django.contrib.auth.models import User
-from django.db.models import Q, Max
-from .models import Room, Message
+from django.db import transaction
+from .models import Message
+from .conversations import inbox, mark_conversation_read
+from .directory import user_directory
+from .metrics import CONTENT_TYPE, metrics
+from .presence import presence
+from .recent import message_row, recent_messages, serialize_rows
+from .rooms import room_cache
+from . import export, search
 from .forms import SignUpForm, SignInForm
+from .pagination import (
+    InvalidCursor,
+    parse_page_params,
+    room_history,
+    direct_history,
+    serialize_history,
+)
 
 
 def signup_view(request):
@@ -59,7 +74,7 @@ def logout_view(request):
 
 @login_required(login_url="chat:signin")
 def room_list(request):
-    rooms = Room.objects.filter(is_active=True)
+    rooms = room_cache.active_rooms()
     return render(request, "chat/room_list.html", {"rooms": rooms})
 
 
@@ -72,14 +87,19 @@ def join_room(request, room_id):
 
 @login_required(login_url="chat:signin")
 def room_detail(request, room_id):
-    room = get_object_or_404(Room, id=room_id, is_active=True)
+    room = room_cache.get_active(room_id)
+    if room is None:
+        raise Http404("Sala não encontrada.")
 
     if request.session.get("room_id") != room_id:
         messages.warning(request, "Por favor, entre na sala primeiro.")
         return redirect("chat:join_room", room_id=room_id)
 
-    # Carrega o histórico de mensagens da sala (últimas 50 mensagens)
-    message_history = room.messages.order_by("timestamp")[:50]
+    # Últimas 50 mensagens, em ordem cronológica: do buffer em memória da sala
+    # (chat/recent.py) e, se ele não cobrir a página, do banco
+    message_history = recent_messages.history(room.id, limit=50)
+    if message_history is None:
+        message_history = [message_row(msg) for msg in room_history(room, limit=50)]
 
     return render(
         request,
@@ -109,93 +129,166 @@ def search_users(request):
     if not query:
         return JsonResponse([], safe=False)
 
-    users = User.objects.filter(
-        Q(username__icontains=query) | Q(first_name__icontains=query)
-    ).exclude(id=request.user.id)[:10]
-
-    users_data = [
-        {
-            "id": user.id,
-            "username": user.username,
-            "first_name": user.first_name or user.username,
-        }
-        for user in users
-    ]
+    # Índice em memória (chat/directory.py): sem consulta ao banco com o índice carregado
+    users_data = user_directory.search(request.user.id, query, limit=10)
 
     return JsonResponse(users_data, safe=False)
 
 
 @login_required(login_url="chat:signin")
 def get_conversations(request):
-    # Buscar todas as mensagens diretas do usuário
-    messages_query = Message.objects.filter(
-        Q(user=request.user, user_to__isnull=False) | Q(user_to=request.user)
-    ).select_related("user", "user_to")
-
-    # Agrupar por usuário e pegar a última mensagem
-    conversations = {}
-    for msg in messages_query:
-        other_user = msg.user_to if msg.user == request.user else msg.user
-
-        if other_user.id not in conversations:
-            conversations[other_user.id] = {
+    # Uma única consulta na tabela desnormalizada de conversas
+    conversations_list = []
+    for conv in inbox(request.user):
+        other_user = conv.other_user(request.user)
+        unread_count = conv.unread_for(request.user)
+        conversations_list.append(
+            {
                 "user_id": other_user.id,
                 "username": other_user.username,
                 "first_name": other_user.first_name or other_user.username,
-                "last_message": msg.content[:50],
-                "timestamp": msg.timestamp,
-                "has_unread": False,
+                "last_message": conv.last_message.content[:50] if conv.last_message else "",
+                "timestamp": conv.last_timestamp.isoformat(),
+                "has_unread": unread_count > 0,
+                "unread_count": unread_count,
             }
-        else:
-            # Atualizar se esta mensagem for mais recente
-            if msg.timestamp > conversations[other_user.id]["timestamp"]:
-                conversations[other_user.id]["last_message"] = msg.content[:50]
-                conversations[other_user.id]["timestamp"] = msg.timestamp
+        )
 
-        # Verificar se há mensagens não lidas
-        if msg.user_to == request.user and not msg.is_read:
-            conversations[other_user.id]["has_unread"] = True
+    return JsonResponse(conversations_list, safe=False)
 
-    conversations_list = list(conversations.values())
-    conversations_list.sort(key=lambda x: x["timestamp"], reverse=True)
 
-    for conv in conversations_list:
-        conv["timestamp"] = conv["timestamp"].isoformat()
+@login_required(login_url="chat:signin")
+def get_room_messages(request, room_id):
+    room = room_cache.get_active(room_id)
+    if room is None:
+        raise Http404("Sala não encontrada.")
 
-    return JsonResponse(conversations_list, safe=False)
+    try:
+        before, after, limit = parse_page_params(request.GET)
+        # Página mais recente ou 'before' dentro do buffer: sem consulta ao banco
+        if after is None:
+            rows = recent_messages.history(room.id, before, limit)
+            if rows is not None:
+                return JsonResponse(serialize_rows(rows), safe=False)
+        messages_query = room_history(room, before, after, limit)
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse(serialize_history(messages_query), safe=False)
 
 
 @login_required(login_url="chat:signin")
 def get_direct_messages(request, user_id):
     other_user = get_object_or_404(User, id=user_id)
 
-    # Buscar mensagens entre os dois usuários
-    messages_query = (
+    # Buscar mensagens entre os dois usuários (página mais recente ou a partir do cursor)
+    try:
+        before, after, limit = parse_page_params(request.GET, default_limit=100)
+        messages_query = direct_history(request.user, other_user, before, after, limit)
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Marcar mensagens como lidas
+    with transaction.atomic():
         Message.objects.filter(
-            (
-                Q(user=request.user, user_to=other_user)
-                | Q(user=other_user, user_to=request.user)
-            )
+            user=other_user, user_to=request.user, is_read=False
+        ).update(is_read=True)
+        mark_conversation_read(request.user.id, other_user.id)
+
+    return JsonResponse(serialize_history(messages_query), safe=False)
+
+
+@login_required(login_url="chat:signin")
+def export_room_messages(request, room_id):
+    room = room_cache.get_active(room_id)
+    if room is None:
+        raise Http404("Sala não encontrada.")
+
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in export.CONTENT_TYPES:
+        return JsonResponse({"error": "Formato inválido: use ndjson ou csv."}, status=400)
+    return export.export_response(export.room_source(room), fmt, f"sala-{room.id}")
+
+
+@login_required(login_url="chat:signin")
+def export_direct_messages(request, user_id):
+    other_user = get_object_or_404(User, id=user_id)
+
+    fmt = request.GET.get("format", "ndjson")
+    if fmt not in export.CONTENT_TYPES:
+        return JsonResponse({"error": "Formato inválido: use ndjson ou csv."}, status=400)
+    return export.export_response(
+        export.direct_source(request.user, other_user), fmt, f"conversa-{other_user.username}"
+    )
+
+
+@login_required(login_url="chat:signin")
+def search_messages(request):
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return JsonResponse({"results": [], "next_cursor": None})
+
+    try:
+        limit = int(request.GET.get("limit") or search.DEFAULT_LIMIT)
+    except ValueError:
+        return JsonResponse({"error": "Parâmetros de paginação inválidos."}, status=400)
+
+    try:
+        results, next_cursor = search.search_messages(
+            request.user,
+            query,
+            sort=request.GET.get("sort", "rank"),
+            cursor=request.GET.get("cursor") or None,
+            limit=limit,
         )
-        .select_related("user")
-        .order_by("timestamp")[:100]
+    except InvalidCursor as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    return JsonResponse({"results": results, "next_cursor": next_cursor})
+
+
+# Presença: visão deste processo somada à dos outros workers (heartbeat)
+MAX_PRESENCE_IDS = 200
+
+
+@login_required(login_url="chat:signin")
+def get_rooms_presence(request):
+    room_ids = [room.id for room in room_cache.active_rooms()]
+    counts = presence.room_counts(room_ids)
+    return JsonResponse(
+        [{"room_id": room_id, "online": counts[room_id]} for room_id in room_ids], safe=False
     )
 
-    # Marcar mensagens como lidas
-    Message.objects.filter(user=other_user, user_to=request.user, is_read=False).update(
-        is_read=True
+
+@login_required(login_url="chat:signin")
+def get_room_presence(request, room_id):
+    room = room_cache.get_active(room_id)
+    if room is None:
+        raise Http404("Sala não encontrada.")
+
+    online = sorted(presence.online_users(room.id))
+    return JsonResponse(
+        {"room_id": room.id, "online": len(online), "user_ids": online[:MAX_PRESENCE_IDS]}
     )
 
-    messages_data = [
-        {
-            "id": msg.id,
-            "user_id": msg.user.id,
-            "username": msg.user.username,
-            "content": msg.content,
-            "timestamp": msg.timestamp.isoformat(),
-            "is_read": msg.is_read,
-        }
-        for msg in messages_query
-    ]
-
-    return JsonResponse(messages_data, safe=False)
+
+@login_required(login_url="chat:signin")
+def get_users_presence(request):
+    try:
+        user_ids = [int(value) for value in request.GET.get("ids", "").split(",") if value]
+    except ValueError:
+        return JsonResponse({"error": "Lista de ids inválida."}, status=400)
+
+    online = presence.is_online(user_ids[:MAX_PRESENCE_IDS])
+    return JsonResponse({str(user_id): is_online for user_id, is_online in online.items()})
+
+
+def metrics_view(request):
+    # Sem login: quem coleta é o Prometheus (com TOKEN, pelo header Authorization)
+    if not metrics.enabled:
+        raise Http404
+    if metrics.token and not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {metrics.token}"
+    ):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type=CONTENT_TYPE)
@@ -17,12 +17,16 @@ django_asgi_app = get_asgi_application()
 
 # Importa após inicializar o Django
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
+from chat.auth import CachedAuthMiddlewareStack
+from chat.outbound import WriteBufferMiddleware
 from chat.routing import websocket_urlpatterns
 
-application = ProtocolTypeRouter(
-    {
-        "http": django_asgi_app,
-        "websocket": AuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
-    }
+# WriteBufferMiddleware fica por fora: só ele recebe o send original do servidor
+application = WriteBufferMiddleware(
+    ProtocolTypeRouter(
+        {
+            "http": django_asgi_app,
+            "websocket": CachedAuthMiddlewareStack(URLRouter(websocket_urlpatterns)),
+        }
+    )
 )
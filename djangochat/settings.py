@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Latência e consultas por view; sai da pilha com CHAT_METRICS desligado
+    "chat.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -73,7 +76,115 @@ WSGI_APPLICATION = "djangochat.wsgi.application"
 ASGI_APPLICATION = "djangochat.asgi.application"
 
 # Channels
-CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+# "memory": um único processo (padrão)
+# "broker": vários workers no mesmo host, via `python manage.py chat_broker`
+CHAT_CHANNEL_LAYER = os.environ.get("CHAT_CHANNEL_LAYER", "memory")
+
+if CHAT_CHANNEL_LAYER == "broker":
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "chat.layers.BrokerChannelLayer",
+            "CONFIG": {
+                "path": os.environ.get("CHAT_BROKER_PATH", "/tmp/djangochat-broker.sock")
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+# Persistência das mensagens: "direct" (um INSERT por mensagem) ou "batched" (write-behind em lote)
+CHAT_PERSISTENCE = {
+    "MODE": "direct",
+    "BATCH_SIZE": 200,
+    "BATCH_WINDOW_MS": 20,
+    "MAX_PENDING": 10000,
+}
+
+# Cache de salas do processo (segundos até recarregar a tabela Room nos outros workers)
+CHAT_ROOM_CACHE = {"TTL": 30}
+
+# Confirmações de leitura das mensagens diretas, gravadas em lote a cada FLUSH_MS
+CHAT_READ_RECEIPTS = {"FLUSH_MS": 50}
+
+# Presença e digitação: eventos agregados a cada TICK_MS, heartbeat entre workers
+CHAT_PRESENCE = {
+    "TICK_MS": 250,
+    "HEARTBEAT": 5,
+    "EXPIRY": 15,
+    "TYPING_TTL": 3,
+    "MAX_DELTA": 50,
+    "LARGE_ROOM": 1000,
+    "LARGE_TICK_MS": 2000,
+}
+
+# Fila de saída por socket: tamanho máximo e política com a fila cheia
+# ("drop_oldest", "coalesce" ou "disconnect"; ver chat/outbound.py)
+CHAT_OUTBOUND = {
+    "MAX_QUEUE": 256,
+    "POLICY": "drop_oldest",
+    "SEND_TIMEOUT": 30,
+    "CLOSE_CODE": 4008,
+    "HIGH_WATER": 65536,
+    "POLL_MS": 10,
+}
+
+# Últimas mensagens de cada sala em memória: room_detail, API de histórico e retomada
+# após reconexão (chat/recent.py)
+CHAT_RECENT_MESSAGES = {"SIZE": 200, "MAX_REPLAY": 200, "TTL": 30}
+
+# Diretório de usuários em memória da busca de usuários (ver chat/directory.py)
+CHAT_USER_DIRECTORY = {"TTL": 60, "REBUILD": 3600, "RESULT_TTL": 5, "MAX_CACHED": 10000}
+
+# Limite de mensagens por token bucket (fichas por segundo e rajada) por conexão,
+# usuário e sala; sincronizado entre workers a cada SYNC_MS (ver chat/ratelimit.py).
+# Desligado: CHAT_RATE_LIMIT=1 no ambiente liga com os limites abaixo
+CHAT_RATE_LIMIT = {
+    "ENABLED": os.environ.get("CHAT_RATE_LIMIT") == "1",
+    "CONNECTION_RATE": 5,
+    "CONNECTION_BURST": 10,
+    "TYPING_RATE": 1,
+    "TYPING_BURST": 5,
+    "USER_RATE": 10,
+    "USER_BURST": 20,
+    "ROOM_RATE": 100,
+    "ROOM_BURST": 200,
+    "SYNC_MS": 500,
+}
+
+# Autenticação dos WebSockets com cache de sessão e usuário (segundos) e leituras em
+# lote nos misses; ENABLED False volta ao AuthMiddlewareStack (ver chat/auth.py)
+CHAT_AUTH_CACHE = {
+    "ENABLED": True,
+    "SESSION_TTL": 30,
+    "USER_TTL": 30,
+    "MAX_CACHED": 10000,
+    "MAX_BATCH": 500,
+}
+
+# Métricas no formato do Prometheus em GET /metrics (ver chat/metrics.py); desligadas,
+# os pontos de medida não custam nada e /metrics responde 404
+CHAT_METRICS = {
+    "ENABLED": os.environ.get("CHAT_METRICS") == "1",
+    "TOKEN": os.environ.get("CHAT_METRICS_TOKEN"),
+}
+
+# Rastreamento de latência por etapa de uma fração das mensagens (SAMPLE_RATE 0.01 = 1%);
+# com FILE os workers anexam as etapas ao arquivo (ver chat/tracing.py e `manage.py trace_report`)
+CHAT_TRACING = {
+    "SAMPLE_RATE": float(os.environ.get("CHAT_TRACE_SAMPLE", 0)),
+    "FILE": os.environ.get("CHAT_TRACE_FILE"),
+    "FLUSH_MS": 1000,
+}
+
+# Retenção: dias até as mensagens irem para as tabelas de arquivo (None: nunca).
+# Room.retention_days sobrepõe ROOM_DAYS; ver chat/retention.py e `manage.py archive_messages`
+CHAT_RETENTION = {
+    "ROOM_DAYS": None,
+    "DIRECT_DAYS": None,
+    "CHUNK": 1000,
+    "PAUSE_MS": 50,
+    "PARTITIONS_TTL": 60,
+}
 
 
 # Database
@@ -86,6 +197,37 @@ DATABASES = {
     }
 }
 
+# SQLite para muitos workers/consumers simultâneos: "default" ou "concurrent"
+# (WAL, pragmas, conexões persistentes e uma thread escritora; ver chat/database.py)
+CHAT_SQLITE = {
+    "MODE": os.environ.get("CHAT_SQLITE_MODE", "default"),
+    "PRAGMAS": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,
+        "cache_size": -65536,
+        "temp_store": "MEMORY",
+    },
+    "CONN_MAX_AGE": 600,
+}
+
+if CHAT_SQLITE["MODE"] == "concurrent":
+    DATABASES["default"].update({
+        "CONN_MAX_AGE": CHAT_SQLITE["CONN_MAX_AGE"],
+        "CONN_HEALTH_CHECKS": True,
+        # BEGIN IMMEDIATE: a transação pega o lock de escrita logo no início e espera
+        # pelo busy_timeout, em vez de falhar ao tentar promover um lock de leitura
+        "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+    })
+
+# Caminho dos consumers até o banco: "sync", "async" (ORM assíncrono) ou "executor"
+# (threads próprias com conexões persistentes, WORKERS para leituras; ver chat/database.py)
+CHAT_DB = {
+    "MODE": os.environ.get("CHAT_DB_MODE", "sync"),
+    "WORKERS": int(os.environ.get("CHAT_DB_WORKERS", 4)),
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators